@@ -0,0 +1,412 @@
+"""
+Persistent positional inverted index over the tokens of a whole corpus.
+
+The index is a directory of segments; each `CorpusIndex.add` writes a new segment, so that a large
+corpus can be indexed incrementally. A segment holds:
+
+- the sorted vocabulary of the segment, as a string table;
+- for each term, the positions of its occurrences, delta-encoded and packed as variable-length integers;
+- the term id of every token (used to print the context of a hit);
+- the documents of the segment, with their first token, and the citations of each document,
+  as runs of tokens sharing the same cite.
+
+All the arrays are saved as `.npy` files and memory-mapped when the index is opened: queries read
+only the postings of the query word and the tokens around each hit.
+
+Removed and superseded documents stay in their segment until `CorpusIndex.compact` rewrites the live
+documents in a single segment.
+"""
+
+import json
+import os
+import re
+import shutil
+
+import numpy as np
+
+from .text import ConcordanceLine
+from .utils import pack_strings, StringTable
+
+
+_INDEX_VERSION = 1
+_MANIFEST = "index.json"
+_SEGMENT_NAME = re.compile(r"seg_(\d+)$")
+
+
+def encode_varints(values):
+    """
+    Pack unsigned integers as little-endian base-128 varints (7 bits per byte, high bit set on
+    all the bytes of a number but the last).
+
+    Parameters
+    ----------
+    values : numpy.ndarray
+        unsigned integers
+
+    Returns
+    -------
+    tuple : (numpy.ndarray, numpy.ndarray)
+        the `uint8` buffer and the number of bytes used by each value
+    """
+    v = np.asarray(values, dtype=np.uint64)
+    nbytes = np.ones(len(v), dtype=np.int64)
+    for k in range(1, 10):
+        nbytes += v >= np.uint64(1 << (7 * k))
+    starts = np.cumsum(nbytes) - nbytes
+    out = np.empty(int(nbytes.sum()), dtype=np.uint8)
+    for j in range(int(nbytes.max()) if len(v) else 0):
+        sel = nbytes > j
+        chunk = (v[sel] >> np.uint64(7 * j)) & np.uint64(0x7f)
+        more = (nbytes[sel] > j + 1).astype(np.uint64) << np.uint64(7)
+        out[starts[sel] + j] = chunk | more
+    return out, nbytes
+
+
+def decode_varints(buf):
+    """Inverse of `encode_varints`; returns a `uint64` array"""
+    b = np.asarray(buf, dtype=np.uint8)
+    ends = np.flatnonzero(b < 0x80)
+    starts = np.concatenate(([0], ends[:-1] + 1))
+    values = np.zeros(len(ends), dtype=np.uint64)
+    for j in range(int((ends - starts).max()) + 1 if len(ends) else 0):
+        idx = starts + j
+        sel = idx <= ends
+        values[sel] |= (b[idx[sel]] & 0x7f).astype(np.uint64) << np.uint64(7 * j)
+    return values
+
+
+def _save_strings(folder, name, strings):
+    blob, offsets = pack_strings(strings)
+    np.save(os.path.join(folder, name + ".npy"), np.frombuffer(blob, dtype=np.uint8))
+    np.save(os.path.join(folder, name + "_offsets.npy"), offsets)
+
+
+class _Segment:
+    """A segment of the index, memory-mapped from its folder"""
+
+    def __init__(self, folder, meta, base):
+        def load(name):
+            return np.load(os.path.join(folder, name + ".npy"), mmap_mode="r")
+
+        self.base = base
+        self.docs = meta["docs"]
+        self.terms = StringTable(load("terms"), load("terms_offsets"))
+        self.cites = StringTable(load("cites"), load("cites_offsets"))
+        self.postings = load("postings")
+        self.posting_offsets = load("posting_offsets")
+        self.counts = load("counts")
+        self.tokens = load("tokens")
+        self.doc_starts = load("doc_starts")
+        self.run_starts = load("run_starts")
+        self.run_cites = load("run_cites")
+        deleted = set(meta["deleted"])
+        self.live = np.array([d["fileid"] not in deleted for d in self.docs], dtype=bool)
+
+    def _term(self, word):
+        try:
+            return self.terms.index(word)
+        except KeyError:
+            return None
+
+    def count(self, word):
+        t = self._term(word)
+        if t is None:
+            return 0
+        if self.live.all():
+            return int(self.counts[t])
+        return len(self.positions(word))
+
+    def positions(self, word):
+        """Positions of the live occurrences of `word` in the segment"""
+        t = self._term(word)
+        if t is None:
+            return np.empty(0, dtype=np.int64)
+        buf = self.postings[int(self.posting_offsets[t]):int(self.posting_offsets[t + 1])]
+        pos = np.cumsum(decode_varints(buf)).astype(np.int64)
+        if not self.live.all():
+            pos = pos[self.live[self.doc_of(pos)]]
+        return pos
+
+    def doc_of(self, pos):
+        return np.searchsorted(self.doc_starts, pos, side="right") - 1
+
+    def cite(self, pos):
+        return self.cites.string(int(self.run_cites[np.searchsorted(self.run_starts, pos, side="right") - 1]))
+
+    def forms(self, start, end):
+        return [self.terms.string(int(t)) for t in self.tokens[start:end]]
+
+    def live_docs(self):
+        """Generate the live documents of the segment, as (doc metadata, cite_words)"""
+        terms = [self.terms.string(i) for i in range(len(self.terms))]
+        cites = [self.cites.string(i) for i in range(len(self.cites))]
+        for d, meta in enumerate(self.docs):
+            if not self.live[d]:
+                continue
+            start, end = int(self.doc_starts[d]), int(self.doc_starts[d + 1])
+            pos = np.arange(start, end)
+            runs = np.searchsorted(self.run_starts, pos, side="right") - 1
+            yield meta, [(cites[c], terms[t]) for c, t in zip(self.run_cites[runs].tolist(),
+                                                               self.tokens[start:end].tolist())]
+
+
+class CorpusIndex:
+    """
+    Persistent positional index of a corpus, answering concordance queries from memory-mapped segments.
+
+    Documents are identified by their fileid; re-adding a fileid (e.g. after the file has changed)
+    supersedes its previous version, which is no longer returned by the queries.
+
+    Examples
+    --------
+    >>> store = CorpusStore("corpus_store", reader)
+    >>> store.update()
+    >>> index = CorpusIndex("corpus_index")
+    >>> index.update(store)  # indexes the new or changed files in a new segment
+    >>> index.find_concordance("λόγος")
+    >>> index.compact()  # merges the segments, dropping the superseded versions
+    """
+
+    def __init__(self, path):
+        """
+        Parameters
+        ----------
+        path : str
+            the directory of the index; it is created if it does not exist. Segment folders that are
+            not in the manifest (left by an interrupted `add` or `compact`) are deleted.
+        """
+        self._path = path
+        os.makedirs(path, exist_ok=True)
+        try:
+            with open(os.path.join(path, _MANIFEST), encoding="utf8") as f:
+                self._manifest = json.load(f)
+        except FileNotFoundError:
+            self._manifest = {"version": _INDEX_VERSION, "segments": []}
+        self._remove_orphans()
+        self._load_segments()
+
+    def _remove_orphans(self):
+        known = {meta["name"] for meta in self._manifest["segments"]}
+        for name in os.listdir(self._path):
+            if _SEGMENT_NAME.match(name) and name not in known:
+                shutil.rmtree(os.path.join(self._path, name), ignore_errors=True)
+
+    def _new_segment_name(self):
+        """A segment name after those of the manifest and of any folder already on disk"""
+        names = [meta["name"] for meta in self._manifest["segments"]] + os.listdir(self._path)
+        numbers = [int(m.group(1)) for m in map(_SEGMENT_NAME.match, names) if m]
+        return "seg_{:06d}".format(max(numbers, default=0) + 1)
+
+    def _load_segments(self):
+        self._segments = []
+        base = 0
+        for meta in self._manifest["segments"]:
+            self._segments.append(_Segment(os.path.join(self._path, meta["name"]), meta, base))
+            base += meta["tokens"]
+
+    def _save_manifest(self):
+        tmp = os.path.join(self._path, _MANIFEST + ".tmp")
+        with open(tmp, "w", encoding="utf8") as f:
+            json.dump(self._manifest, f, ensure_ascii=False, indent=1)
+        os.replace(tmp, os.path.join(self._path, _MANIFEST))
+
+    def keys(self):
+        """
+        Returns
+        -------
+        dict
+            fileid -> key (e.g. the content hash) of the indexed version of every live document
+        """
+        keys = {}
+        for meta in self._manifest["segments"]:
+            deleted = set(meta["deleted"])
+            for d in meta["docs"]:
+                if d["fileid"] not in deleted:
+                    keys[d["fileid"]] = d["key"]
+        return keys
+
+    def fileids(self):
+        return list(self.keys())
+
+    def remove(self, fileids):
+        """Drop documents from the index (their postings are skipped by the queries)"""
+        fileids = set(fileids)
+        for meta in self._manifest["segments"]:
+            for d in meta["docs"]:
+                if d["fileid"] in fileids and d["fileid"] not in meta["deleted"]:
+                    meta["deleted"].append(d["fileid"])
+        self._save_manifest()
+        self._load_segments()
+
+    def add(self, docs):
+        """
+        Index a batch of documents in a new segment.
+
+        Parameters
+        ----------
+        docs : iter
+            of (fileid, key, text_id, cite_words), where `cite_words` is a list of (cite, token) and
+            `key` identifies the version of the document (e.g. the hash of its file), or None
+
+        Returns
+        -------
+        str
+            the name of the new segment, or None if `docs` was empty
+        """
+        metas, cite_words = [], []
+        for fileid, key, text_id, cw in docs:
+            metas.append({"fileid": fileid, "key": key, "text_id": text_id})
+            cite_words.append(cw)
+        if not metas:
+            return None
+
+        # older versions of the documents are superseded by the new ones
+        self.remove([d["fileid"] for d in metas])
+
+        segment = self._write_segment(metas, cite_words)
+        self._manifest["segments"].append(segment)
+        self._save_manifest()
+        self._load_segments()
+        return segment["name"]
+
+    def compact(self):
+        """
+        Rewrite the live documents of all the segments in a single new segment, dropping the removed and
+        superseded ones, and delete the old segments. The documents are loaded in memory all at once.
+
+        Returns
+        -------
+        str
+            the name of the new segment, or None if there was nothing to compact
+        """
+        old = self._manifest["segments"]
+        if not old or (len(old) == 1 and not old[0]["deleted"]):
+            return None
+        metas, cite_words = [], []
+        for seg in self._segments:
+            for meta, cw in seg.live_docs():
+                metas.append(meta)
+                cite_words.append(cw)
+        segments = [self._write_segment(metas, cite_words)] if metas else []
+        self._manifest["segments"] = segments
+        self._save_manifest()
+        self._load_segments()
+        for meta in old:
+            shutil.rmtree(os.path.join(self._path, meta["name"]), ignore_errors=True)
+        return segments[0]["name"] if segments else None
+
+    def _write_segment(self, metas, cite_words):
+        """Write the documents in a new segment folder; returns the manifest entry of the segment"""
+        lengths = np.array([len(cw) for cw in cite_words], dtype=np.int64)
+        doc_starts = np.zeros(len(metas) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=doc_starts[1:])
+        words = [w for cw in cite_words for _, w in cw]
+        cites = [c for cw in cite_words for c, _ in cw]
+
+        terms, tokens = np.unique(np.array(words, dtype=object), return_inverse=True)
+        tokens = tokens.astype(np.uint32).ravel()
+
+        # postings: positions grouped by term, each group delta-encoded
+        order = np.argsort(tokens, kind="stable")
+        counts = np.bincount(tokens, minlength=len(terms))
+        group_starts = np.cumsum(counts) - counts
+        deltas = np.diff(order, prepend=0)
+        deltas[group_starts[counts > 0]] = order[group_starts[counts > 0]]
+        postings, nbytes = encode_varints(deltas)
+        posting_offsets = np.zeros(len(terms) + 1, dtype=np.uint64)
+        np.cumsum(np.bincount(tokens[order], weights=nbytes, minlength=len(terms)).astype(np.uint64),
+                  out=posting_offsets[1:])
+
+        # citations: a run starts wherever the cite changes, and at the beginning of every document
+        is_start = np.zeros(len(cites), dtype=bool)
+        is_start[doc_starts[:-1][lengths > 0]] = True
+        is_start[1:] |= np.array([a != b for a, b in zip(cites, cites[1:])], dtype=bool)
+        run_starts = np.flatnonzero(is_start)
+        cite_ids = {}
+        run_cites = np.array([cite_ids.setdefault(cites[i], len(cite_ids)) for i in run_starts], dtype=np.uint32)
+
+        name = self._new_segment_name()
+        folder = os.path.join(self._path, name)
+        os.makedirs(folder)
+        _save_strings(folder, "terms", terms)
+        _save_strings(folder, "cites", list(cite_ids))
+        for arr_name, arr in [("postings", postings), ("posting_offsets", posting_offsets),
+                              ("counts", counts.astype(np.uint64)), ("tokens", tokens),
+                              ("doc_starts", doc_starts), ("run_starts", run_starts.astype(np.int64)),
+                              ("run_cites", run_cites)]:
+            np.save(os.path.join(folder, arr_name + ".npy"), arr)
+        return {"name": name, "tokens": int(doc_starts[-1]), "docs": metas, "deleted": []}
+
+    def update(self, store):
+        """
+        Bring the index in line with a `CorpusStore`: the new or changed files are indexed in a new segment,
+        the files that are no longer in the store are removed.
+
+        Parameters
+        ----------
+        store : CorpusStore
+            an up-to-date store (see `CorpusStore.update`)
+
+        Returns
+        -------
+        list
+            the fileids that were indexed
+        """
+        indexed = self.keys()
+        fileids = store.fileids()
+        gone = set(indexed) - set(fileids)
+        if gone:
+            self.remove(gone)
+        todo = [f for f in fileids if indexed.get(f) != store.content_hash(f)]
+        self.add((f, store.content_hash(f), store.text_id(f), store.cite_words(f)) for f in todo)
+        return todo
+
+    def count(self, word):
+        """Number of occurrences of `word` in the corpus"""
+        return sum(seg.count(word) for seg in self._segments)
+
+    def offsets(self, word):
+        """
+        Offsets of the occurrences of `word`; the offsets are positions in the concatenation of the segments
+
+        Returns
+        -------
+        numpy.ndarray
+        """
+        if not self._segments:
+            return np.empty(0, dtype=np.int64)
+        return np.concatenate([seg.base + seg.positions(word) for seg in self._segments])
+
+    def find_concordance(self, word, width=80):
+        """
+        Find the concordance lines given the query word. The context of a line does not cross the
+        boundaries of its document; the cite is given as "text_id:cite".
+
+        Parameters
+        ----------
+        word : str
+            the query word
+        width : int
+            the width of each line, in characters (default=80)
+
+        Returns
+        -------
+        list(ConcordanceLine)
+        """
+        half_width = (width - len(word) - 2) // 2
+        context = width // 4  # approx number of words of context
+
+        concordance_list = []
+        for seg in self._segments:
+            positions = seg.positions(word)
+            for i, d in zip(positions.tolist(), seg.doc_of(positions).tolist()):
+                start, end = int(seg.doc_starts[d]), int(seg.doc_starts[d + 1])
+                left_context = seg.forms(max(start, i - context), i)
+                right_context = seg.forms(i + 1, min(end, i + context))
+                left_print = ' '.join(left_context)[-half_width:]
+                right_print = ' '.join(right_context)[:half_width]
+                cite = "{}:{}".format(seg.docs[d]["text_id"], seg.cite(i))
+                line_print = ' '.join([left_print, word, right_print])
+                concordance_list.append(ConcordanceLine(left_context, word, right_context, seg.base + i, cite,
+                                                        left_print, right_print, line_print))
+        return concordance_list
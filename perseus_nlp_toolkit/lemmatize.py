@@ -1,6 +1,184 @@
 import pandas as pd
+import numpy as np
+import os
 import re
-from functools import lru_cache
+import struct
+import unicodedata
+
+from .utils import pack_strings, StringTable, LRUCache
+
+
+_TABLE_MAGIC = b"PNTMORPH"
+_TABLE_VERSION = 1
+# name and dtype of the sections of a compiled table, in the order they are stored on disk
+_TABLE_SECTIONS = [("forms", np.uint8), ("form_offsets", np.uint64),
+                   ("tags", np.uint8), ("tag_offsets", np.uint64),
+                   ("lemmas", np.uint8), ("lemma_offsets", np.uint64),
+                   ("row_start", np.uint32), ("row_tag", np.uint16), ("row_lemma", np.uint32),
+                   ("form_lemma", np.uint32)]
+_TABLE_HEADER = struct.Struct("<8sII")
+_DEFAULT_TABLE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "lib", "morpheus", "morpheus_dataframe.csv.bz2")
+_TABLE_ENTRY = struct.Struct("<QQ")
+
+
+def compile_morpheus_table(path_to_csv, out_file):
+    """
+    Compile the Morpheus CSV table (Form, Tag, Lemma) into the binary format read by `MorpheusTable`.
+    This has to be done only once; the compiled file can then be passed to `MorpheusLookupLemmatizer`
+    in place of the CSV.
+
+    Forms, tags and lemmata are interned in three string tables (the forms are sorted, so that they can be
+    binary-searched); the rows are sorted by form and stored as integer arrays pointing to those tables.
+
+    Parameters
+    ----------
+    path_to_csv : str
+        the Morpheus table (plain or compressed CSV)
+    out_file : str
+        filename (and path) of the compiled table
+    """
+    df = pd.read_csv(path_to_csv, compression="infer").drop_duplicates(["Form", "Tag"])
+    forms, form_codes = np.unique(df.Form.to_numpy(dtype=object), return_inverse=True)
+    tags, tag_codes = np.unique(df.Tag.to_numpy(dtype=object), return_inverse=True)
+    lemmas, lemma_codes = np.unique(df.Lemma.to_numpy(dtype=object), return_inverse=True)
+
+    order = np.lexsort((tag_codes, form_codes))
+    _, first = np.unique(form_codes, return_index=True)
+    row_start = np.zeros(len(forms) + 1, dtype=np.uint32)
+    np.cumsum(np.bincount(form_codes, minlength=len(forms)), out=row_start[1:])
+
+    sections = {"row_start": row_start,
+                "row_tag": tag_codes[order],
+                "row_lemma": lemma_codes[order],
+                "form_lemma": lemma_codes[first]}
+    for name, strings in [("forms", forms), ("tags", tags), ("lemmas", lemmas)]:
+        blob, offsets = pack_strings(strings)
+        sections[name] = np.frombuffer(blob, dtype=np.uint8)
+        sections[name[:-1] + "_offsets"] = offsets
+
+    pos = _TABLE_HEADER.size + _TABLE_ENTRY.size * len(_TABLE_SECTIONS)
+    entries, arrays = [], []
+    for name, dtype in _TABLE_SECTIONS:
+        a = np.ascontiguousarray(sections[name], dtype=dtype)
+        pos += -pos % 8
+        entries.append(_TABLE_ENTRY.pack(pos, a.size))
+        arrays.append((pos, a))
+        pos += a.nbytes
+
+    with open(out_file, "wb") as out:
+        out.write(_TABLE_HEADER.pack(_TABLE_MAGIC, _TABLE_VERSION, len(_TABLE_SECTIONS)))
+        out.write(b"".join(entries))
+        for pos, a in arrays:
+            out.write(b"\0" * (pos - out.tell()))
+            out.write(a.tobytes())
+
+
+class MorpheusTable:
+    """
+    A Morpheus table compiled with `compile_morpheus_table`, memory-mapped from disk.
+
+    Nothing is parsed at load time except the (small) tag table: the arrays are read straight from the
+    mapped file, so that opening a table takes milliseconds and all the processes that use the same file
+    share one copy in the OS page cache.
+    """
+
+    def __init__(self, path):
+        import mmap
+
+        self._path = path
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, n = _TABLE_HEADER.unpack_from(self._mmap)
+        if magic != _TABLE_MAGIC or version != _TABLE_VERSION or n != len(_TABLE_SECTIONS):
+            raise ValueError("{} is not a compiled Morpheus table".format(path))
+
+        a = {}
+        for i, (name, dtype) in enumerate(_TABLE_SECTIONS):
+            offset, count = _TABLE_ENTRY.unpack_from(self._mmap, _TABLE_HEADER.size + i * _TABLE_ENTRY.size)
+            a[name] = np.frombuffer(self._mmap, dtype=dtype, count=count, offset=offset)
+
+        self._forms = StringTable(a["forms"], a["form_offsets"])
+        self._lemmas = StringTable(a["lemmas"], a["lemma_offsets"])
+        tags = StringTable(a["tags"], a["tag_offsets"])
+        self._tags = {tags.string(i): i for i in range(len(tags))}
+        self._row_start = a["row_start"]
+        self._row_tag = a["row_tag"]
+        self._row_lemma = a["row_lemma"]
+        self._form_lemma = a["form_lemma"]
+
+    @staticmethod
+    def is_compiled(path):
+        """Check whether a file is a compiled table (as opposed to a CSV)"""
+        with open(path, "rb") as f:
+            return f.read(len(_TABLE_MAGIC)) == _TABLE_MAGIC
+
+    def __len__(self):
+        return len(self._row_tag)
+
+    def __contains__(self, form):
+        try:
+            self._forms.index(form)
+        except KeyError:
+            return False
+        return True
+
+    def lookup(self, form, postag, form_fallback=False):
+        """
+        Return the lemma of a form+tag couple, or an empty string if the couple is not in the table.
+        If `form_fallback` is True, the lemma of the first entry with the same form is returned
+        when the tag does not match.
+        """
+        try:
+            f = self._forms.index(form)
+        except KeyError:
+            return ""
+        t = self._tags.get(postag)
+        if t is not None:
+            b, e = int(self._row_start[f]), int(self._row_start[f + 1])
+            match = np.flatnonzero(self._row_tag[b:e] == t)
+            if len(match):
+                return self._lemmas.string(int(self._row_lemma[b + match[0]]))
+        if form_fallback:
+            return self._lemmas.string(int(self._form_lemma[f]))
+        return ""
+
+
+class MorpheusFormSet:
+    """
+    The set of the forms known to Morpheus, for offline checks of the validity of a word.
+    Forms are compared in Unicode NFC, the normalization of the Morpheus table.
+
+    With a CSV table the forms are loaded in a hash set (this takes a second or so);
+    with a compiled table (see `compile_morpheus_table`) they are binary-searched in the mapped file.
+    """
+
+    def __init__(self, path_to_data=_DEFAULT_TABLE):
+        """
+        Parameters
+        ----------
+        path_to_data : str
+            the Morpheus table, as CSV (plain or compressed) or compiled; defaults to the table bundled
+            in `lib/morpheus`
+        """
+        if MorpheusTable.is_compiled(path_to_data):
+            self._forms = MorpheusTable(path_to_data)
+        else:
+            forms = pd.read_csv(path_to_data, usecols=["Form"], compression="infer").Form
+            self._forms = frozenset(forms.dropna().astype(str).unique())
+
+    def __contains__(self, form):
+        return unicodedata.normalize("NFC", form) in self._forms
+
+
+_default_form_set = None
+
+
+def default_form_set():
+    """The `MorpheusFormSet` of the bundled Morpheus table, loaded on first use and then shared"""
+    global _default_form_set
+    if _default_form_set is None:
+        _default_form_set = MorpheusFormSet()
+    return _default_form_set
 
 
 class MateLemmatizer:
@@ -18,20 +196,161 @@ class MorpheusLookupLemmatizer():
     configure a database on their machine in order for them to use it. Instead, we rely on `pandas` and on a
     CSV export of the Morpheus greek parses for fast lookups.
 
+    When the table is loaded, a hash index is built on the (form, tag) couples, plus a fallback index
+    on the forms alone. Single lookups are thus constant-time, and whole sentences (or lists of sentences)
+    are resolved with a single vectorized join against the index.
+
+    Loading the CSV takes a few seconds. If you spawn many lemmatizers (e.g. one per worker process),
+    compile the table once with `compile_morpheus_table` and pass the compiled file as `path_to_data`:
+    it is memory-mapped instead of parsed (see `MorpheusTable`).
+
+    The results of the lookups are kept in a bounded LRU cache that belongs to the lemmatizer. Its size can be
+    set in entries and/or bytes; `cache_info` reports hits, misses and evictions, and `warm_cache` pre-loads it
+    with the most frequent words of a corpus.
+
     The CSV file is stored in a bz2 archive in the folder `lib`. It is relatively light (3.3 MB) and
     was generated using G. Celano's [utf-8 conversions](https://github.com/gcelano/MorpheusGreekUnicode)
     of Morpheus' betacode tables.
     """
 
-    def __init__(self, path_to_data="lib/morpheus/morpheus_dataframe.csv.bz2"):
+    def __init__(self, path_to_data=_DEFAULT_TABLE, form_fallback=False,
+                 cache_size=100000, cache_bytes=None):
+        """
+        Parameters
+        ----------
+        path_to_data : str
+            path to the bz2-compressed CSV table with the Morpheus forms, tags and lemmata,
+            or to a table compiled with `compile_morpheus_table`; by default, the table in `lib/morpheus`
+            of the package
+        form_fallback : bool
+            if True, when the form+tag couple is not in the table, the lemma of the first entry
+            with the same form (whatever its tag) is returned instead of an empty string
+        cache_size : int
+            maximum number of (form, tag) couples kept in the lemma cache (None for no limit)
+        cache_bytes : int
+            maximum approximate size of the lemma cache in bytes (None for no limit)
+        """
         self._path = path_to_data
-        self._df = pd.read_csv(self._path, compression="bz2")
+        self._form_fallback = form_fallback
+        self._cache = LRUCache(maxsize=cache_size, maxbytes=cache_bytes)
+        if MorpheusTable.is_compiled(self._path):
+            self._table = MorpheusTable(self._path)
+            self._df = None
+        else:
+            self._table = None
+            self._df = pd.read_csv(self._path, compression="bz2")
+            self._build_index()
+
+    def _build_index(self):
+        """
+        Index the table on (form, tag) and on form alone. If the same key appears more than once,
+        the first row wins, as it did with the old boolean-mask scan of the dataframe.
+        """
+        df = self._df.drop_duplicates(["Form", "Tag"])
+        self._index = pd.MultiIndex.from_arrays([df.Form.to_numpy(dtype=object),
+                                                 df.Tag.to_numpy(dtype=object)])
+        self._lemmas = df.Lemma.to_numpy(dtype=object)
+
+        df = df.drop_duplicates("Form")
+        self._form_index = pd.Index(df.Form.to_numpy(dtype=object))
+        self._form_lemmas = df.Lemma.to_numpy(dtype=object)
+
+    @staticmethod
+    def _normalize_tag(postag):
+        # normalize the postag returned by the taggers
+        postag = postag.replace("|", "")
+        if re.search(r'^[a-z]_$', postag):
+            postag = postag.replace("_", "--------")
+        return postag
+
+    def _lookup(self, form, postag):
+        if self._table is not None:
+            return self._table.lookup(form, postag, self._form_fallback)
+        try:
+            return self._lemmas[self._index.get_loc((form, postag))]
+        except KeyError:
+            pass
+        if self._form_fallback:
+            try:
+                return self._form_lemmas[self._form_index.get_loc(form)]
+            except KeyError:
+                pass
+        return ""
+
+    def _lookup_many(self, forms, postags):
+        """
+        Vectorized version of `_lookup`: resolve all the (form, tag) couples with one join on the index.
+
+        Returns
+        -------
+        numpy.ndarray : the lemmata, with an empty string where the lookup failed
+        """
+        if self._table is not None:
+            # the compiled table is binary-searched: look up each distinct couple once
+            lemmas = {k: self._lookup(*k) for k in set(zip(forms, postags))}
+            return np.array([lemmas[k] for k in zip(forms, postags)], dtype=object)
+
+        forms = np.asarray(forms, dtype=object)
+        pos = self._index.get_indexer(pd.MultiIndex.from_arrays([forms, np.asarray(postags, dtype=object)]))
+        lemmas = np.where(pos >= 0, self._lemmas[pos], "")
+        if self._form_fallback:
+            missing = np.flatnonzero(pos < 0)
+            fpos = self._form_index.get_indexer(forms[missing])
+            lemmas[missing] = np.where(fpos >= 0, self._form_lemmas[fpos], "")
+        return lemmas
+
+    def _cached_lookup_many(self, forms, postags):
+        """Like `_lookup_many`, but serves what it can from the cache and caches the rest"""
+        keys = list(zip(forms, postags))
+        lemmas = [self._cache.get(k) for k in keys]
+        missing = [i for i, l in enumerate(lemmas) if l is None]
+        if missing:
+            found = self._lookup_many([forms[i] for i in missing], [postags[i] for i in missing])
+            for i, l in zip(missing, found):
+                lemmas[i] = l
+                self._cache.put(keys[i], l)
+        return lemmas
+
+    def cache_info(self):
+        """
+        Statistics of the lemma cache.
+
+        Returns
+        -------
+        CacheInfo : namedtuple with hits, misses, evictions, size, maxsize, bytes, maxbytes
+        """
+        return self._cache.info()
+
+    def clear_cache(self):
+        self._cache.clear()
+
+    def warm_cache(self, frequencies):
+        """
+        Pre-load the cache with the lemmata of the most frequent words.
+
+        Parameters
+        ----------
+        frequencies : dict or list
+            either a mapping (e.g. a `collections.Counter`) from (form, tag) couples to their frequency,
+            or a list of (form, tag) couples sorted from the most to the least frequent.
+            If the list is longer than the cache, only the most frequent couples are kept.
+        """
+        if hasattr(frequencies, "items"):
+            frequencies = [k for k, _ in sorted(frequencies.items(), key=lambda kv: kv[1], reverse=True)]
+        couples = list(frequencies)
+        if self._cache.maxsize is not None:
+            couples = couples[:self._cache.maxsize]
+        forms = [c[0] for c in couples]
+        postags = [self._normalize_tag(c[1]) for c in couples]
+        lemmas = self._lookup_many(forms, postags)
+        # the least frequent go in first, so that they are also the first to be evicted
+        for k, l in reversed(list(zip(zip(forms, postags), lemmas))):
+            self._cache.put(k, l)
 
     #def lemmatize_cited_word(self, cite, form, postag):
     #    t = self.lemmatize_word(form, postag)
     #    return (cite,) + t
 
-    @lru_cache(maxsize=512)
     def lemmatize_word(self, form, postag):
         """
         Generate a tuple with form, lemma, tag.
@@ -50,31 +369,79 @@ class MorpheusLookupLemmatizer():
             if lemma is not found for the form+tag couple, the second element in the tuple is an empty string
 
         """
-        # normalize the postag returned by the taggers
-        postag = postag.replace("|", "")
-        if re.search(r'^[a-z]_$', postag):
-            postag = postag.replace("_", "--------")
-        try:
-            l = self._df[(self._df.Form == form) & (self._df.Tag == postag)].Lemma.values[0]
-        except IndexError:
-            l = ""
+        postag = self._normalize_tag(postag)
+        l = self._cache.get((form, postag))
+        if l is None:
+            l = self._lookup(form, postag)
+            self._cache.put((form, postag), l)
         if postag == "u--------":
             l = "punct"
         return (form, l, postag)
 
     def lemmatize_sentence(self, sent, include_cite=False):
-        lemmsent = []
-        for token in sent:
-            if include_cite:
-                t = self.lemmatize_word(token[1], token[2])
-                t = (token[0],) + t
-
-            else:
-                t = self.lemmatize_word(token[0], token[1])
-            lemmsent.append(t)
-        return lemmsent
+        return self.lemmatize_sentences([sent], include_cite=include_cite)[0]
 
     def lemmatize_sentences(self, sents, include_cite=False):
-        return [self.lemmatize_sentence(s, include_cite=include_cite)
-                for s in sents]
+        """
+        Lemmatize a list of tagged sentences. All the tokens are looked up at once with a single join
+        on the index, instead of one lookup per token.
+
+        Parameters
+        ----------
+        sents : list(list(tuple))
+            the tagged sentences; each token is a tuple (form, tag), or (cite, form, tag) if `include_cite` is True
+        include_cite : bool
+            whether the tokens start with a citation
+
+        Returns
+        -------
+        list(list(tuple)) : the sentences as lists of (form, lemma, tag) or (cite, form, lemma, tag)
+
+        """
+        sents = [list(s) for s in sents]
+        i = 1 if include_cite else 0
+        forms = [t[i] for s in sents for t in s]
+        postags = [self._normalize_tag(t[i + 1]) for s in sents for t in s]
+        lemmas = self._cached_lookup_many(forms, postags)
+
+        lemmsents = []
+        it = iter(zip(forms, lemmas, postags))
+        for s in sents:
+            lemmsent = []
+            for token in s:
+                form, l, postag = next(it)
+                if postag == "u--------":
+                    l = "punct"
+                t = (form, l, postag)
+                if include_cite:
+                    t = (token[0],) + t
+                lemmsent.append(t)
+            lemmsents.append(lemmsent)
+        return lemmsents
+
+    def iter_lemmatize_sentences(self, sents, include_cite=False, chunk_size=1000):
+        """
+        Lemmatize a stream of tagged sentences (e.g. the output of `MateMorphTagger.iter_tag_sents`)
+        one chunk at a time, generating the lemmatized sentences as soon as each chunk is done.
+
+        Parameters
+        ----------
+        sents : iter
+            list or generator of tagged sentences (see `lemmatize_sentences`)
+        include_cite : bool
+            whether the tokens start with a citation
+        chunk_size : int
+            number of sentences looked up at once
+
+        Returns
+        -------
+        generator : the lemmatized sentences
+        """
+        from itertools import islice
 
+        sents = iter(sents)
+        while True:
+            chunk = list(islice(sents, chunk_size))
+            if not chunk:
+                break
+            yield from self.lemmatize_sentences(chunk, include_cite=include_cite)
@@ -0,0 +1,113 @@
+import is2.data.SentenceData09;
+import is2.tools.Tool;
+
+import java.io.BufferedReader;
+import java.io.BufferedWriter;
+import java.io.InputStreamReader;
+import java.io.OutputStreamWriter;
+import java.io.PrintStream;
+import java.io.PrintWriter;
+import java.util.ArrayList;
+import java.util.List;
+
+/**
+ * Keeps a Mate tool (tagger, lemmatizer, parser) and its model in memory and annotates the sentences
+ * it receives on the standard input, so that the model is loaded once per session instead of once per batch.
+ *
+ * Input and output are CoNLL-2009 sentences terminated by a blank line; each annotated sentence is
+ * flushed as soon as it is ready. A line containing only END_OF_BATCH is echoed back once all the
+ * sentences sent before it have been written out.
+ *
+ * Compile with:  javac -cp anna-3.61.jar MateServer.java
+ * Run with:      java -cp anna-3.61.jar:. MateServer is2.tag.Tagger -model path/to/model
+ */
+public class MateServer {
+
+    static final String END_OF_BATCH = "<EOB>";
+    static final String ROOT = "<root>";
+    static final String ROOT_LEMMA = "<root-LEMMA>";
+    static final String ROOT_POS = "<root-POS>";
+    static final String ROOT_FEAT = "<no-type>";
+
+    public static void main(String[] args) throws Exception {
+        String model = null;
+        for (int i = 1; i < args.length - 1; i++) {
+            if (args[i].equals("-model")) {
+                model = args[i + 1];
+            }
+        }
+        // Mate logs to stdout: keep stdout for the annotations and send everything else to stderr
+        PrintStream stdout = System.out;
+        System.setOut(System.err);
+
+        Tool tool = (Tool) Class.forName(args[0]).getConstructor(String.class).newInstance(model);
+
+        BufferedReader in = new BufferedReader(new InputStreamReader(System.in, "UTF-8"));
+        PrintWriter out = new PrintWriter(new BufferedWriter(new OutputStreamWriter(stdout, "UTF-8")));
+        List<String[]> rows = new ArrayList<String[]>();
+        String line;
+        while ((line = in.readLine()) != null) {
+            if (line.equals(END_OF_BATCH)) {
+                out.println(END_OF_BATCH);
+                out.flush();
+            } else if (line.trim().isEmpty()) {
+                if (!rows.isEmpty()) {
+                    write(out, tool.apply(read(rows)));
+                    rows.clear();
+                }
+                out.println();
+                out.flush();
+            } else {
+                rows.add(line.split("\t"));
+            }
+        }
+        out.flush();
+    }
+
+    static String col(String[] row, int i) {
+        return i < row.length ? row[i] : "_";
+    }
+
+    static SentenceData09 read(List<String[]> rows) {
+        int n = rows.size() + 1;
+        String[] forms = new String[n], lemmas = new String[n], pos = new String[n], feats = new String[n];
+        forms[0] = ROOT;
+        lemmas[0] = ROOT_LEMMA;
+        pos[0] = ROOT_POS;
+        feats[0] = ROOT_FEAT;
+        for (int i = 1; i < n; i++) {
+            String[] row = rows.get(i - 1);
+            forms[i] = col(row, 1);
+            lemmas[i] = col(row, 2);
+            pos[i] = col(row, 4);
+            feats[i] = col(row, 6);
+        }
+        SentenceData09 s = new SentenceData09();
+        s.init(forms);
+        s.lemmas = lemmas;
+        s.plemmas = lemmas.clone();
+        s.gpos = pos;
+        s.ppos = pos.clone();
+        s.ofeats = feats;
+        s.pfeats = feats.clone();
+        return s;
+    }
+
+    static String str(String[] a, int i) {
+        return a != null && i < a.length && a[i] != null ? a[i] : "_";
+    }
+
+    static String num(int[] a, int i) {
+        return a != null && i < a.length ? String.valueOf(a[i]) : "_";
+    }
+
+    static void write(PrintWriter out, SentenceData09 s) {
+        int start = s.forms.length > 0 && ROOT.equals(s.forms[0]) ? 1 : 0;
+        for (int i = start; i < s.forms.length; i++) {
+            out.println((i - start + 1) + "\t" + s.forms[i] + "\t" + str(s.lemmas, i) + "\t" + str(s.plemmas, i)
+                    + "\t" + str(s.gpos, i) + "\t" + str(s.ppos, i) + "\t" + str(s.ofeats, i) + "\t" + str(s.pfeats, i)
+                    + "\t" + num(s.heads, i) + "\t" + num(s.pheads, i) + "\t" + str(s.labels, i)
+                    + "\t" + str(s.plabels, i) + "\t_\t_");
+        }
+    }
+}
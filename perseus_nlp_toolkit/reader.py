@@ -6,10 +6,16 @@ from nltk.corpus.reader.api import *
 from nltk.tokenize import *
 
 
+import os
+import weakref
+from itertools import islice
+
 from MyCapytain.resources.texts.local.capitains.cts import CapitainsCtsText
 from MyCapytain.common.constants import Mimetypes, XPATH_NAMESPACES
+from MyCapytain.common.utils import normalize
+from lxml import etree
 
-from .utils import Sentence, Word, Artificial
+from .utils import Sentence, Word, Artificial, HeadCycle, LRUCache, postag_to_ud
 
 class CapitainCorpusReader(CorpusReader):
     """
@@ -18,15 +24,15 @@ class CapitainCorpusReader(CorpusReader):
     or by custom tokenizers specified as parameters to the constructor.
     """
 
-    # CorpusView = StreamBackedCorpusView
-    """Here we should create a corpus viewer, but it was too hard..."""
-
     def __init__(self, root, fileids,
                  word_tokenizer=WordPunctTokenizer(),
                  sent_tokenizer=PunktSentenceTokenizer(lang_vars=AncientGreekPunktVar()),
                  exclude_tags=['tei:note'],
                  # para_block_reader=read_blankline_block,
-                 encoding='utf8'):
+                 encoding='utf8',
+                 lazy=False,
+                 cache_size=8,
+                 passage_engine="capitains"):
         """
         Construct a new citable corpus reader for a set of documents
         located at the given root directory.
@@ -43,13 +49,33 @@ class CapitainCorpusReader(CorpusReader):
             Tokenizer for breaking paragraphs into sentences
         exclude_tags : list
             TEI tags whose text should not be extracted.
+        lazy : bool
+            if True, `words` and `cite_words` return lazy corpus views (see `CiteCorpusView`)
+            that read the passages on demand, instead of lists
+        cache_size : int
+            number of parsed texts (and of their extracted passages) kept in memory, so that calling
+            several methods on the same file parses it only once. Texts are re-parsed if their file
+            has been modified in the meantime. Use 0 to disable the cache.
+        passage_engine : str
+            how the citable passages are extracted. "capitains" (default) asks MyCapytain for the references
+            and for each passage. "xpath" walks the TEI tree once with lxml, using the XPath patterns of the
+            refsDecl, and produces the same references and texts much faster on finely cited texts
+            (e.g. verse cited by line); texts whose citation scheme it cannot resolve are read with MyCapytain.
         """
+        if passage_engine not in ("capitains", "xpath"):
+            raise ValueError("Unknown passage engine: {}".format(passage_engine))
 
         CorpusReader.__init__(self, root, fileids, encoding)
         self._word_tokenizer = word_tokenizer
         self._sent_tokenizer = sent_tokenizer
         # we copy the list with list() to avoid the notorious problem with mutable default args
         self._tags_to_exclude = list(exclude_tags)
+        self._lazy = lazy
+        self._passage_engine = passage_engine
+        self._text_xpath = None
+        self._text_cache = LRUCache(maxsize=cache_size)
+        # passages extracted from the cached texts; they go away with the texts
+        self._paras_cache = weakref.WeakKeyDictionary()
 
     def _get_citable_text(self, fileid):
         """
@@ -63,11 +89,41 @@ class CapitainCorpusReader(CorpusReader):
         CapitainsCtsText object
 
         """
-
-        with open(self._root.join(fileid)) as f:
-            text = CapitainsCtsText(resource=f)
+        path = self._root.join(fileid)
+        # keying on the modification time invalidates the texts whose file has changed
+        key = (fileid, os.path.getmtime(path))
+        text = self._text_cache.get(key)
+        if text is None:
+            with open(path) as f:
+                text = CapitainsCtsText(resource=f)
+            self._text_cache.put(key, text)
         return text
 
+    def __getstate__(self):
+        # parsed texts and compiled XPaths do not travel to the worker processes: each worker builds its own
+        state = self.__dict__.copy()
+        state["_text_cache"] = LRUCache(maxsize=self._text_cache.maxsize)
+        state["_paras_cache"] = None
+        state["_text_xpath"] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._paras_cache = weakref.WeakKeyDictionary()
+
+    def clear_cache(self):
+        """Forget all the parsed texts"""
+        self._text_cache.clear()
+        self._paras_cache.clear()
+
+    def cache_info(self):
+        """
+        Returns
+        -------
+        CacheInfo : hits, misses and evictions of the cache of parsed texts
+        """
+        return self._text_cache.info()
+
     def _set_fileids(self, fileids):
         """If fileids is None, then return the whole corpus;
         if it is a single file then return a 1-element list
@@ -84,13 +140,76 @@ class CapitainCorpusReader(CorpusReader):
             fileids = [fileids]
         return fileids
 
-    def raw(self, fileids=None):
+    def _map_fileids(self, method, fileids, workers=1, chunksize=1):
+        """
+        Apply a per-file reading method to each file, yielding the results in the order of `fileids`.
+        With several workers, at most `2 * workers` chunks of files are submitted (or waiting to be
+        consumed) at any time, so that memory does not grow with the size of the corpus.
+
+        Parameters
+        ----------
+        method : str
+            name of the per-file method (e.g. "_file_words")
+        fileids : list
+            the files to read
+        workers : int
+            if greater than 1, the files are read and tokenized by a pool of as many processes
+        chunksize : int
+            number of files sent to a worker at once
+
+        Returns
+        -------
+        generator
+        """
+        if workers <= 1 or len(fileids) < 2:
+            read = getattr(self, method)
+            for f in fileids:
+                yield read(f)
+            return
+
+        from collections import deque
+        from concurrent.futures import ProcessPoolExecutor
+
+        chunks = (fileids[i:i + chunksize] for i in range(0, len(fileids), chunksize))
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(self,)) as ex:
+            pending = deque(ex.submit(_read_files, method, c) for c in islice(chunks, 2 * workers))
+            try:
+                while pending:
+                    results = pending.popleft().result()
+                    for c in islice(chunks, 1):
+                        pending.append(ex.submit(_read_files, method, c))
+                    yield from results
+            finally:
+                for fut in pending:
+                    fut.cancel()
+
+    def _file_paras(self, fileid):
+        return self._read_paras(self._get_citable_text(fileid))
+
+    def _file_words(self, fileid):
+        return self._read_words(self._get_citable_text(fileid))
+
+    def _file_sents(self, fileid):
+        return self._read_sents(self._get_citable_text(fileid))
+
+    @staticmethod
+    def _text_id(fileid):
+        """The CTS identifier of a file (auth_id.work_id), taken from its file name"""
+        return ".".join(os.path.basename(fileid).split(".")[:2])
+
+    def _file_cite_words(self, fileid):
+        txt_id = self._text_id(fileid)
+        return [(txt_id, c, w) for c, w in self._read_words(self._get_citable_text(fileid), include_cites=True)]
+
+    def raw(self, fileids=None, workers=1):
         """Returns the given file(s) as a single string.
 
         Parameters
         ----------
         fileids : None, list, str, path
             file identifier or pointer. If None, then the whole corpus is returned
+        workers : int
+            number of processes used to read the files (1 reads them one after another)
 
         Returns
         -------
@@ -100,27 +219,29 @@ class CapitainCorpusReader(CorpusReader):
         fileids = self._set_fileids(fileids)
 
         raw_texts = []
-        for f in fileids:
-            text = self._get_citable_text(f)
-            raw_texts.extend(self._read_paras(text))
+        for paras in self._map_fileids("_file_paras", fileids, workers):
+            raw_texts.extend(paras)
 
         return concat(raw_texts)
 
-    def words(self, fileids=None):
+    def words(self, fileids=None, workers=1):
         """
+        :param workers: number of processes used to read and tokenize the files (ignored by lazy readers)
         :return: the given file(s) as a list of words
             and punctuation symbols.
         :rtype: list(str)
         """
         fileids = self._set_fileids(fileids)
+        if self._lazy:
+            return concat([CiteCorpusView(self._root.join(f), self, f) for f in fileids])
         words = []
-        for f in fileids:
-            text = self._get_citable_text(f)
-            words.extend(self._read_words(text))
+        for w in self._map_fileids("_file_words", fileids, workers):
+            words.extend(w)
         return words
 
-    def sents(self, fileids=None):
+    def sents(self, fileids=None, workers=1):
         """
+        :param workers: number of processes used to read and tokenize the files
         :return: the given file(s) as a list of
             sentences or utterances, each encoded as a list of word
             strings.
@@ -131,9 +252,8 @@ class CapitainCorpusReader(CorpusReader):
 
         fileids = self._set_fileids(fileids)
         sents = []
-        for f in fileids:
-            text = self._get_citable_text(f)
-            sents.extend(self._read_sents(text))
+        for s in self._map_fileids("_file_sents", fileids, workers):
+            sents.extend(s)
 
         return sents
 
@@ -152,6 +272,8 @@ class CapitainCorpusReader(CorpusReader):
         """
         if not isinstance(fileid, string_types):
             raise TypeError('Expected a single file identifier string')
+        if self._lazy:
+            return CiteCorpusView(self._root.join(fileid), self, fileid, include_cites=True)
         text = self._get_citable_text(fileid)
         return self._read_words(text, include_cites=True)
 
@@ -173,43 +295,64 @@ class CapitainCorpusReader(CorpusReader):
         text = self._get_citable_text(fileid)
         return self._read_sents(text, include_cites=True)
 
-    def corpus_cite_words(self):
+    def corpus_cite_words(self, workers=1):
         """
         Get text identifier, tokens and citations for all the tokens in all the files of the corpus.
 
         WARNING:
         the file id's must be formatted using a cts compatible format: auth_id.work_id
 
+        Parameters
+        ----------
+        workers : int
+            number of processes used to read and tokenize the files; the result is the same,
+            in the same (fileid) order, whatever the number of workers
+
         Returns
         -------
         list (tuple)
             list of (text_id, cite, token)
 
         """
-        import os
-        cite_words = []
-        for f in self.fileids():
-            txt_ids = os.path.basename(f).split(".")[:2]
-            _words = [(".".join(txt_ids), w[0], w[1]) for w in self.cite_words(f)]
-            cite_words.extend(_words)
-        return cite_words
+        return list(self.iter_corpus_cite_words(workers=workers))
 
+    def iter_corpus_cite_words(self, workers=1, chunksize=1):
+        """
+        Same as `corpus_cite_words`, but the tuples are streamed file by file, so that only the
+        files being processed are kept in memory.
 
-    def paras(self, fileids=None):
+        Parameters
+        ----------
+        workers : int
+            number of processes used to read and tokenize the files
+        chunksize : int
+            number of files sent to a worker at once; larger chunks lower the overhead
+            for corpora made of many small files
+
+        Returns
+        -------
+        generator
+            of (text_id, cite, token)
+        """
+        for cite_words in self._map_fileids("_file_cite_words", self.fileids(), workers, chunksize):
+            yield from cite_words
+
+
+    def paras(self, fileids=None, workers=1):
         """
         Returns a series of sections, corresponding to the last citeable level identified
         by Capitain. It does not do much more than what the Capitain API does, but it may
         be helpful for some use cases.
 
+        :param workers: number of processes used to read the files
         :return: the given file(s) as a list of
             sections.
         :rtype: list (str)
         """
         fileids = self._set_fileids(fileids)
         paras = []
-        for f in fileids:
-            text = self._get_citable_text(f)
-            paras.extend(self._read_paras(text))
+        for p in self._map_fileids("_file_paras", fileids, workers):
+            paras.extend(p)
         return paras
 
 
@@ -219,11 +362,7 @@ class CapitainCorpusReader(CorpusReader):
         if include_cites:
             spans = self._word_tokenizer.span_tokenize(text)
             words = self._word_tokenizer.tokenize(text)
-            cite_words = []
-            for span,word in zip(spans, words):
-                c = self._return_cite(span, secs[0])
-                cite_words.append((c, word))
-            return cite_words
+            return list(zip(self._sweep_cites(spans, secs[0]), words))
         else:
             text = "".join(concat(secs))
             return self._word_tokenizer.tokenize(text)
@@ -231,26 +370,138 @@ class CapitainCorpusReader(CorpusReader):
     def _read_sents(self, capitain_file, include_cites=False):
         secs = self._read_paras(capitain_file, include_cites)
 
-        text = "".join(secs) if not include_cites else "".join(secs[1])
-        rawsents = self._sent_tokenizer.tokenize(text)
-        sents = [self._word_tokenizer.tokenize(s) for s in rawsents]
-
         if not include_cites:
-            return sents
-        else:
-            # get the cite_words and regroup them with sents
-            sizes = [len(s) for s in sents]
-            _cite_words = self._read_words(capitain_file, include_cites=True)
-            it = iter(_cite_words)
-            cite_sents = [[next(it) for _ in range(size)] for size in sizes]
-            return cite_sents
+            text = "".join(secs)
+            rawsents = self._sent_tokenizer.tokenize(text)
+            return [self._word_tokenizer.tokenize(s) for s in rawsents]
+
+        if not hasattr(self._sent_tokenizer, "span_tokenize"):
+            # tokenizers without spans: regroup the cite_words of the file by the size of the sentences
+            text = "".join(secs[1])
+            sizes = [len(self._word_tokenizer.tokenize(s)) for s in self._sent_tokenizer.tokenize(text)]
+            it = iter(self._read_words(capitain_file, include_cites=True))
+            return [[next(it) for _ in range(size)] for size in sizes]
+
+        # a single span-based pass: sentence spans, word spans inside each sentence,
+        # and the citations from the offsets of the words
+        refs, paras = secs
+        text = "".join(paras)
+        sents = []
+        spans = []
+        for b, e in self._sent_tokenizer.span_tokenize(text):
+            sent = text[b:e]
+            words = []
+            for wb, we in self._word_tokenizer.span_tokenize(sent):
+                words.append(sent[wb:we])
+                spans.append((b + wb, b + we))
+            sents.append(words)
+
+        cites = self._sweep_cites(spans, refs)
+        return [[(next(cites), w) for w in words] for words in sents]
 
+    def _return_cite(self, span, cites):
+        """
+        The reference of the passage where a span ends (binary search on the passage offsets)
 
+        Parameters
+        ----------
+        span : tuple
+            (begin, end) offsets of a token
+        cites : list
+            list of (ref, begin, end) of the passages, sorted by offset
 
-    def _return_cite(self, span, cites):
-        for c in cites:
-            if span[-1] <= c[-1]:
-                return c[0]
+        Returns
+        -------
+        str : the reference, or None if the span is beyond the last passage
+        """
+        import bisect
+
+        i = bisect.bisect_left(_PassageEnds(cites), span[-1])
+        return cites[i][0] if i < len(cites) else None
+
+    def _sweep_cites(self, spans, cites):
+        """
+        Same as calling `_return_cite` for each span, but for spans sorted by offset (as those returned by a
+        tokenizer): spans and passages are merged in a single linear sweep.
+
+        Returns
+        -------
+        generator : the reference of each span
+        """
+        i = 0
+        n = len(cites)
+        for span in spans:
+            while i < n and span[-1] > cites[i][-1]:
+                i += 1
+            yield cites[i][0] if i < n else None
+
+    def _export_passage(self, capitain_file, ref):
+        """Plain text of the passage identified by ref, followed by a blank space"""
+        psg = capitain_file.getTextualNode(subreference=ref, simple=True)
+        return psg.export(Mimetypes.PLAINTEXT, exclude=self._tags_to_exclude) + " "
+
+    def _export_node(self, node):
+        """
+        Plain text of a passage node, followed by a blank space. The result is the same as that of
+        `_export_passage` (MyCapytain's plaintext export), without building a passage object.
+        """
+        if self._text_xpath is None:
+            from lxml import etree
+
+            exclude = ""
+            if self._tags_to_exclude:
+                exclude = "[{}]".format(" and ".join("not(./ancestor-or-self::{})".format(t)
+                                                     for t in self._tags_to_exclude))
+            self._text_xpath = etree.XPath(".//descendant-or-self::text(){}".format(exclude),
+                                           namespaces=XPATH_NAMESPACES, smart_strings=False)
+        return normalize(" ".join(self._text_xpath(node))) + " "
+
+    def _xpath_passage_nodes(self, capitain_file):
+        """
+        Find the nodes of all the deepest citable passages at once. Each citation level is queried with
+        its refsDecl pattern, with wildcards in place of the reference values; the reference of a passage is
+        then rebuilt from the reference attributes of its ancestors.
+
+        Returns
+        -------
+        list(tuple) : (ref, node) in the order of the text, or None if some passage cannot be placed
+            under the upper citation levels
+        """
+        xml = capitain_file.xml
+        levels = []
+        for citation in capitain_file.citation.root:
+            attr = citation.attribute.replace("xml:", "{http://www.w3.org/XML/1998/namespace}")
+            nodes = xml.xpath(citation.fill(None), namespaces=XPATH_NAMESPACES)
+            levels.append([(n, n.get(attr)) for n in nodes])
+
+        # lxml elements may compare by value (objectify): index the upper levels by identity
+        upper = [{id(n): v for n, v in level} for level in levels[:-1]]
+        located = []
+        for node, value in levels[-1]:
+            parts = [value]
+            ancestors = [id(a) for a in node.iterancestors()]
+            for level in reversed(upper):
+                parts.append(next((level[a] for a in ancestors if a in level), None))
+            if None in parts:
+                return None
+            located.append((".".join(reversed(parts)), node))
+        return located
+
+    def _locate_passages(self, capitain_file):
+        """
+        References of the deepest citable passages, each with a handle for `_export_located`:
+        the passage node with the xpath engine, the reference itself with MyCapytain.
+        """
+        if self._passage_engine == "xpath":
+            located = self._xpath_passage_nodes(capitain_file)
+            if located is not None:
+                return located
+        return [(str(ref), ref) for ref in capitain_file.getReffs(level=len(capitain_file.citation))]
+
+    def _export_located(self, capitain_file, handle):
+        if isinstance(handle, etree._Element):
+            return self._export_node(handle)
+        return self._export_passage(capitain_file, handle)
 
     def _read_paras(self, capitain_file, include_cites=False):
         """
@@ -267,33 +518,207 @@ class CapitainCorpusReader(CorpusReader):
             list of textual sections, or list of references and texts
 
         """
-        paras = []
-        refs = []
-        b, e = 0, 0
-        for ref in capitain_file.getReffs(level=len(capitain_file.citation)):
-            psg = capitain_file.getTextualNode(subreference=ref, simple=True)
-            t = psg.export(Mimetypes.PLAINTEXT, exclude=self._tags_to_exclude) + " "
-            paras.append(t)
-            e += len(t)
-            refs.append((ref, b, e))
-            b = e
+        try:
+            refs, paras = self._paras_cache[capitain_file]
+        except KeyError:
+            paras = []
+            refs = []
+            b, e = 0, 0
+            for ref, handle in self._locate_passages(capitain_file):
+                t = self._export_located(capitain_file, handle)
+                paras.append(t)
+                e += len(t)
+                refs.append((ref, b, e))
+                b = e
+            self._paras_cache[capitain_file] = (refs, paras)
         if include_cites:
             return refs, paras
         else:
             return paras
 
 
+# reader of the worker processes of CapitainCorpusReader._map_fileids
+_worker_reader = None
+
+
+def _init_worker(reader):
+    global _worker_reader
+    _worker_reader = reader
+
+
+def _read_files(method, fileids):
+    read = getattr(_worker_reader, method)
+    return [read(f) for f in fileids]
+
+
+class _PassageEnds:
+    """Sequence of the end offsets of a list of (ref, begin, end), for `bisect`"""
+
+    def __init__(self, cites):
+        self._cites = cites
+
+    def __len__(self):
+        return len(self._cites)
+
+    def __getitem__(self, i):
+        return self._cites[i][-1]
+
+
+class _PassageStream:
+    """
+    Stream-like access to the citable passages of a text, for `CiteCorpusView`.
+    Positions are passage indexes (not characters): `tell` and `seek` move from passage to passage.
+    """
+
+    def __init__(self, reader, text):
+        self._reader = reader
+        self._text = text
+        self._passages = reader._locate_passages(text)
+        self.refs = [ref for ref, _ in self._passages]
+        self._pos = 0
+
+    def seek(self, pos):
+        self._pos = pos
+
+    def tell(self):
+        return self._pos
+
+    def read_passage(self):
+        """Read the passage at the current position and move to the next one
+
+        Returns
+        -------
+        tuple : (ref, text)
+        """
+        ref, handle = self._passages[self._pos]
+        self._pos += 1
+        return ref, self._reader._export_located(self._text, handle)
+
+    def close(self):
+        self._text = None
+        self._passages = None
+
+
 class CiteCorpusView(StreamBackedCorpusView):
     """
     A specialized corpus view for cts-compliant documents.
-    Not implemented yet.
 
-    It may help in case of very large corpora, because MyCapitain can be slow when the cite scheme
-    is very fine-grained (e.g. with poetry, where you have a cite element per line).
+    The view reads one citable passage per block, so only the passages that are actually accessed are
+    extracted and tokenized, and only the last block is kept in memory. This helps with very large corpora,
+    because MyCapitain can be slow when the cite scheme is very fine-grained (e.g. with poetry, where you
+    have a cite element per line).
+
+    Tokens can be accessed by index or by CTS reference (`passage`, `ref_offset`).
     """
 
-    def __init__(self, fileid):
-        raise NotImplementedError
+    def __init__(self, path, reader, fileid, include_cites=False, encoding='utf8'):
+        """
+        Parameters
+        ----------
+        path : PathPointer
+            the path of the file
+        reader : CapitainCorpusReader
+            the reader that provides parsing, passage export and tokenization
+        fileid : str
+            the file identifier in the reader
+        include_cites : bool
+            whether the tokens are (cite, token) tuples or plain strings
+        """
+        self._reader = reader
+        self._reader_fileid = fileid
+        self._include_cites = include_cites
+        self._ref_index = None
+        StreamBackedCorpusView.__init__(self, path, encoding=encoding)
+
+    def _open(self):
+        self._stream = _PassageStream(self._reader, self._reader._get_citable_text(self._reader_fileid))
+        # the "end of file" is the number of passages
+        self._eofpos = len(self._stream.refs)
+
+    def _tokenize(self, ref, text):
+        words = self._reader._word_tokenizer.tokenize(text)
+        if self._include_cites:
+            return [(ref, w) for w in words]
+        return words
+
+    def read_block(self, stream):
+        return self._tokenize(*stream.read_passage())
+
+    def refs(self):
+        """
+        Returns
+        -------
+        list(str) : the references of the citable passages, in the order of the text
+        """
+        if self._stream is None:
+            self._open()
+        return self._stream.refs
+
+    def _passage_index(self, ref):
+        if self._ref_index is None:
+            self._ref_index = {r: i for i, r in enumerate(self.refs())}
+        try:
+            return self._ref_index[str(ref)]
+        except KeyError:
+            raise KeyError("Unknown reference {}".format(ref))
+
+    def passage(self, ref):
+        """
+        Random access by CTS reference: the tokens of one passage, without reading what comes before it
+
+        Parameters
+        ----------
+        ref : str
+            the reference of the passage (e.g. "1.2")
+
+        Returns
+        -------
+        list : the tokens of the passage
+        """
+        p = self._passage_index(ref)
+        if self._stream is None:
+            self._open()
+        pos = self._stream.tell()
+        self._stream.seek(p)
+        try:
+            return self.read_block(self._stream)
+        finally:
+            self._stream.seek(pos)
+
+    def ref_offset(self, ref):
+        """
+        Index in the view of the first token of a passage. The blocks before the passage are read
+        (once) to count their tokens.
+
+        Parameters
+        ----------
+        ref : str
+            the reference of the passage
+
+        Returns
+        -------
+        int
+        """
+        import bisect
+
+        p = self._passage_index(ref)
+        if self._filepos[-1] <= p and self._len is None:
+            for _ in self.iterate_from(self._toknum[-1]):
+                if self._filepos[-1] > p:
+                    break
+        # passages between two recorded block positions are empty
+        return self._toknum[bisect.bisect_right(self._filepos, p) - 1]
+
+
+# row templates of the CoNLL dialects supported by `AGLDTReader.export_to_conll`
+_CONLL_ROWS = {
+    #  ID FORM LEMMA PLEMMA POS PPOS FEAT PFEAT HEAD PHEAD DEPREL PDEPREL FILLPRED PRED APREDs
+    "2009": "{}\t{}\t{}\t_\t{}\t_\t{}\t_\t{}\t_\t{}\t_\t_\t_\t_\n",
+    #  ID FORM LEMMA CPOSTAG POSTAG FEATS HEAD DEPREL PHEAD PDEPREL
+    "X": "{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t_\t_\n",
+    #  ID FORM LEMMA UPOS XPOS FEATS HEAD DEPREL DEPS MISC
+    "U": "{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t_\t_\n",
+}
 
 
 class AGLDTReader(XMLCorpusReader):
@@ -314,24 +739,28 @@ class AGLDTReader(XMLCorpusReader):
 
         return x
 
-    def _is_artificial(self, t):
-        try:
-            t.attrib["artificial"]
-            return True
-        except KeyError:
-            return False
+    def _fileid_list(self, fileids):
+        if fileids is None:
+            return self._fileids
+        if isinstance(fileids, string_types):
+            return [fileids]
+        return fileids
 
-    def _set_prop_if_there(self, el, p):
+    def _iter_sentence_els(self, fileids=None):
         """
-        Generic function that tries to set a proprety by accessing the appropriate XML attribute;
-        if the attribute is not there, None is returned.
-        This is used for properties like "cite" or "cid" that might
-        or might not be set for all files"""
-        try:
-            s = el.attrib[p]
-        except KeyError:
-            s = None
-        return s
+        Stream the <sentence> elements of the files with `etree.iterparse`, as (fileid, element): each file
+        is parsed once, and every sentence is cleared (and detached from the tree) as soon as the caller
+        moves to the next one, so that memory does not grow with the size of the treebank.
+        """
+        from lxml import etree
+
+        for f in self._fileid_list(fileids):
+            for _, el in etree.iterparse(self.abspath(f), events=("end",), tag="sentence"):
+                yield f, el
+                el.clear()
+                # drop the sentences already processed, which the root still references
+                while el.getprevious() is not None:
+                    del el.getparent()[0]
 
     def get_sentences_metadata(self, fileids=None):
         """
@@ -347,93 +776,128 @@ class AGLDTReader(XMLCorpusReader):
         -------
 
         """
-        if fileids is None:
-            fileids = self._fileids
-        elif isinstance(fileids, string_types):
-            fileids = [fileids]
-        smetadata = []
-        for f in fileids:
-            x = self.xml(f)
-            sents = x.xpath("//sentence")
-
-            for s in sents:
-                sid = self._set_prop_if_there(s, "id")
-                docid = self._set_prop_if_there(s, "document_id")
-                subdoc = self._set_prop_if_there(s, "subdoc")
-                m = Sentence(sid, docid, subdoc)
-                smetadata.append(m)
-        return smetadata
+        return list(self.iter_sentences_metadata(fileids))
+
+    def iter_sentences_metadata(self, fileids=None):
+        """Same as `get_sentences_metadata`, but streamed sentence by sentence (see `iter_annotated_sents`)"""
+        for _, s in self._iter_sentence_els(fileids):
+            yield self._get_sent_metadata(s)
+
+    def _get_sent_metadata(self, sentence_el):
+        get = sentence_el.attrib.get
+        return Sentence(get("id"), get("document_id"), get("subdoc"))
 
     def _get_sent_tokens(self, sentence_el):
         toks = []
-        words = sentence_el.xpath("word")
-        for w in words:
-            wid = self._set_prop_if_there(w, "id")
-            form = self._set_prop_if_there(w, "form")
-            lemma = self._set_prop_if_there(w, "lemma")
-            postag = self._set_prop_if_there(w, "postag")
-            head = self._set_prop_if_there(w, "head")
-            relation = self._set_prop_if_there(w, "relation")
-            cite = self._set_prop_if_there(w, "cite")
-            if self._is_artificial(w):
-                art_type = self._set_prop_if_there(w, "artificial")
-                t = Artificial(wid, form, lemma, postag, head, relation, cite, art_type)
+        for w in sentence_el.iterchildren("word"):
+            # all the attributes are read from the element's attribute map at once; missing ones are None
+            get = w.attrib.get
+            fields = (get("id"), get("form"), get("lemma"), get("postag"), get("head"), get("relation"), get("cite"))
+            art_type = get("artificial")
+            if art_type is not None:
+                t = Artificial(*fields, art_type)
             else:
-                t = Word(wid, form, lemma, postag, head, relation, cite)
+                t = Word(*fields)
             toks.append(t)
         return toks
 
-    def _get_sents_el(self, fileids=None):
-        if fileids is None:
-            fileids = self._fileids
-        elif isinstance(fileids, string_types):
-            fileids = [fileids]
+    def iter_annotated_sents(self, fileids=None):
+        """
+        Stream the annotated sentences of the treebank, one at a time. Unlike `annotated_sents`, the files are
+        never held in memory as a whole: memory stays constant whatever the size of the treebank.
 
-        sents = []
+        Parameters
+        ----------
+        fileids : None, list, str
+            the files to read (default: the whole corpus)
 
-        for f in fileids:
-            x = self.xml(f)
-            s = x.xpath("//sentence")
-            sents.extend(s)
+        Returns
+        -------
+        generator
+            of lists of Word or Artificial
+        """
+        for _, s in self._iter_sentence_els(fileids):
+            yield self._get_sent_tokens(s)
 
-        return sents
+    def iter_sentences(self, fileids=None):
+        """
+        Stream the metadata and the tokens of each sentence together, in a single pass over the files.
+
+        Returns
+        -------
+        generator
+            of (Sentence, list of Word or Artificial)
+        """
+        for _, s in self._iter_sentence_els(fileids):
+            yield self._get_sent_metadata(s), self._get_sent_tokens(s)
+
+    def to_dataframe(self, fileids=None):
+        """
+        The treebank as a table with one row per token (artificial nodes included), built in a single pass.
+        Sentence metadata are repeated on the rows of their tokens; columns with few distinct values
+        are stored as categoricals.
+
+        Returns
+        -------
+        pandas.DataFrame
+            columns: fileid, sentence_id, document_id, subdoc, id, form, lemma, postag, head, relation,
+            cite, artificial (None for real words)
+        """
+        import pandas as pd
+
+        names = ["fileid", "sentence_id", "document_id", "subdoc"] + list(Artificial._fields)
+        columns = [[] for _ in names]
+        for f, s in self._iter_sentence_els(fileids):
+            meta = (f,) + tuple(self._get_sent_metadata(s))
+            for t in self._get_sent_tokens(s):
+                row = meta + tuple(t) + ((None,) if isinstance(t, Word) else ())
+                for col, v in zip(columns, row):
+                    col.append(v)
+        df = pd.DataFrame(dict(zip(names, columns)), columns=names)
+        df = df.rename(columns={"type": "artificial"})
+        for c in ("fileid", "document_id", "subdoc", "postag", "relation", "artificial"):
+            df[c] = df[c].astype("category")
+        return df
+
+    def iter_sents(self, fileids=None):
+        """Stream the sentences as lists of forms (see `iter_annotated_sents`)"""
+        for _, s in self._iter_sentence_els(fileids):
+            yield [w.attrib["form"] for w in s.iterchildren("word")]
+
+    def iter_annotated_words(self, fileids=None):
+        for s in self.iter_annotated_sents(fileids):
+            yield from s
+
+    def iter_words(self, fileids=None):
+        for s in self.iter_sents(fileids):
+            yield from s
 
     def annotated_sents(self, fileids=None):
-        sents = self._get_sents_el(fileids)
-        annotated_sents = []
-        for s in sents:
-            toks = self._get_sent_tokens(s)
-            annotated_sents.append(toks)
-        return annotated_sents
+        return list(self.iter_annotated_sents(fileids))
 
     def sents(self, fileids=None):
-        sentels = self._get_sents_el(fileids)
-        sents = []
-        for s in sentels:
-            words = s.xpath("word")
-            sents.append([w.attrib["form"] for w in words])
-        return sents
+        return list(self.iter_sents(fileids))
 
     def annotated_words(self, fileids=None):
-        asents = self.annotated_sents(fileids)
-        return [w for s in asents for w in s]
+        return list(self.iter_annotated_words(fileids))
 
     def words(self, fileids=None):
-        awords = self.annotated_words(fileids)
-        return [w.form for w in awords]
+        return list(self.iter_words(fileids))
+
+    @staticmethod
+    def _token_map(tokens):
+        return tokens if isinstance(tokens, dict) else {t.id: t for t in tokens}
 
     def _is_governed_by_artificial(self, t, tokens):
-        h = t.head
-        for tok in tokens:
-            if tok.id == h:
-                if isinstance(tok, Artificial):
-                    return True
-                else:
-                    return False
+        """
+        Whether the head of a node is an Artificial; `tokens` is the sentence, as a list or as
+        an id -> token map (see `resolve_heads`), in which case the check takes constant time
+        """
+        return isinstance(self._token_map(tokens).get(t.head), Artificial)
 
     def _find_true_head(self, t, tokens):
         """
-        Checks a node's head. If this head is an Arificial then it (recursively) searches for the first
+        Checks a node's head. If this head is an Arificial then it searches for the first
         non-artificial node that is at the root of the subtree.
         Otherwise, it simply returns the original node's head
 
@@ -441,29 +905,83 @@ class AGLDTReader(XMLCorpusReader):
         ----------
         t : namedtuple
             Word or Artificial node
-        tokens : list
-            the full sentence, as a list of Artificial or Word
+        tokens : list or dict
+            the full sentence, as a list of Artificial or Word, or as an id -> token map
 
         Returns
         -------
         str : the id of the first Word element governing the whole structure
 
+        Raises
+        ------
+        ValueError
+            if the chain of artificial heads is a cycle
         """
-        arts_ids = [tok.id for tok in tokens if isinstance(tok, Artificial)]
+        by_id = self._token_map(tokens)
+        seen = set()
         h = t.head
-        if h not in arts_ids:
-            return h
-        else:
-            for tok in tokens:
-                if h == tok.id:
-                    # then we found the target immediate head
-                    true_head = tok.head
-                    # now let's check if th is an artificial
-                    if true_head in arts_ids:
-                        true_head = self._find_true_head(tok, tokens)
+        while isinstance(by_id.get(h), Artificial):
+            if h in seen:
+                raise ValueError("Cyclic artificial heads for token {}:{}".format(t.cite, t.id))
+            seen.add(h)
+            h = by_id[h].head
+        return h
+
+    def resolve_heads(self, sent, sentence=None):
+        """
+        Find the true head (see `_find_true_head`) of every node of a sentence in a single pass:
+        the chain of artificial heads above each node is followed only once, and the result is shared
+        by all the nodes that it governs.
+
+        Parameters
+        ----------
+        sent : list(named tuple)
+            the AGLDT sentence
+        sentence : object
+            identifier of the sentence (e.g. its id or position), copied to the diagnostics
+
+        Returns
+        -------
+        tuple : (dict, list)
+            the map of the node ids to their true head (None for the nodes governed by a cycle
+            of artificial nodes), and a list of HeadCycle, one for each of these nodes, with
+            the ids of the artificial nodes in the cycle
+        """
+        by_id = self._token_map(sent)
+        # true head of each artificial node, or None if it leads to a cycle
+        resolved = {}
+        cycles = {}
+
+        def resolve(h):
+            path = []
+            on_path = {}
+            while isinstance(by_id.get(h), Artificial) and h not in resolved:
+                if h in on_path:
+                    cycle = tuple(path[on_path[h]:])
+                    for a in cycle:
+                        cycles[a] = cycle
+                    break
+                on_path[h] = len(path)
+                path.append(h)
+                h = by_id[h].head
+            true_head = resolved.get(h, h) if h not in cycles else None
+            for a in path:
+                resolved[a] = true_head
+                if true_head is None and a not in cycles:
+                    cycles[a] = cycles[h]
             return true_head
 
-    def sent_to_dggraph(self, sent):
+        heads = {}
+        diagnostics = []
+        for t in sent:
+            true_head = resolve(t.head)
+            heads[t.id] = true_head
+            if true_head is None:
+                # the cycle is reported as the one that the chain above the head runs into
+                diagnostics.append(HeadCycle(sentence, t.id, t.cite, cycles[t.head]))
+        return heads, diagnostics
+
+    def sent_to_dggraph(self, sent, drop_artificial=False):
         """
         Creates a Dependency Graph object from an AGLDT sentence
 
@@ -471,6 +989,10 @@ class AGLDTReader(XMLCorpusReader):
         ----------
         sent : list(named tuple)
             the AGLDT sentence
+        drop_artificial : bool
+            if True, the artificial nodes are left out: the words that they govern are attached to their
+            true head (see `resolve_heads`), with the relation "ExD", and are renumbered.
+            Words governed by a cycle of artificial nodes are attached to the root.
 
         Returns
         -------
@@ -480,67 +1002,106 @@ class AGLDTReader(XMLCorpusReader):
 
         from nltk.parse import DependencyGraph
 
-        strsent = "\n".join(["{}\t{}\t{}\t{}".format(w.form, w.postag, w.head, w.relation) for w in sent])
+        rows = [(w.form, w.postag, w.head, w.relation) for w in sent]
+        if drop_artificial:
+            heads, _ = self.resolve_heads(sent)
+            words = [w for w in sent if isinstance(w, Word)]
+            new_ids = {w.id: str(i) for i, w in enumerate(words, 1)}
+            rows = []
+            for w in words:
+                h = heads[w.id]
+                relation = w.relation if h == w.head else "ExD"
+                h = "0" if h is None else new_ids.get(h, h)
+                rows.append((w.form, w.postag, h, relation))
+
+        strsent = "\n".join(["{}\t{}\t{}\t{}".format(*r) for r in rows])
         rootrel = "AuxZ"
-        for w in sent :
-            if w.head == '0':
-                rootrel = w.relation
+        for r in rows:
+            if r[2] == '0':
+                rootrel = r[3]
                 break
         g = DependencyGraph(strsent, cell_separator="\t", top_relation_label=rootrel)
 
         return g
 
+    def _conll_lines(self, sent, heads, dialect):
+        """The CoNLL rows of the words of a sentence; the words governed by a cycle (head None) are skipped"""
+        words = [t for t in sent if isinstance(t, Word) and heads[t.id] is not None]
+        if dialect != "2009":
+            # CoNLL-X and CoNLL-U want consecutive ids: the words are renumbered after dropping the artificial
+            # nodes and the skipped words; the words governed by a skipped word are attached to the root
+            new_ids = {w.id: str(i) for i, w in enumerate(words, 1)}
+            dropped = {t.id for t in sent} - set(new_ids)
+        for w in words:
+            realh = heads[w.id]
+            relation = w.relation if realh == w.head else "ExD"
+            postag = w.postag or ""
+            lemma = w.lemma if w.lemma is not None else "Unknown"
+            feat = "|".join(postag) or "_"
+            if dialect == "2009":
+                pos = postag[0] if postag else "x--------"
+                yield _CONLL_ROWS[dialect].format(w.id, w.form, lemma, pos, feat, realh, relation)
+                continue
+            if realh in dropped:
+                realh, relation = "0", "ExD"
+            wid, realh = new_ids[w.id], new_ids.get(realh, realh)
+            if dialect == "X":
+                yield _CONLL_ROWS[dialect].format(wid, w.form, lemma, postag[:1] or "_", postag or "_", feat,
+                                                  realh, relation)
+            else:
+                upos, feats = postag_to_ud(postag)
+                yield _CONLL_ROWS[dialect].format(wid, w.form, lemma, upos, postag or "_", feats, realh, relation)
 
-
-
-    def export_to_conll(self, annotated_sents, out_file, dialect='2009'):
+    def export_to_conll(self, annotated_sents, out_file, dialect='2009', chunk_size=1000):
         """
-        Save the sentences passed to a CoNLL file.
+        Save the sentences passed to a CoNLL file. The sentences are written as they come, in chunks of
+        `chunk_size`, so that a generator (e.g. `iter_annotated_sents`) can be exported with constant memory.
+        Artificial nodes are left out: the words that they govern are attached to their true head
+        (see `resolve_heads`), with the relation "ExD".
 
         Parameters
         ----------
-        annotated_sents : list
-            list of annotated sentences. Each sentence must contain the token as named tuples:
-            Word or Artificial. You can use the method `annotated_sentence` to get them
-        out_file : str
-            filename (and path) to save the output
+        annotated_sents : iter
+            the annotated sentences. Each sentence must contain the token as named tuples:
+            Word or Artificial. You can use the methods `annotated_sents` or `iter_annotated_sents` to get them
+        out_file : str or file
+            filename (and path) to save the output, or a file object open for writing (text mode)
         dialect : str
-            the CoNLL dialect
-        """
-        import logging
-
-        c = ""
-        if dialect == '2009':
-            #  ID FORM LEMMA PLEMMA POS PPOS FEAT PFEAT HEAD PHEAD DEPREL PDEPREL FILLPRED PRED APREDs
-            l = "{}\t{}\t{}\t_\t{}\t_\t{}\t_\t{}\t_\t{}\t_\t_\t_\t_\n"
-
-        for s in annotated_sents:
-            toks = [t for t in s if isinstance(t, Word)]
-            for w in toks:
-                try:
-                    realh = self._find_true_head(w,s)
-                except RecursionError:
-                    logging.error("Problem with the head of token: {}:{}".format(w.cite, w.id))
-                    continue
-                relation = w.relation if realh == w.head else "ExD"
-                try:
-                    pos = w.postag[0]
-                except IndexError:
-                    pos = "x--------"
-                lemma = w.lemma if w.lemma is not None else "Unknown"
-                feat = "|".join(w.postag)
-                form = w.form.replace("̓", "'")
-                c += l.format(w.id, w.form, lemma, pos, feat, realh, relation)
-            c+="\n"
-
-        with open(out_file, "w") as out:
-            out.write(c)
-
-
-
-
-
-
-
-
+            the CoNLL dialect: "2009" (default), "X" (CoNLL-X) or "U" (CoNLL-U; the postags are converted
+            to UPOS and FEATS, while the AGLDT tag is kept as XPOS and the relations are left as they are).
+            In CoNLL-X and CoNLL-U the words are renumbered, and those whose head was left out
+            are attached to the root
+        chunk_size : int
+            number of sentences written at once (at least 1)
 
+        Returns
+        -------
+        list(HeadCycle)
+            the words that were left out because they are governed by a cycle of artificial nodes;
+            `sentence` is the position of their sentence in `annotated_sents`
+        """
+        dialect = str(dialect).upper()
+        if dialect not in _CONLL_ROWS:
+            raise ValueError("Unknown CoNLL dialect: {} (use one of {})".format(dialect, ", ".join(_CONLL_ROWS)))
+        if chunk_size < 1:
+            raise ValueError("chunk_size must be at least 1")
+
+        if hasattr(out_file, "write"):
+            return self._write_conll(annotated_sents, out_file, dialect, chunk_size)
+        with open(out_file, "w", encoding="utf8") as out:
+            return self._write_conll(annotated_sents, out, dialect, chunk_size)
+
+    def _write_conll(self, annotated_sents, out, dialect, chunk_size):
+        diagnostics = []
+        buf = []
+        for n, s in enumerate(annotated_sents):
+            heads, cycles = self.resolve_heads(s, sentence=n)
+            word_ids = {t.id for t in s if isinstance(t, Word)}
+            diagnostics.extend(d for d in cycles if d.id in word_ids)
+            buf.extend(self._conll_lines(s, heads, dialect))
+            buf.append("\n")
+            if (n + 1) % chunk_size == 0:
+                out.write("".join(buf))
+                buf = []
+        out.write("".join(buf))
+        return diagnostics
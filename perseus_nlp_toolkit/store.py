@@ -0,0 +1,269 @@
+"""
+On-disk store of the tokenized texts of a `CapitainCorpusReader`.
+
+Each file of the corpus is tokenized once and its (text_id, cite, token) stream is saved in a small
+columnar `.npz` file: tokens and cites are interned in two string tables (see `utils.pack_strings`)
+and every token is stored as a pair of integer ids. A JSON manifest records, for each file, the hash
+of its content and a fingerprint of the tokenizer configuration, so that `CorpusStore.update` only
+re-tokenizes the files whose source or tokenizer has changed.
+"""
+
+from collections import namedtuple
+import hashlib
+import json
+import os
+from urllib.parse import quote
+
+import numpy as np
+
+from .utils import pack_strings, intern_strings, StringTable
+
+
+_STORE_VERSION = 2
+_MANIFEST = "manifest.json"
+
+StoredText = namedtuple("StoredText", ["text_id", "token_ids", "tokens", "cite_ids", "cites"])
+
+
+def _describe(obj):
+    """
+    Class name and scalar attributes of a tokenizer, in a JSON-friendly form. Unset attributes and
+    compiled regexps are left out: NLTK tokenizers compile their pattern (kept as a string) on first use.
+    """
+    cls = type(obj)
+    attrs = [[k, v] for k, v in sorted(getattr(obj, "__dict__", {}).items())
+             if isinstance(v, (str, int, float, bool))]
+    return [cls.__module__ + "." + cls.__qualname__, attrs]
+
+
+def tokenizer_fingerprint(reader):
+    """
+    Hash of the reader settings that change the (cite, token) stream of a file: the word tokenizer
+    (class and configuration) and the TEI tags that are excluded from the text.
+
+    Parameters
+    ----------
+    reader : CapitainCorpusReader
+
+    Returns
+    -------
+    str
+    """
+    config = {"version": _STORE_VERSION,
+              "word_tokenizer": _describe(reader._word_tokenizer),
+              "exclude_tags": list(reader._tags_to_exclude)}
+    return hashlib.sha1(json.dumps(config, sort_keys=True).encode("utf8")).hexdigest()
+
+
+def _file_hash(path):
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class CorpusStore:
+    """
+    Persistent cache of the tokenized files of a `CapitainCorpusReader`.
+
+    Examples
+    --------
+    >>> reader = CapitainCorpusReader(root, r".*\\.xml")
+    >>> store = CorpusStore("corpus_store", reader)
+    >>> store.update(workers=4)  # tokenizes only the new or modified files
+    >>> cite_words = store.corpus_cite_words()
+    """
+
+    def __init__(self, path, reader):
+        """
+        Parameters
+        ----------
+        path : str
+            the directory of the store; it is created if it does not exist
+        reader : CapitainCorpusReader
+            the reader used to tokenize the files
+        """
+        self._path = path
+        self._reader = reader
+        self._fingerprint = tokenizer_fingerprint(reader)
+        os.makedirs(path, exist_ok=True)
+        self._manifest = self._load_manifest()
+
+    def _load_manifest(self):
+        try:
+            with open(os.path.join(self._path, _MANIFEST), encoding="utf8") as f:
+                manifest = json.load(f)
+        except FileNotFoundError:
+            return {"version": _STORE_VERSION, "files": {}}
+        if manifest.get("version") != _STORE_VERSION:
+            return {"version": _STORE_VERSION, "files": {}}
+        return manifest
+
+    def _save_manifest(self):
+        tmp = os.path.join(self._path, _MANIFEST + ".tmp")
+        with open(tmp, "w", encoding="utf8") as f:
+            json.dump(self._manifest, f, ensure_ascii=False, indent=1)
+        os.replace(tmp, os.path.join(self._path, _MANIFEST))
+
+    def _data_file(self, fileid):
+        # percent-escaping keeps distinct fileids apart (e.g. "a/b.xml" and "a__b.xml")
+        return os.path.join(self._path, quote(fileid, safe="") + ".npz")
+
+    def fileids(self):
+        """The files of the reader's corpus"""
+        return self._reader.fileids()
+
+    def content_hash(self, fileid):
+        """Hash of the content of a stored file, as it was when it was tokenized"""
+        return self._manifest["files"][fileid]["hash"]
+
+    def text_id(self, fileid):
+        return self._manifest["files"][fileid]["text_id"]
+
+    def stale(self):
+        """
+        Files that have to be (re-)tokenized: those that are not in the store, whose content has changed
+        or that were tokenized with a different configuration.
+        The content is hashed only for the files whose size or modification time has changed.
+
+        Returns
+        -------
+        list
+        """
+        stale = []
+        for f in self.fileids():
+            entry = self._manifest["files"].get(f)
+            if entry is None or entry["tokenizer"] != self._fingerprint:
+                stale.append(f)
+                continue
+            path = self._reader.abspath(f)
+            st = os.stat(path)
+            if (entry["size"], entry["mtime"]) == (st.st_size, st.st_mtime):
+                continue
+            if _file_hash(path) != entry["hash"]:
+                stale.append(f)
+            else:
+                # touched, but not changed
+                entry["size"], entry["mtime"] = st.st_size, st.st_mtime
+        return stale
+
+    def update(self, workers=1, chunksize=1):
+        """
+        Tokenize the stale files and forget those that are no longer in the corpus.
+        A file is hashed before it is tokenized; if it changes while it is being tokenized,
+        it is not stored and stays stale.
+
+        Parameters
+        ----------
+        workers : int
+            number of processes used to tokenize the files (see `CapitainCorpusReader.corpus_cite_words`)
+        chunksize : int
+            number of files sent to a worker at once
+
+        Returns
+        -------
+        list
+            the files that were (re-)tokenized and stored
+        """
+        stale = self.stale()
+        files = self._manifest["files"]
+        for f in set(files) - set(self.fileids()):
+            del files[f]
+            if os.path.exists(self._data_file(f)):
+                os.remove(self._data_file(f))
+
+        # the state of the files as they are before tokenization, which is what the tokens will reflect
+        before = {}
+        for f in stale:
+            path = self._reader.abspath(f)
+            st = os.stat(path)
+            before[f] = (_file_hash(path), st.st_size, st.st_mtime)
+
+        updated = []
+        results = self._reader._map_fileids("_file_cite_words", stale, workers, chunksize)
+        for f, cite_words in zip(stale, results):
+            content_hash, size, mtime = before[f]
+            st = os.stat(self._reader.abspath(f))
+            if (st.st_size, st.st_mtime) != (size, mtime):
+                # modified while it was tokenized: the tokens may come from either version
+                files.pop(f, None)
+                continue
+            self._write(f, cite_words)
+            files[f] = {"hash": content_hash, "size": size, "mtime": mtime,
+                        "tokenizer": self._fingerprint, "text_id": self._reader._text_id(f),
+                        "tokens": len(cite_words)}
+            updated.append(f)
+        self._save_manifest()
+        return updated
+
+    def _write(self, fileid, cite_words):
+        cites, cite_ids = intern_strings((c for _, c, _ in cite_words), len(cite_words))
+        tokens, token_ids = intern_strings((w for _, _, w in cite_words), len(cite_words))
+        tok_blob, tok_offsets = pack_strings(tokens)
+        cite_blob, cite_offsets = pack_strings(cites)
+        tmp = self._data_file(fileid) + ".tmp"
+        with open(tmp, "wb") as out:
+            np.savez(out, token_ids=token_ids, cite_ids=cite_ids,
+                     tokens=np.frombuffer(tok_blob, dtype=np.uint8), token_offsets=tok_offsets,
+                     cites=np.frombuffer(cite_blob, dtype=np.uint8), cite_offsets=cite_offsets)
+        os.replace(tmp, self._data_file(fileid))
+
+    def load(self, fileid):
+        """
+        The columns of a stored file.
+
+        Parameters
+        ----------
+        fileid : str
+
+        Returns
+        -------
+        StoredText
+            text_id, token ids, token table, cite ids and cite table
+        """
+        entry = self._manifest["files"].get(fileid)
+        if entry is None:
+            raise KeyError("{} is not in the store; call update() first".format(fileid))
+        with np.load(self._data_file(fileid)) as data:
+            return StoredText(entry["text_id"],
+                              data["token_ids"], StringTable(data["tokens"].tobytes(), data["token_offsets"]),
+                              data["cite_ids"], StringTable(data["cites"].tobytes(), data["cite_offsets"]))
+
+    def words(self, fileid):
+        """The tokens of a stored file, as a list of str"""
+        text = self.load(fileid)
+        tokens = [text.tokens.string(i) for i in range(len(text.tokens))]
+        return [tokens[i] for i in text.token_ids.tolist()]
+
+    def cite_words(self, fileid):
+        """The tokens of a stored file, as a list of (cite, token)"""
+        text = self.load(fileid)
+        tokens = [text.tokens.string(i) for i in range(len(text.tokens))]
+        cites = [text.cites.string(i) for i in range(len(text.cites))]
+        return [(cites[c], tokens[t]) for c, t in zip(text.cite_ids.tolist(), text.token_ids.tolist())]
+
+    def iter_corpus_cite_words(self):
+        """
+        Same as `CapitainCorpusReader.iter_corpus_cite_words`, but read from the store.
+
+        Returns
+        -------
+        generator
+            of (text_id, cite, token)
+        """
+        for f in self.fileids():
+            text_id = self.text_id(f)
+            for c, w in self.cite_words(f):
+                yield text_id, c, w
+
+    def corpus_cite_words(self):
+        """
+        Same as `CapitainCorpusReader.corpus_cite_words`, but read from the store.
+
+        Returns
+        -------
+        list (tuple)
+            list of (text_id, cite, token)
+        """
+        return list(self.iter_corpus_cite_words())
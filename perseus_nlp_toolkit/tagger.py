@@ -6,17 +6,80 @@ from .utils import MateCaller
 
 
 class MateMorphTagger(MateCaller):
-    def __init__(self, mate_folder, path_to_model, java_options="-Xmx3G"):
-        MateCaller.__init__(mate_folder, path_to_model, java_options)
+    def __init__(self, mate_folder, path_to_model, java_options="-Xmx3G", persistent=False):
+        MateCaller.__init__(self, mate_folder, path_to_model, java_options, persistent)
         self._java_class = 'is2.tag.Tagger'
 
-    def tag_sents(self, sents, lemma_col=None, outfile=None):
-        c = self._annotate_sents(sents, self._java_class, lemma_col, outfile)
+    def tag_sents(self, sents, lemma_col=None, outfile=None, workers=1, worker_java_options=None):
+        """
+        Tag a list of sentences.
 
-    def tag_cite_sents(self, cite_sents):
+        Parameters
+        ----------
+        sents : list
+            the sentences (lists of tokens)
+        lemma_col : int
+            index of the lemma in the tokens (or None)
+        outfile : str
+            if given, the CoNLL output of Mate is also saved there
+        workers : int
+            if greater than 1, the sentences are split in shards tagged by as many Mate processes in parallel
+        worker_java_options : str
+            JVM options of each parallel worker (e.g. "-Xmx2G"); by default, those of the tagger
+
+        Returns
+        -------
+        list(list(tuple)) : the sentences as lists of (form, tag)
+        """
+        c = self._annotate_sents(sents, self._java_class, lemma_col, None, outfile, workers, worker_java_options)
+        return self._conll2tagged(c)
+
+    def iter_tag_sents(self, sents, lemma_col=None, chunk_size=1000):
+        """
+        Tag the sentences in chunks and generate the tagged sentences as they come back from Mate.
+        Memory stays flat whatever the size of the input, and the output can be consumed
+        (e.g. by `MorpheusLookupLemmatizer.iter_lemmatize_sentences`) before tagging is over.
+
+        Parameters
+        ----------
+        sents : iter
+            list or generator of sentences (lists of tokens)
+        lemma_col : int
+            index of the lemma in the tokens (or None)
+        chunk_size : int
+            number of sentences sent to Mate at once. Unless the tagger was created with `persistent=True`,
+            every chunk starts a new JVM, which loads the model again: with a small `chunk_size`,
+            most of the time goes there
+
+        Returns
+        -------
+        generator : the tagged sentences, as lists of (form, tag); empty sentences come back empty
+        """
+        for c in self._iter_annotate_sents(sents, self._java_class, lemma_col, None, chunk_size):
+            yield self._conll2tagged_sent(c)
+
+    def iter_tag_cite_sents(self, cite_sents, chunk_size=1000):
+        """
+        Streaming version of `tag_cite_sents`: generate the sentences as lists of (cite, form, tag)
+        """
+        from collections import deque
+
+        cites = deque()
+
+        def forms():
+            for s in cite_sents:
+                cites.append([w[0] for w in s])
+                yield [w[1] for w in s]
+
+        for ts in self.iter_tag_sents(forms(), chunk_size=chunk_size):
+            cs = cites.popleft()
+            assert len(ts) == len(cs), "Tagged words and citations not in sync"
+            yield [(cw, tw[0], tw[1]) for tw, cw in zip(ts, cs)]
+
+    def tag_cite_sents(self, cite_sents, workers=1, worker_java_options=None):
         _sents = [[w[1] for w in s] for s in cite_sents]
         _cites = [[w[0] for w in s] for s in cite_sents]
-        tagged = self.tag_sents(_sents)
+        tagged = self.tag_sents(_sents, workers=workers, worker_java_options=worker_java_options)
         tagged_cited = []
         assert len(tagged) == len(_cites), "Tagged sentences and citations not in sync"
         for ts, cs in zip(tagged, _cites):
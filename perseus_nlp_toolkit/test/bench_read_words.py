@@ -0,0 +1,62 @@
+"""
+Benchmark of the citation lookup in `CapitainCorpusReader._read_words` on a line-cited poem.
+
+Compares the old linear scan of the passages for each token with the linear sweep used now
+(`_sweep_cites`) and with the binary search of `_return_cite`. The poem is synthetic (600 lines per book),
+so the benchmark does not need a corpus or MyCapytain's parsing.
+
+Run with: python -m perseus_nlp_toolkit.test.bench_read_words [number of books, default 6]
+"""
+import random
+import sys
+import time
+
+from nltk.tokenize import WordPunctTokenizer
+
+from perseus_nlp_toolkit.reader import CapitainCorpusReader
+
+
+def poem(books=24, lines=600, seed=0):
+    rnd = random.Random(seed)
+    vocab = "μῆνιν ἄειδε θεὰ Πηληϊάδεω Ἀχιλῆος οὐλομένην ἣ μυρί᾽ Ἀχαιοῖς ἄλγε᾽ ἔθηκε , · .".split()
+    refs, paras = [], []
+    b = 0
+    for book in range(1, books + 1):
+        for line in range(1, lines + 1):
+            t = " ".join(rnd.choice(vocab) for _ in range(8)) + " "
+            paras.append(t)
+            refs.append(("{}.{}".format(book, line), b, b + len(t)))
+            b += len(t)
+    return refs, "".join(paras)
+
+
+def linear_scan(span, cites):
+    # the lookup used before: scan the passages from the beginning for every token
+    for c in cites:
+        if span[-1] <= c[-1]:
+            return c[0]
+
+
+def main(books=6):
+    reader = CapitainCorpusReader.__new__(CapitainCorpusReader)
+    refs, text = poem(books)
+    spans = list(WordPunctTokenizer().span_tokenize(text))
+    print("{} lines, {} tokens".format(len(refs), len(spans)))
+
+    t = time.perf_counter()
+    old = [linear_scan(s, refs) for s in spans]
+    print("linear scan:   {:.3f}s".format(time.perf_counter() - t))
+
+    t = time.perf_counter()
+    bisected = [reader._return_cite(s, refs) for s in spans]
+    print("binary search: {:.3f}s".format(time.perf_counter() - t))
+
+    t = time.perf_counter()
+    swept = list(reader._sweep_cites(spans, refs))
+    print("sweep:         {:.3f}s".format(time.perf_counter() - t))
+
+    assert old == bisected == swept
+
+
+if __name__ == "__main__":
+    main(*[int(a) for a in sys.argv[1:2]])
@@ -0,0 +1,109 @@
+import os
+import types
+import pytest
+from perseus_nlp_toolkit.reader import AGLDTReader
+from perseus_nlp_toolkit.utils import Word, Artificial
+
+root = os.path.join(os.path.dirname(__file__), "data")
+tb = "treebank-test.xml"
+
+
+@pytest.fixture
+def reader():
+    return AGLDTReader(root, tb)
+
+
+def test_streaming_sents(reader):
+    sents = reader.iter_annotated_sents()
+    assert isinstance(sents, types.GeneratorType)
+    first = next(sents)
+    assert first[1] == Word("2", "ἀνὴρ", "ἀνήρ", "n-s---mn-", "3", "SBJ", "urn:cts:greekLit:tlg9999.tlg001:1.1")
+    second = next(sents)
+    assert isinstance(second[-1], Artificial) and second[-1].type == "elliptic"
+    assert reader.sents()[0] == ["ὁ", "ἀνὴρ", "λέγει", "."]
+    assert reader.words()[4:6] == ["καὶ", "λόγον"]
+    assert [m.subdoc for m in reader.get_sentences_metadata()] == ["1.1", "1.2"]
+    assert reader.annotated_sents() == [s for s in reader.iter_annotated_sents()]
+
+
+def test_single_pass(reader):
+    sentences = list(reader.iter_sentences())
+    assert [m for m, _ in sentences] == reader.get_sentences_metadata()
+    assert [t for _, t in sentences] == reader.annotated_sents()
+
+
+def test_to_dataframe(reader):
+    df = reader.to_dataframe()
+    assert len(df) == 10
+    assert df.columns.tolist() == ["fileid", "sentence_id", "document_id", "subdoc", "id", "form", "lemma",
+                                   "postag", "head", "relation", "cite", "artificial"]
+    assert df[df.sentence_id == "2"].form.tolist() == ["καὶ", "λόγον", "ἔργον", "·", "[0]", "[1]"]
+    assert df.artificial.notna().sum() == 2
+    assert df.groupby("relation", observed=True).size()["OBJ_CO"] == 3
+
+
+def test_resolve_heads(reader):
+    sent = reader.annotated_sents()[1]
+    heads, cycles = reader.resolve_heads(sent)
+    # λόγον and ἔργον hang from the elliptic [0], which hangs from καὶ
+    assert heads == {"1": "0", "2": "1", "3": "1", "4": "0", "5": "1", "6": "0"}
+    assert cycles == []
+    by_id = {t.id: t for t in sent}
+    assert reader._find_true_head(by_id["2"], by_id) == "1"
+    assert reader._is_governed_by_artificial(by_id["1"], sent)
+
+    cyclic = [t._replace(head={"5": "6", "6": "5"}[t.id]) if t.id in ("5", "6") else t for t in sent]
+    heads, cycles = reader.resolve_heads(cyclic, sentence=1)
+    assert heads["1"] is None and heads["2"] is None and heads["3"] == "1" and heads["4"] == "0"
+    assert [(d.sentence, d.id) for d in cycles] == [(1, "1"), (1, "2"), (1, "5"), (1, "6")]
+    assert set(cycles[0].cycle) == {"5", "6"}
+    with pytest.raises(ValueError):
+        reader._find_true_head(by_id["2"], cyclic)
+
+
+def test_dggraph(reader):
+    sent = reader.annotated_sents()[1]
+    g = reader.sent_to_dggraph(sent, drop_artificial=True)
+    assert [g.nodes[i]["word"] for i in range(1, 5)] == ["καὶ", "λόγον", "ἔργον", "·"]
+    assert g.nodes[2]["head"] == 1 and g.nodes[2]["rel"] == "ExD"
+    assert len(reader.sent_to_dggraph(sent).nodes) == 7
+
+
+def test_export_cycles(reader, tmp_path):
+    sent = reader.annotated_sents()[1]
+    cyclic = [t._replace(head={"5": "6", "6": "5"}[t.id]) if t.id in ("5", "6") else t for t in sent]
+    out = str(tmp_path / "out.conll")
+    diagnostics = reader.export_to_conll([reader.annotated_sents()[0], cyclic], out)
+    assert [(d.sentence, d.id) for d in diagnostics] == [(1, "1"), (1, "2")]
+    rows = [l.split("\t") for l in open(out, encoding="utf8").read().split("\n") if l]
+    assert [r[1] for r in rows] == ["ὁ", "ἀνὴρ", "λέγει", ".", "ἔργον", "·"]
+
+    for dialect in ("X", "U"):
+        reader.export_to_conll([cyclic], out, dialect=dialect)
+        rows = [l.split("\t") for l in open(out, encoding="utf8").read().split("\n") if l]
+        # ids without gaps; ἔργον's head (καὶ) was left out, so it is attached to the root
+        assert [(r[0], r[1], r[6], r[7]) for r in rows] == [("1", "ἔργον", "0", "ExD"), ("2", "·", "0", "AuxK")]
+
+
+def test_export_dialects(reader, tmp_path):
+    import io
+
+    out = io.StringIO()
+    reader.export_to_conll(reader.iter_annotated_sents(), out, dialect="U", chunk_size=1)
+    sents = out.getvalue().split("\n\n")
+    rows = [l.split("\t") for l in sents[0].split("\n")]
+    assert rows[1][:8] == ["2", "ἀνὴρ", "ἀνήρ", "NOUN", "n-s---mn-", "Case=Nom|Gender=Masc|Number=Sing", "3", "SBJ"]
+    assert all(len(r) == 10 for r in rows)
+    # λόγον hangs from the elliptic node [0]: it is attached to καὶ
+    assert sents[1].split("\n")[1].split("\t")[6:8] == ["1", "ExD"]
+
+    path = str(tmp_path / "out.conllx")
+    reader.export_to_conll(reader.annotated_sents(), path, dialect="X")
+    rows = [l.split("\t") for l in open(path, encoding="utf8").read().split("\n") if l]
+    assert len(rows) == 8 and rows[1][3:5] == ["n", "n-s---mn-"]
+    with pytest.raises(ValueError):
+        reader.export_to_conll([], path, dialect="2003")
+    for chunk_size in (0, -1):
+        with pytest.raises(ValueError):
+            reader.export_to_conll(reader.iter_annotated_sents(), path, chunk_size=chunk_size)
+    assert len(open(path, encoding="utf8").read().split("\n\n")) == 3  # the file was left as it was
@@ -0,0 +1,87 @@
+import pytest
+import os
+from perseus_nlp_toolkit import CapitainCorpusReader
+
+root = os.path.join(os.path.dirname(__file__), "data")
+poem = "tlg9999.tlg001.test-grc1.xml"
+
+
+@pytest.fixture
+def reader():
+    return CapitainCorpusReader(root, poem)
+
+
+@pytest.fixture
+def lazy_reader():
+    return CapitainCorpusReader(root, poem, lazy=True)
+
+
+def test_lazy_words(reader, lazy_reader):
+    assert list(lazy_reader.words()) == reader.words()
+
+
+def test_lazy_cite_words(reader, lazy_reader):
+    view = lazy_reader.cite_words(poem)
+    assert list(view) == reader.cite_words(poem)
+    assert view[5] == ('1.2', 'οὐλομένην')
+
+
+def test_view_random_access(lazy_reader):
+    view = lazy_reader.cite_words(poem)
+    assert view.passage("2.2")[:2] == [('2.2', 'ἐξ'), ('2.2', 'οὗ')]
+    assert view[view.ref_offset("2.1")] == ('2.1', 'οἰωνοῖσί')
+
+
+def test_parse_once(reader):
+    reader.raw()
+    reader.words()
+    reader.cite_sents(poem)
+    info = reader.cache_info()
+    assert (info.misses, info.hits) == (1, 2)
+
+
+def test_xpath_passage_engine(reader):
+    fast = CapitainCorpusReader(root, poem, passage_engine="xpath")
+    expected = reader._read_paras(reader._get_citable_text(poem), include_cites=True)
+    assert fast._read_paras(fast._get_citable_text(poem), include_cites=True) == expected
+    assert fast.cite_words(poem) == reader.cite_words(poem)
+
+
+def test_cite_sents(reader):
+    cite_sents = reader.cite_sents(poem)
+    assert [[w for c, w in s] for s in cite_sents] == reader.sents(poem)
+    assert [c for s in cite_sents for c, w in s] == [c for c, w in reader.cite_words(poem)]
+
+
+def test_cite_sents_without_spans(reader):
+    import re
+
+    class PunctTokenizer:
+        """A sentence tokenizer that only has `tokenize`"""
+
+        def tokenize(self, text):
+            return [s for s in re.split(r"(?<=[.,;·])\s+", text) if s.strip()]
+
+    plain = CapitainCorpusReader(root, poem, sent_tokenizer=PunctTokenizer())
+    cite_sents = plain.cite_sents(poem)
+    assert len(cite_sents) > 1
+    assert [[w for c, w in s] for s in cite_sents] == plain.sents(poem)
+    assert [cw for s in cite_sents for cw in s] == reader.cite_words(poem)
+
+
+def test_parallel_readers(reader, tmp_path):
+    import shutil
+
+    fileids = [poem, poem]
+    assert reader.words(fileids, workers=2) == reader.words(fileids)
+    assert reader.sents(fileids, workers=2) == reader.sents(fileids)
+
+    # enough files for the pool to refill its window of pending chunks
+    names = ["tlg9999.tlg{:03d}.test-grc1.xml".format(i) for i in range(1, 8)]
+    for name in names:
+        shutil.copy(os.path.join(root, poem), str(tmp_path / name))
+    corpus = CapitainCorpusReader(str(tmp_path), r".*\.xml")
+    expected = corpus.corpus_cite_words()
+    assert [t for t, _, _ in expected[::len(expected) // 7]] == [n[:14] for n in names]
+    assert corpus.corpus_cite_words(workers=2) == expected
+    assert list(corpus.iter_corpus_cite_words(workers=2, chunksize=3)) == expected
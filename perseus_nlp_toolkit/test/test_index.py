@@ -0,0 +1,89 @@
+import os
+import shutil
+import numpy as np
+import pytest
+from perseus_nlp_toolkit import CapitainCorpusReader
+from perseus_nlp_toolkit.store import CorpusStore
+from perseus_nlp_toolkit.index import CorpusIndex, encode_varints, decode_varints
+
+data = os.path.join(os.path.dirname(__file__), "data")
+poem = "tlg9999.tlg001.test-grc1.xml"
+
+
+@pytest.fixture
+def store(tmp_path):
+    root = tmp_path / "corpus"
+    root.mkdir()
+    shutil.copy(os.path.join(data, poem), str(root / poem))
+    store = CorpusStore(str(tmp_path / "store"), CapitainCorpusReader(str(root), poem))
+    store.update()
+    return store
+
+
+def test_varints():
+    values = np.array([0, 1, 127, 128, 300, 2 ** 35, 2 ** 64 - 1], dtype=np.uint64)
+    buf, nbytes = encode_varints(values)
+    assert nbytes.tolist() == [1, 1, 1, 2, 2, 6, 10]
+    assert decode_varints(buf).tolist() == values.tolist()
+
+
+def test_index_concordance(store, tmp_path):
+    index = CorpusIndex(str(tmp_path / "index"))
+    assert index.update(store) == [poem]
+    words = store.words(poem)
+    word = words[5]
+    lines = CorpusIndex(str(tmp_path / "index")).find_concordance(word)
+    assert [l.offset for l in lines] == [i for i, w in enumerate(words) if w == word]
+    assert lines[0].cite == "tlg9999.tlg001:1.2"
+    assert index.count(word) == len(lines)
+    assert index.count("missing") == 0
+
+
+def test_index_update(store, tmp_path):
+    index = CorpusIndex(str(tmp_path / "index"))
+    index.update(store)
+    assert index.update(store) == []
+
+    path = store._reader.abspath(poem)
+    with open(path, encoding="utf8") as f:
+        xml = f.read()
+    with open(path, "w", encoding="utf8") as f:
+        f.write(xml.replace("οὐλομένην", "ὀλομένην"))
+    store.update()
+    assert index.update(store) == [poem]
+    assert index.count("οὐλομένην") == 0
+    assert index.count("ὀλομένην") == 1
+    assert index.fileids() == [poem]
+
+
+def test_index_compact(store, tmp_path):
+    path = str(tmp_path / "index")
+    index = CorpusIndex(path)
+    index.update(store)
+    word = store.words(poem)[5]
+    expected = [(l.offset, l.cite, l.line) for l in index.find_concordance(word)]
+    cite_words = store.cite_words(poem)
+    index.add([("other.xml", None, "tlg9999.tlg002", cite_words)])
+    index.add([("other.xml", None, "tlg9999.tlg002", cite_words[:10])])
+    index.remove(["other.xml"])
+    assert len(os.listdir(path)) == 4
+
+    assert index.compact() == "seg_000004"
+    assert sorted(os.listdir(path)) == ["index.json", "seg_000004"]
+    assert index.compact() is None
+    index = CorpusIndex(path)
+    assert index.keys() == {poem: store.content_hash(poem)}
+    assert [(l.offset, l.cite, l.line) for l in index.find_concordance(word)] == expected
+
+
+def test_index_orphan_segments(store, tmp_path):
+    path = str(tmp_path / "index")
+    index = CorpusIndex(path)
+    index.update(store)
+    # a segment written by an add() that crashed before saving the manifest
+    os.makedirs(os.path.join(path, "seg_000002"))
+    index.add([("other.xml", None, "tlg9999.tlg002", store.cite_words(poem))])
+    assert index.fileids() == [poem, "other.xml"]
+    os.makedirs(os.path.join(path, "seg_000007"))
+    CorpusIndex(path)
+    assert sorted(os.listdir(path)) == ["index.json", "seg_000001", "seg_000003"]
@@ -0,0 +1,82 @@
+import pytest
+from perseus_nlp_toolkit.lemmatize import MorpheusLookupLemmatizer, compile_morpheus_table
+
+table = """Form,Tag,Lemma
+λόγου,n-s---mg-,λόγος
+λόγου,n-s---mg-,λόγιον
+λόγος,n-s---mn-,λόγος
+ἔλεγε,v3siia---,λέγω
+"""
+
+
+@pytest.fixture
+def morpheus_csv(tmp_path):
+    import bz2
+    p = tmp_path / "morpheus.csv.bz2"
+    p.write_bytes(bz2.compress(table.encode("utf8")))
+    return str(p)
+
+
+def test_lemmatize_word(morpheus_csv):
+    lemmatizer = MorpheusLookupLemmatizer(morpheus_csv)
+    assert lemmatizer.lemmatize_word("λόγου", "n|-|s|-|-|-|m|g|-") == ("λόγου", "λόγος", "n-s---mg-")
+    assert lemmatizer.lemmatize_word("λόγου", "n-p---mg-") == ("λόγου", "", "n-p---mg-")
+    assert lemmatizer.lemmatize_word(",", "u_") == (",", "punct", "u--------")
+
+
+def test_form_fallback(morpheus_csv):
+    lemmatizer = MorpheusLookupLemmatizer(morpheus_csv, form_fallback=True)
+    assert lemmatizer.lemmatize_word("λόγου", "n-p---mg-")[1] == "λόγος"
+
+
+def test_lemmatize_sentences(morpheus_csv):
+    lemmatizer = MorpheusLookupLemmatizer(morpheus_csv)
+    sents = [[("1.1", "λόγος", "n-s---mn-"), ("1.1", "ἔλεγε", "v3siia---")], [], [("1.2", "·", "u_")]]
+    assert lemmatizer.lemmatize_sentences(sents, include_cite=True) == [
+        [("1.1", "λόγος", "λόγος", "n-s---mn-"), ("1.1", "ἔλεγε", "λέγω", "v3siia---")],
+        [],
+        [("1.2", "·", "punct", "u--------")]]
+
+
+def test_compiled_table(morpheus_csv, tmp_path):
+    compiled = str(tmp_path / "morpheus.bin")
+    compile_morpheus_table(morpheus_csv, compiled)
+    lemmatizer = MorpheusLookupLemmatizer(compiled)
+    assert lemmatizer.lemmatize_word("λόγου", "n-s---mg-") == ("λόγου", "λόγος", "n-s---mg-")
+    assert lemmatizer.lemmatize_word("λόγου", "n-p---mg-")[1] == ""
+    assert lemmatizer.lemmatize_sentence([("ἔλεγε", "v3siia---"), ("λόγοι", "n-p---mn-")]) == [
+        ("ἔλεγε", "λέγω", "v3siia---"), ("λόγοι", "", "n-p---mn-")]
+    lemmatizer = MorpheusLookupLemmatizer(compiled, form_fallback=True)
+    assert lemmatizer.lemmatize_word("λόγου", "n-p---mg-")[1] == "λόγος"
+
+
+def test_lemma_cache(morpheus_csv):
+    lemmatizer = MorpheusLookupLemmatizer(morpheus_csv, cache_size=2)
+    lemmatizer.warm_cache({("λόγος", "n-s---mn-"): 10, ("ἔλεγε", "v3siia---"): 5, ("λόγου", "n-s---mg-"): 1})
+    assert lemmatizer.cache_info().size == 2
+    lemmatizer.lemmatize_word("λόγος", "n-s---mn-")
+    lemmatizer.lemmatize_word("λόγου", "n-s---mg-")
+    info = lemmatizer.cache_info()
+    assert (info.hits, info.misses, info.evictions) == (1, 1, 1)
+    other = MorpheusLookupLemmatizer(morpheus_csv)
+    assert other.cache_info().hits == 0
+
+
+def test_form_set(morpheus_csv, tmp_path):
+    from perseus_nlp_toolkit.lemmatize import MorpheusFormSet
+    compiled = str(tmp_path / "morpheus.bin")
+    compile_morpheus_table(morpheus_csv, compiled)
+    for form_set in (MorpheusFormSet(morpheus_csv), MorpheusFormSet(compiled)):
+        assert "λόγου" in form_set
+        assert "λόγου" in form_set  # NFD
+        assert "λόγον" not in form_set
+
+
+def test_default_table():
+    import inspect
+    import os
+    from perseus_nlp_toolkit import lemmatize
+
+    default = inspect.signature(MorpheusLookupLemmatizer).parameters["path_to_data"].default
+    assert default == lemmatize._DEFAULT_TABLE
+    assert os.path.isabs(default) and os.path.exists(default)
@@ -0,0 +1,75 @@
+import os
+import shutil
+import pytest
+from nltk.tokenize import WhitespaceTokenizer
+from perseus_nlp_toolkit import CapitainCorpusReader
+from perseus_nlp_toolkit.store import CorpusStore
+
+data = os.path.join(os.path.dirname(__file__), "data")
+poem = "tlg9999.tlg001.test-grc1.xml"
+
+
+@pytest.fixture
+def root(tmp_path):
+    root = tmp_path / "corpus"
+    root.mkdir()
+    shutil.copy(os.path.join(data, poem), str(root / poem))
+    return str(root)
+
+
+def test_store_roundtrip(root, tmp_path):
+    reader = CapitainCorpusReader(root, poem)
+    store = CorpusStore(str(tmp_path / "store"), reader)
+    assert store.update() == [poem]
+    assert store.corpus_cite_words() == reader.corpus_cite_words()
+    assert store.words(poem) == reader.words()
+
+    # a fresh store on the same directory finds everything up to date
+    assert CorpusStore(str(tmp_path / "store"), reader).update() == []
+
+
+def test_store_incremental(root, tmp_path):
+    store = CorpusStore(str(tmp_path / "store"), CapitainCorpusReader(root, poem))
+    store.update()
+
+    path = os.path.join(root, poem)
+    os.utime(path, (0, 0))
+    assert store.update() == []
+
+    with open(path, encoding="utf8") as f:
+        xml = f.read()
+    with open(path, "w", encoding="utf8") as f:
+        f.write(xml.replace("οὐλομένην", "ὀλομένην"))
+    assert store.update() == [poem]
+    assert ("1.2", "ὀλομένην") in store.cite_words(poem)
+
+    reader = CapitainCorpusReader(root, poem, word_tokenizer=WhitespaceTokenizer())
+    assert CorpusStore(str(tmp_path / "store"), reader).update() == [poem]
+
+
+def test_store_file_changed_while_tokenized(root, tmp_path, monkeypatch):
+    reader = CapitainCorpusReader(root, poem)
+    store = CorpusStore(str(tmp_path / "store"), reader)
+    tokenize = reader._file_cite_words
+
+    def edit_then_tokenize(fileid):
+        cite_words = tokenize(fileid)
+        os.utime(reader.abspath(fileid), (1, 1))
+        return cite_words
+
+    monkeypatch.setattr(reader, "_file_cite_words", edit_then_tokenize)
+    assert store.update() == []
+    assert store.stale() == [poem]
+    monkeypatch.undo()
+    assert store.update() == [poem]
+
+
+def test_store_fileid_encoding(root, tmp_path):
+    os.mkdir(os.path.join(root, "a"))
+    shutil.copy(os.path.join(data, poem), os.path.join(root, "a", poem))
+    os.rename(os.path.join(root, poem), os.path.join(root, "a__" + poem))
+    reader = CapitainCorpusReader(root, r".*\.xml")
+    store = CorpusStore(str(tmp_path / "store"), reader)
+    assert sorted(store.update()) == ["a/" + poem, "a__" + poem]
+    assert len(os.listdir(str(tmp_path / "store"))) == 3
+    assert store.words("a/" + poem) == store.words("a__" + poem) == reader.words("a/" + poem)
@@ -0,0 +1,133 @@
+import pytest
+from nltk.collocations import BigramCollocationFinder, TrigramCollocationFinder
+from nltk.metrics import BigramAssocMeasures, TrigramAssocMeasures
+from perseus_nlp_toolkit.text import CitableConcordanceIndex, PerseusPlainText, PerseusAnnotateText
+
+# (form, lemma, postag)
+tokens = [("ἔλεγε", "λέγω", "v3siia---"),
+          ("εἴποι", "λέγω", "v3saoa---"),
+          ("λόγον", "λόγος", "n-s---ma-"),
+          (",", ",", "u--------"),
+          ("λέξειε", "λέγω", "v3saoa---"),
+          ("εἴποι", "λέγω", "v3saoa---"),
+          ("λέγει", "λέγω", "v3spia---")]
+cites = ["1.{}".format(i // 3 + 1) for i in range(len(tokens))]
+
+
+@pytest.fixture
+def index():
+    return CitableConcordanceIndex(tokens, cites, lambda t: t[0], lemma_col=1, postag_col=2)
+
+
+def test_lookup_lemma_and_features(index):
+    assert index.lookup(lemma="λέγω").tolist() == [0, 1, 4, 5, 6]
+    assert index.lookup(lemma="λέγω", tense="aorist", mood="optative").tolist() == [1, 4, 5]
+    assert index.lookup(lemma="λέγω", postag="...ao....").tolist() == [1, 4, 5]
+    assert index.lookup("εἴποι", tense="a").tolist() == [1, 5]
+    assert index.lookup(lemma="λέγω", case="accusative").tolist() == []
+    with pytest.raises(ValueError):
+        index.lookup(tense="aoristic")
+
+
+def test_find_concordance_by_lemma(index):
+    lines = index.find_concordance(lemma="λέγω", mood="optative")
+    assert [(l.query, l.cite) for l in lines] == [("εἴποι", "1.1"), ("λέξειε", "1.2"), ("εἴποι", "1.2")]
+    assert [l.offset for l in index.find_concordance("εἴποι")] == [1, 5]
+
+
+def test_index_without_postings():
+    index = CitableConcordanceIndex([t[0] for t in tokens], cites)
+    with pytest.raises(ValueError):
+        index.lookup(lemma="λέγω")
+
+
+def test_find_concordances(index):
+    found = index.find_concordances(["εἴποι", "λόγον", "missing"])
+    assert [l.offset for l in found["εἴποι"]] == [1, 5]
+    assert found["λόγον"][0].left == ["ἔλεγε", "εἴποι"]
+    assert found["λόγον"][0].line == "ἔλεγε εἴποι λόγον , λέξειε εἴποι λέγει"
+    assert found["missing"] == []
+    words = index.vocabulary().match("*") + ["εἴποι"]
+    assert index.find_concordances(words, width=30) == {w: index.find_concordance(w, width=30) for w in words}
+
+
+def test_pattern_queries(index):
+    assert index.expand(pattern="λ*") == ["λέγει", "λέξειε", "λόγον"]
+    assert index.expand(pattern="*ποι") == ["εἴποι"]
+    assert index.expand(pattern="λ?γ*") == ["λέγει", "λόγον"]
+    assert index.expand(pattern="λ[έό]γ*") == ["λέγει", "λόγον"]
+    assert index.expand(pattern="λ[!ό]*") == ["λέγει", "λέξειε"]
+    assert index.expand(pattern="*[ιε]") == ["εἴποι", "λέγει", "λέξειε", "ἔλεγε"]
+    assert index.expand(pattern="λ[εο]γ*", normalize=True) == ["λέγει", "λόγον"]
+    assert index.expand(regex="ει$") == ["λέγει"]
+    assert index.expand(pattern="λεγ*", normalize=True) == ["λέγει"]
+    assert index.lookup(pattern="*ποι").tolist() == [1, 5]
+    assert index.lookup("ΕΙΠΟΙ", normalize=True).tolist() == [1, 5]
+    assert index.lookup(regex="^λ", tense="a").tolist() == [4]
+    assert [l.query for l in index.find_concordance(pattern="λ*")] == ["λόγον", "λέξειε", "λέγει"]
+
+
+def test_paginated_concordance(index, capsys):
+    assert index.count(lemma="λέγω") == 5
+    assert index.count("missing") == 0
+    page = list(index.iter_concordance(lemma="λέγω", offset=1, limit=2))
+    assert [l.offset for l in page] == [1, 4]
+    calls = []
+    query_offsets = index._query_offsets
+    index._query_offsets = lambda word, query: calls.append(word) or query_offsets(word, query)
+    index.print_concordance("εἴποι", lines=1, offset=1)
+    assert calls == ["εἴποι"]
+    out = capsys.readouterr().out.splitlines()
+    assert out[0] == "Displaying 1 of 2 matches (from match 2):"
+    assert out[1].endswith("(1.2)")
+
+
+def test_bigram_collocations():
+    words = "ὁ δὲ λόγος καὶ ὁ μῦθος καὶ ὁ λόγος δὲ καὶ ὁ λόγος".split()
+    text = PerseusPlainText([("1.{}".format(i), w) for i, w in enumerate(words)])
+    nltk_scores = dict(BigramCollocationFinder.from_words(words).score_ngrams(BigramAssocMeasures.pmi))
+    best = text.bigram_collocations(num=3, min_freq=1)
+    assert best[0].score == pytest.approx(max(nltk_scores.values()))
+    assert all(c.score == pytest.approx(nltk_scores[c.ngram]) for c in best)
+
+    found = {c.ngram: c for c in text.bigram_collocations(min_freq=2, ignore=["καὶ"])}
+    assert found[("ὁ", "λόγος")].freq == 2
+    assert found[("ὁ", "λόγος")].cites == ["1.7", "1.11"]
+    assert not any("καὶ" in ng for ng in found)
+
+
+@pytest.mark.parametrize("window_size", [3, 4])
+@pytest.mark.parametrize("measure", ["pmi", "likelihood_ratio", "raw_freq"])
+def test_trigram_collocations(window_size, measure):
+    words = "ὁ δὲ λόγος καὶ ὁ μῦθος καὶ ὁ λόγος δὲ καὶ ὁ λόγος ὁ δὲ μῦθος λόγος καὶ ὁ δὲ".split() * 3
+    text = PerseusPlainText([("1.{}".format(i), w) for i, w in enumerate(words)])
+    finder = TrigramCollocationFinder.from_words(words, window_size=window_size)
+    nltk_scores = dict(finder.score_ngrams(getattr(TrigramAssocMeasures, measure)))
+    found = text.trigram_collocations(num=len(nltk_scores), window_size=window_size, measure=measure, min_freq=1)
+    assert len(found) == len(nltk_scores)
+    assert all(c.score == pytest.approx(nltk_scores[c.ngram]) for c in found)
+
+
+def test_annotated_text(capsys):
+    text = PerseusAnnotateText([(c,) + t for c, t in zip(cites, tokens)], key="lemma")
+    assert text.concordance_list(lemma="λέγω", mood="optative")[0].query == "εἴποι"
+    text.concordance(lemma="λέγω", tense="aorist", lines=1)
+    assert capsys.readouterr().out.startswith("Displaying 1 of 3 matches")
+    best = text.bigram_collocations(min_freq=1, measure="raw_freq", ignore=lambda l: l == ",")
+    assert best[0].ngram == ("λέγω", "λέγω")
+    assert best[0].freq == 3
+    tri = text.trigram_collocations(min_freq=1, measure="likelihood_ratio")
+    assert tri[0].cites
+
+
+def test_repeated_token_trigrams():
+    import math
+    import warnings
+
+    text = PerseusAnnotateText([(c,) + t for c, t in zip(cites, tokens)], key="lemma")
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        tri = text.trigram_collocations(min_freq=1, measure="likelihood_ratio")
+    assert len(tri) == 4 and all(math.isfinite(c.score) for c in tri)
+    # its contingency table has a negative cell (NLTK raises on it): it cannot be scored
+    assert ("λέγω", "λέγω", "λέγω") not in [c.ngram for c in tri]
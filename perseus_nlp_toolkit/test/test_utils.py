@@ -0,0 +1,193 @@
+import numpy as np
+import pytest
+from perseus_nlp_toolkit import utils
+
+tags = ["v3saoa---", "n-s---mg-", "u--------", "t-prpemn-", None]
+
+
+def test_pack_postags():
+    packed = utils.pack_postags(tags)
+    assert packed.dtype == np.uint32
+    assert utils.unpack_postags(packed) == tags[:4] + ["?????????"]
+    assert utils.pack_postags(["---------"]).tolist() == [0]
+
+
+def test_postag_codes_and_mask():
+    codes = utils.postag_codes(tags)
+    assert codes["case"][1] == utils.POSTAG_ALPHABETS[7].index("g")
+    packed = utils.pack_postags(codes)
+    assert utils.postag_mask(packed, pos="verb").tolist() == [True, False, False, True, False]
+    assert utils.postag_mask(packed, tense="aorist", mood="o").tolist() == [True, False, False, False, False]
+    with pytest.raises(ValueError):
+        utils.postag_mask(packed, case="ablative")
+
+
+def test_postags_to_dataframe():
+    df = utils.postags_to_dataframe(tags)
+    assert df.loc[0].tolist() == [utils.Morph(tags[0]).full[f] for f in utils.POSTAG_FIELDS]
+    assert df.case[1] == "genitive"
+    assert df.pos.isna().tolist() == [False, False, False, False, True]
+
+
+@pytest.fixture
+def form_set(tmp_path):
+    from perseus_nlp_toolkit.lemmatize import MorpheusFormSet
+    p = tmp_path / "morpheus.csv"
+    p.write_text("Form,Tag,Lemma\nἐ,p-s---ma-,ἑ\nἀλλ',c--------,ἀλλά\n", encoding="utf8")
+    return MorpheusFormSet(str(p))
+
+
+def test_fix_bad_apostrophe_offline(form_set):
+    sents = [["ἀλλ̓", "ἐ"], ["δ̓", "ἐ"]]
+    fixed = utils.fix_bad_apostrophe_sents(sents, form_set=form_set)
+    assert fixed == [["ἀλλ'", "ἐ"], ["δ'", "ἐ"]]
+
+
+def test_fix_bad_apostrophe_remote(form_set, tmp_path, monkeypatch):
+    queried = []
+    monkeypatch.setattr(utils, "_is_morph_word", lambda w: queried.append(w) or w == "δ̓")
+    cache = str(tmp_path / "morph_words.json")
+    words = ["ἀλλ̓", "δ̓", "δ̓"]
+    assert utils.fix_bad_apostrophe_words(list(words), form_set, remote=True, cache_path=cache) == ["ἀλλ'", "δ̓", "δ̓"]
+    # each unknown word is queried once, and never again once it is in the disk cache
+    assert sorted(queried) == ["δ̓", "ἀλλ̓"]
+    utils.fix_bad_apostrophe_words(list(words), form_set, remote=True, cache_path=cache)
+    assert len(queried) == 2
+
+
+class FakeMateServer:
+    """
+    Stands in for the Popen of `MateServer`, over real pipes: every token line comes back with an extra
+    column, blank lines end the sentences and the <EOB> line is echoed
+    """
+
+    def __init__(self, *args, **kwargs):
+        import os
+        import threading
+
+        in_r, in_w = os.pipe()
+        out_r, out_w = os.pipe()
+        self.stdin, self.stdout = open(in_w, "wb"), open(out_r, "rb")
+        self._in, self._out = open(in_r, encoding="utf8"), open(out_w, "w", encoding="utf8")
+        self._thread = threading.Thread(target=self._serve, daemon=True)
+        self._thread.start()
+
+    def _serve(self):
+        for line in self._in:
+            line = line.rstrip("\n")
+            self._out.write(line + "\tTAG\n" if line and line != "<EOB>" else line + "\n")
+            if not line or line == "<EOB>":
+                self._out.flush()
+        self._out.close()
+
+    def poll(self):
+        return None if self._thread.is_alive() else 0
+
+    def wait(self):
+        self._thread.join()
+        return 0
+
+
+@pytest.fixture
+def fake_mate(monkeypatch):
+    import subprocess
+
+    compiled = []
+    monkeypatch.setattr(subprocess, "check_call", lambda cmd: compiled.append(cmd))
+    monkeypatch.setattr(utils, "java", FakeMateServer)
+    return compiled
+
+
+def test_mate_process(fake_mate, tmp_path):
+    import os
+
+    sents = ["1\tλόγος{}\t_\n".format(i) for i in range(5000)]
+    proc = utils.MateProcess(str(tmp_path), "is2.tag.Tagger", "model")
+    with proc:
+        assert fake_mate and os.path.isdir(proc._classdir)
+        out = list(proc.annotate(iter(sents[:3])))
+        assert out == ["1\tλόγος0\t_\tTAG\n", "1\tλόγος1\t_\tTAG\n", "1\tλόγος2\t_\tTAG\n"]
+        # stop early, with much more than a pipe buffer still to come: the next batch must not see it
+        for _ in proc.annotate(iter(sents)):
+            break
+        assert list(proc.annotate(["1\tἔπος\t_\n"])) == ["1\tἔπος\t_\tTAG\n"]
+
+        def failing():
+            yield from sents[:2]
+            raise ValueError("bad input")
+
+        out = []
+        with pytest.raises(ValueError, match="bad input"):
+            out.extend(proc.annotate(failing()))
+        assert out == ["1\tλόγος0\t_\tTAG\n", "1\tλόγος1\t_\tTAG\n"]
+        assert list(proc.annotate(["1\tἔπος\t_\n"])) == ["1\tἔπος\t_\tTAG\n"]
+        classdir = proc._classdir
+    assert not proc.running and not os.path.exists(classdir)
+
+
+def fake_mate_output(conll):
+    """What Mate writes for a CoNLL-2009 input: the empty sentences are dropped, each token is tagged"""
+    out = []
+    for block in conll.split("\n\n"):
+        rows = [l.split("\t") for l in block.split("\n") if l]
+        if rows:
+            out.append("".join("\t".join(r[:5] + ["T-" + r[1]] + r[6:]) + "\n" for r in rows))
+    return "\n".join(out)
+
+
+@pytest.fixture
+def tagger(monkeypatch):
+    from perseus_nlp_toolkit.tagger import MateMorphTagger
+
+    monkeypatch.setattr(utils, "config_java", lambda **kwargs: None)
+    tagger = MateMorphTagger("mate", "model")
+    tagger.calls = 0
+
+    def execute(java_class, infile, outfile):
+        tagger.calls += 1
+        with open(infile) as f, open(outfile, "w") as out:
+            out.write(fake_mate_output(f.read()))
+        return None, None
+
+    monkeypatch.setattr(tagger, "_execute", execute)
+    return tagger
+
+
+def test_conll09(tagger):
+    line = tagger._conll09_sentence([("λόγος", "λόγος", "n-s---mn-")], lemma_col=1, tag_col=2)
+    assert line.split("\t")[:7] == ["1", "λόγος", "λόγος", "_", "n", "_", "n|-|s|-|-|-|m|n|-"]
+    assert len(line.split("\t")) == 15 and line.endswith("\n")
+    blocks = list(tagger._iter_conll09([["ὁ", "λόγος"], ["καί"]]))
+    assert [b.count("\n") for b in blocks] == [3, 2]
+    assert blocks[0].split("\n")[1].split("\t")[:5] == ["2", "λόγος", "_", "_", "_"]
+
+
+def test_iter_tag_sents_chunks(tagger):
+    sents = [["ὁ", "λόγος"], [], ["καί"], ["ἔπος"], [], []]
+    tagged = list(tagger.iter_tag_sents(iter(sents), chunk_size=2))
+    # the last chunk is empty: Mate is not even started
+    assert tagger.calls == 2
+    assert tagged == [[("ὁ", "T-ὁ"), ("λόγος", "T-λόγος")], [], [("καί", "T-καί")], [("ἔπος", "T-ἔπος")], [], []]
+    assert tagger.tag_sents(sents) == tagged
+
+
+@pytest.mark.parametrize("workers", [2, 3, 10])
+def test_tag_sents_parallel(tagger, monkeypatch, workers):
+    import io
+
+    shards = []
+
+    def annotate_shard(shard, j_class, lemma_col, tag_col, java_options=None):
+        shards.append(shard)
+        conll = fake_mate_output("".join(tagger._iter_conll09(shard, lemma_col, tag_col)))
+        return list(tagger._read_conll(io.StringIO(conll)))
+
+    monkeypatch.setattr(tagger, "_annotate_shard", annotate_shard)
+    sents = [[], ["ὁ", "λόγος"], ["καί"], [], ["ἔπος", "τε"], ["μῦθος"], ["ἔργον"], []]
+    tagged = tagger.tag_sents(sents, workers=workers)
+    assert tagged == tagger.tag_sents(sents)
+    assert [len(s) for s in tagged] == [len(s) for s in sents]
+    # contiguous shards of the non-empty sentences, at most one per worker
+    assert len(shards) == min(workers, 5)
+    shards.sort(key=lambda shard: sents.index(shard[0]))
+    assert [s for shard in shards for s in shard] == [s for s in sents if s]
@@ -1,5 +1,13 @@
 from nltk.text import Text, ConcordanceIndex, BigramCollocationFinder
 from collections import namedtuple
+from itertools import islice
+import bisect
+import fnmatch
+import re
+import unicodedata
+import numpy as np
+
+from . import utils
 
 
 ConcordanceLine = namedtuple('ConcordanceLine',
@@ -7,54 +15,400 @@ ConcordanceLine = namedtuple('ConcordanceLine',
                               'left_print', 'right_print', 'line'])
 
 
+def strip_diacritics(s):
+    """Remove accents, breathings, iota subscripts and other combining marks (e.g. "λόγῳ" -> "λογω")"""
+    return unicodedata.normalize("NFC", "".join(c for c in unicodedata.normalize("NFD", s)
+                                                if not unicodedata.combining(c)))
+
+
+def normalize_key(s):
+    """Diacritic- and case-insensitive form of a key (final sigma is folded to σ)"""
+    return strip_diacritics(s).casefold()
+
+
+class SortedVocabulary:
+    """
+    The string keys of an index, sorted both as they are and reversed, so that prefix (`λογ*`) and
+    suffix (`*λογος`) patterns are resolved by binary search; the other wildcards and the regular expressions
+    are only matched against the keys in the range found by the longest literal prefix or suffix.
+    If `normalize` is given, the keys are searched through their normalized form (see `normalize_key`).
+    """
+
+    def __init__(self, keys, normalize=None):
+        self._normalize = normalize
+        pairs = sorted((normalize(k) if normalize else k, k) for k in keys)
+        self._texts = [t for t, _ in pairs]
+        self._keys = [k for _, k in pairs]
+        rpairs = sorted((t[::-1], k) for t, k in pairs)
+        self._rtexts = [t for t, _ in rpairs]
+        self._rkeys = [k for _, k in rpairs]
+
+    def __len__(self):
+        return len(self._keys)
+
+    @staticmethod
+    def _range(texts, keys, prefix):
+        lo = bisect.bisect_left(texts, prefix)
+        hi = bisect.bisect_left(texts, prefix + "\U0010ffff")
+        return zip(texts[lo:hi], keys[lo:hi])
+
+    def find(self, key):
+        """All the keys whose (normalized) text is `key`"""
+        key = self._normalize(key) if self._normalize else key
+        return [k for t, k in self._range(self._texts, self._keys, key) if t == key]
+
+    @staticmethod
+    def _literal_ends(pattern):
+        """
+        Literal prefix and suffix of a shell-style pattern, i.e. the text before the first and after the last
+        wildcard; a `[...]` set counts as a wildcard, an unclosed `[` as a literal (as in `fnmatch`).
+        The suffix is "" if the pattern has no wildcards.
+        """
+        parts, literal = [], []
+        i, n = 0, len(pattern)
+        while i < n:
+            c = pattern[i]
+            i += 1
+            if c == "[":
+                j = i
+                if j < n and pattern[j] == "!":
+                    j += 1
+                if j < n and pattern[j] == "]":
+                    j += 1
+                j = pattern.find("]", j)
+                if j < 0:
+                    literal.append(c)
+                    continue
+                i = j + 1
+            elif c not in "*?":
+                literal.append(c)
+                continue
+            parts.append("".join(literal))
+            literal = []
+        parts.append("".join(literal))
+        return parts[0], parts[-1] if len(parts) > 1 else ""
+
+    def match(self, pattern):
+        """
+        Keys matching a shell-style pattern: `*` matches any sequence of characters, `?` a single character
+        and `[...]` a set of characters (see `fnmatch`).
+        """
+        pattern = self._normalize(pattern) if self._normalize else pattern
+        prefix, suffix = self._literal_ends(pattern)
+        regex = re.compile(fnmatch.translate(pattern))
+        if len(suffix) > len(prefix):
+            candidates = ((t[::-1], k) for t, k in self._range(self._rtexts, self._rkeys, suffix[::-1]))
+        else:
+            candidates = self._range(self._texts, self._keys, prefix)
+        return sorted(k for t, k in candidates if regex.match(t))
+
+    def search(self, regex):
+        """Keys matching a regular expression anywhere (`re.search`); use ^ and $ to anchor it"""
+        flags = 0
+        if self._normalize:
+            regex, flags = strip_diacritics(regex), re.IGNORECASE
+        regex = re.compile(regex, flags)
+        return [k for t, k in zip(self._texts, self._keys) if regex.search(t)]
+
+
+def _build_postings(keys):
+    """Map each distinct key to the sorted array of the offsets where it occurs"""
+    uniq, inv = np.unique(keys, return_inverse=True)
+    inv = inv.ravel()
+    order = np.argsort(inv, kind="stable")
+    bounds = np.cumsum(np.bincount(inv, minlength=len(uniq)))[:-1]
+    return dict(zip(uniq.tolist(), np.split(order, bounds)))
+
+
 class CitableConcordanceIndex(ConcordanceIndex):
-    def __init__(self, tokens, cites, key= lambda x : x):
+    def __init__(self, tokens, cites, key= lambda x : x, lemma_col=None, postag_col=None):
+        """
+        Parameters
+        ----------
+        tokens : list
+            the tokens; either strings, or tuples whose first element is the form
+        cites : list
+            the citation of each token
+        key : callable
+            function that maps a token to the key used by `offsets` and `find_concordance` (default: the token)
+        lemma_col : int
+            position of the lemma in the token tuples; if set, the index can be queried by lemma
+        postag_col : int
+            position of the 9-character AGLDT postag in the token tuples; if set, the index can be queried
+            by morphological feature (see `lookup`)
+        """
         ConcordanceIndex.__init__(self, tokens, key)
         if len(tokens) != len(cites):
             raise ValueError("Tokens and citations do not seem to match")
-        self._cites = cites
 
-    def _get_form_tokens(self):
-        if all(isinstance(n, tuple) for n in self._tokens):
-            forms = [t[0] for t in self._tokens]
+        # forms and cites are interned once: each token is a pair of integer ids
+        if all(isinstance(n, tuple) for n in tokens):
+            forms = (t[0] for t in tokens)
         else:
-            forms = self._tokens
-        return forms
+            forms = tokens
+        self._form_vocab, self._form_ids = utils.intern_strings(forms, len(tokens))
+        self._cite_vocab, self._cite_ids = utils.intern_strings(cites, len(cites))
+        # object arrays of the distinct forms and cites, for vectorized lookups of the context windows
+        self._form_array = np.empty(len(self._form_vocab), dtype=object)
+        self._form_array[:] = self._form_vocab
+        self._cite_array = np.empty(len(self._cite_vocab), dtype=object)
+        self._cite_array[:] = self._cite_vocab
 
-    def offsets(self, word):
-        return self._offsets[word]
+        # secondary postings, queried by intersection (see lookup)
+        self._lemma_offsets = None
+        self._postag_offsets = None
+        if lemma_col is not None:
+            self._lemma_offsets = _build_postings(np.array([str(t[lemma_col]) for t in tokens], dtype=object))
+        if postag_col is not None:
+            tags = np.array([str(t[postag_col]).ljust(9, "-")[:9] for t in tokens], dtype="U9")
+            chars = tags.view("U1").reshape(-1, 9)
+            self._postag_offsets = [_build_postings(chars[:, i]) for i in range(9)]
+
+        # sorted vocabularies of the keys, built on the first pattern query
+        self._vocabularies = {}
 
-    def find_concordance(self, word, width=80):
+    def vocabulary(self, normalize=False):
         """
-        Find the concordance lines given the query word.
+        The sorted vocabulary of the (string) keys of the index, used by the pattern queries.
+
+        Parameters
+        ----------
+        normalize : bool
+            if True, the keys are searched in their diacritic- and case-insensitive form
+
+        Returns
+        -------
+        SortedVocabulary
         """
-        half_width = (width - len(word) - 2) // 2
-        context = width // 4  # approx number of words of context
+        if normalize not in self._vocabularies:
+            keys = [k for k in self._offsets if isinstance(k, str)]
+            self._vocabularies[normalize] = SortedVocabulary(keys, normalize_key if normalize else None)
+        return self._vocabularies[normalize]
+
+    def expand(self, pattern=None, regex=None, normalize=False):
+        """
+        The keys of the index that match a wildcard pattern or a regular expression.
+
+        Parameters
+        ----------
+        pattern : str
+            shell-style pattern, e.g. "λογ*", "*λογος" or "λ?γος"
+        regex : str
+            regular expression, matched anywhere in the key (e.g. "^λογ.*ος$")
+        normalize : bool
+            if True, match regardless of diacritics and case (e.g. "λογ*" also finds "λόγος" and "Λόγῳ")
 
-        # Find the instances of the word to create the ConcordanceLine
-        concordance_list = []
-        offsets = self.offsets(word)
-        forms = self._get_form_tokens()
-        if offsets:
-            for i in offsets:
-                query_word = forms[i]
-                # Find the context of query word.
-                left_context = forms[i - context:i]
-                right_context = forms[i + 1:i + context]
+        Returns
+        -------
+        list
+            the matching keys, sorted
+        """
+        vocabulary = self.vocabulary(normalize)
+        if pattern is not None:
+            return vocabulary.match(pattern)
+        if regex is not None:
+            return vocabulary.search(regex)
+        raise ValueError("Either a pattern or a regex is required")
+
+    def _keys_offsets(self, keys):
+        """The merged (sorted) offsets of several keys"""
+        found = [self._offsets[k] for k in keys if k in self._offsets]
+        if not found:
+            return np.empty(0, dtype=np.int64)
+        return np.sort(np.concatenate([np.array(o, dtype=np.int64) for o in found]))
+
+    def _feature_offsets(self, i, value):
+        """Offsets of the tokens whose i-th postag character is `value` (a code or a name, e.g. "a" or "aorist")"""
+        codes = utils.postag_values(utils.POSTAG_FIELDS[i], value)
+        found = [self._postag_offsets[i][c] for c in codes if c in self._postag_offsets[i]]
+        if not found:
+            return np.empty(0, dtype=np.int64)
+        return np.sort(np.concatenate(found)) if len(found) > 1 else found[0]
+
+    def lookup(self, word=None, lemma=None, postag=None, pattern=None, regex=None, normalize=False, **features):
+        """
+        Offsets of the tokens that match all the given criteria. Each criterion has its own postings,
+        and the result is the intersection of the postings (smallest first).
+
+        Parameters
+        ----------
+        word : str
+            the key of the token (see `key` in the constructor)
+        pattern : str
+            a wildcard pattern on the keys (see `expand`)
+        regex : str
+            a regular expression on the keys (see `expand`)
+        normalize : bool
+            if True, `word`, `pattern` and `regex` match regardless of diacritics and case
+        lemma : str
+            the lemma (requires `lemma_col`)
+        postag : str
+            a 9-character postag pattern, where "." matches any character (e.g. "v..ao....");
+            requires `postag_col`
+        features : str
+            postag fields by name (pos, person, number, tense, mood, voice, gender, case, degree),
+            with either the code or the name of the value, e.g. `tense="aorist", mood="o"`
+
+        Returns
+        -------
+        numpy.ndarray
+            sorted offsets
+
+        Examples
+        --------
+        >>> index = CitableConcordanceIndex(tokens, cites, lambda t: t[0], lemma_col=1, postag_col=2)
+        >>> index.lookup(lemma="λέγω", tense="aorist", mood="optative")
+        """
+        postings = []
+        if word is not None:
+            if normalize:
+                postings.append(self._keys_offsets(self.vocabulary(True).find(word)))
+            else:
+                postings.append(np.array(self._offsets.get(word, []), dtype=np.int64))
+        if pattern is not None:
+            postings.append(self._keys_offsets(self.expand(pattern=pattern, normalize=normalize)))
+        if regex is not None:
+            postings.append(self._keys_offsets(self.expand(regex=regex, normalize=normalize)))
+        if lemma is not None:
+            if self._lemma_offsets is None:
+                raise ValueError("The index was built without lemma_col")
+            postings.append(self._lemma_offsets.get(lemma, np.empty(0, dtype=np.int64)))
+        wanted = {}
+        if postag is not None:
+            wanted.update((i, c) for i, c in enumerate(postag) if c != ".")
+        for name, value in features.items():
+            if name not in utils.POSTAG_FIELDS:
+                raise TypeError("Unknown postag field: {}".format(name))
+            wanted[utils.POSTAG_FIELDS.index(name)] = value
+        if wanted:
+            if self._postag_offsets is None:
+                raise ValueError("The index was built without postag_col")
+            postings.extend(self._feature_offsets(i, value) for i, value in wanted.items())
+        if not postings:
+            raise ValueError("No query criteria")
+
+        postings.sort(key=len)
+        result = postings[0]
+        for p in postings[1:]:
+            if not len(result):
+                break
+            result = np.intersect1d(result, p, assume_unique=True)
+        return result
+
+    def _get_form_tokens(self):
+        vocab = self._form_vocab
+        return [vocab[i] for i in self._form_ids.tolist()]
+
+    def _concordance_lines(self, offsets, word, width, chunk_size=10000):
+        """
+        Generate the ConcordanceLine of each offset. The context windows of a chunk of hits are
+        looked up at once, as a (hits x window) array of form ids; chunks start small and grow up to
+        `chunk_size`, so that the first lines come out at once.
+        `word` is the query word of all the offsets or, if it is a list, the query word of each offset.
+        """
+        context = width // 4  # approx number of words of context
+        n = len(self._form_ids)
+        window = np.arange(-context, context)
+        words = word if isinstance(word, list) else None
+        start, size = 0, 32
+        while start < len(offsets):
+            chunk = np.asarray(offsets[start:start + size], dtype=np.int64)
+            chunk_words = words[start:start + size] if words is not None else [word] * len(chunk)
+            start, size = start + size, min(size * 4, chunk_size)
+            rows = self._form_array[self._form_ids[np.clip(chunk[:, None] + window, 0, n - 1)]].tolist()
+            cites = self._cite_array[self._cite_ids[chunk]].tolist()
+            for i, row, cite, word in zip(chunk.tolist(), rows, cites, chunk_words):
+                query_word = row[context]
+                half_width = (width - len(word if word is not None else query_word) - 2) // 2
+                # Find the context of query word (the window is clipped at the ends of the text)
+                left_context = row[max(0, context - i):context]
+                right_context = row[context + 1:min(2 * context, context + n - i)]
                 # Create the pretty lines with the query_word in the middle.
                 left_print = ' '.join(left_context)[-half_width:]
                 right_print = ' '.join(right_context)[:half_width]
-                # Find the cite
-                cite = self._cites[i]
                 # The WYSIWYG line of the concordance.
-                line_print = ' '.join([left_print, query_word, right_print]) #"{} ({})".format(, cite)
-                # Create the ConcordanceLine
-                concordance_line = ConcordanceLine(left_context, query_word, right_context, i, cite,
-                                                   left_print, right_print, line_print)
-                concordance_list.append(concordance_line)
-        return concordance_list
+                line_print = ' '.join([left_print, query_word, right_print])
+                yield ConcordanceLine(left_context, query_word, right_context, i, cite,
+                                      left_print, right_print, line_print)
+
+    def offsets(self, word):
+        return self._offsets[word]
+
+    def _query_offsets(self, word, query):
+        if query:
+            return self.lookup(word, **query)
+        return self._offsets.get(word, [])
+
+    def count(self, word=None, **query):
+        """
+        Number of matches of a query (see `lookup`), taken from the postings without building any line.
+        """
+        return len(self._query_offsets(word, query))
+
+    def iter_concordance(self, word=None, width=80, offset=0, limit=None, **query):
+        """
+        Generate the concordance lines of a query one page at a time: only the requested lines are built,
+        as they are consumed.
+
+        Parameters
+        ----------
+        word : str
+            The target word
+        width : int
+            The width of each line, in characters (default=80)
+        offset : int
+            Number of matches to skip (default=0)
+        limit : int
+            Maximum number of lines to generate (default=None, all the matches)
+        query : str
+            lemma, postag and pattern criteria (see `lookup`)
+
+        Returns
+        -------
+        generator
+            of ConcordanceLine
 
-    def print_concordance(self, word, include_cite=True, width=80, lines=25):
+        Examples
+        --------
+        >>> index.count("καί")
+        >>> page = list(index.iter_concordance("καί", offset=50, limit=25))  # matches 50 to 74
+        """
+        offsets = self._query_offsets(word, query)
+        end = None if limit is None else offset + limit
+        return self._concordance_lines(offsets[offset:end], word, width)
+
+    def find_concordance(self, word=None, width=80, **query):
+        """
+        Find the concordance lines given the query word. Lemma, postag and pattern criteria (see `lookup`)
+        can be given instead of, or together with, the word.
+        """
+        return list(self.iter_concordance(word, width=width, **query))
+
+    def find_concordances(self, words, width=80):
+        """
+        Find the concordance lines of several query words at once: the postings of all the words are
+        gathered first, and the lines of all the hits are built in the same chunks (see `_concordance_lines`),
+        instead of a separate pass for each word.
+
+        Parameters
+        ----------
+        words : iter
+            the query words (keys)
+        width : int
+            The width of each line, in characters (default=80)
+
+        Returns
+        -------
+        dict
+            word -> list of ConcordanceLine
+        """
+        words = list(words)
+        postings = [self._offsets.get(w, []) for w in words]
+        offsets = np.concatenate([np.asarray(p, dtype=np.int64) for p in postings] + [np.empty(0, dtype=np.int64)])
+        lines = self._concordance_lines(offsets, [w for w, p in zip(words, postings) for _ in range(len(p))], width)
+        return {w: list(islice(lines, len(p))) for w, p in zip(words, postings)}
+
+    def print_concordance(self, word=None, include_cite=True, width=80, lines=25, offset=0, **query):
         """
         Print concordance lines given the query word.
 
@@ -68,30 +422,377 @@ class CitableConcordanceIndex(ConcordanceIndex):
             The width of each line, in characters (default=80)
         lines : int
             The number of lines to display (default=25)
+        offset : int
+            The number of matches to skip, to display the next pages (default=0)
+        query : str
+            lemma, postag and pattern criteria (see `lookup`)
 
         Returns
         -------
         None
 
         """
-        concordance_list = self.find_concordance(word, width=80)
+        offsets = self._query_offsets(word, query)
+        total = len(offsets)
 
-        if not concordance_list:
+        if not total:
             print("no matches")
         else:
-            lines = min(lines, len(concordance_list))
-            print("Displaying {} of {} matches:".format(lines, len(concordance_list)))
-            for i, concordance_line in enumerate(concordance_list[:lines]):
+            lines = max(0, min(lines, total - offset))
+            if offset:
+                print("Displaying {} of {} matches (from match {}):".format(lines, total, offset + 1))
+            else:
+                print("Displaying {} of {} matches:".format(lines, total))
+            for concordance_line in self._concordance_lines(offsets[offset:offset + lines], word, width):
                 if include_cite:
                     print("{} ({})".format(concordance_line.line, concordance_line.cite))
                 else:
                     print(concordance_line.line)
 
 
+Collocation = namedtuple("Collocation", ["ngram", "freq", "score", "cites"])
+
+_SMALL = 1e-20
+
+
+def _likelihood_ratio(cont, n):
+    """
+    Log-likelihood ratio of a batch of contingency tables (Manning and Schütze 5.3.4), as computed
+    by `nltk.metrics.association`; `cont` has one row per cell (in NLTK's order) and one column per ngram.
+    Tables with a negative cell, on which NLTK raises a math domain error, score NaN.
+    """
+    total = cont.sum(axis=0)
+    bits = [1 << j for j in range(n)]
+    score = np.zeros(cont.shape[1])
+    for i in range(len(cont)):
+        expected = np.ones(cont.shape[1])
+        for j in bits:
+            expected *= cont[[x for x in range(len(cont)) if (x & j) == (i & j)]].sum(axis=0)
+        expected /= total ** (n - 1)
+        with np.errstate(invalid="ignore"):
+            score += cont[i] * np.log(cont[i] / (expected + _SMALL) + _SMALL)
+    return 2 * score
+
+
+class CitableCollocationFinder:
+    """
+    Bigram and trigram collocations of an integer-coded token stream. Co-occurrences are counted with NumPy:
+    every ngram found within the window is encoded as a single integer, and the codes are counted with
+    `numpy.unique`. Each collocation comes with the citations of its first occurrences.
+
+    Scores follow `nltk.metrics.association`: "pmi" (pointwise mutual information), "likelihood_ratio"
+    (log-likelihood) or "raw_freq"; the ngrams whose contingency table has a negative cell (on which NLTK
+    raises an error) have no likelihood ratio and are left out. The counts are those of NLTK's collocation finders: bigram counts are
+    scaled by 1 / (window_size - 1); for trigrams, every token is counted once for each (w2, w3) combination
+    of its window, so that the unigram counts and N are scaled by (window_size - 1)(window_size - 2) / 2,
+    and the pair marginals (w1, w2) and (w1, w3) are weighted by the number of such combinations they appear in.
+    """
+
+    MEASURES = ("pmi", "likelihood_ratio", "raw_freq")
+
+    def __init__(self, ids, vocab, cite_ids, cite_vocab):
+        """
+        Parameters
+        ----------
+        ids : numpy.ndarray
+            the id of each token
+        vocab : list
+            the string of each id
+        cite_ids : numpy.ndarray
+            the id of the citation of each token
+        cite_vocab : list
+            the string of each citation id
+        """
+        self._ids = np.asarray(ids, dtype=np.int64)
+        self._vocab = vocab
+        self._cite_ids = cite_ids
+        self._cite_vocab = cite_vocab
+        self.N = len(self._ids)
+        self.word_fd = np.bincount(self._ids, minlength=len(vocab))
+        self._pairs = {}
+        self._distance_pairs = {}
+
+    def _mask(self, ignore):
+        """Boolean array over the vocabulary: True for the words to leave out"""
+        mask = np.zeros(len(self._vocab), dtype=bool)
+        if ignore is None:
+            return mask
+        if callable(ignore):
+            mask[:] = [bool(ignore(w)) for w in self._vocab]
+        else:
+            ignore = set(ignore)
+            mask[:] = [w in ignore for w in self._vocab]
+        return mask
+
+    def _window_pairs(self, window_size):
+        """Codes (w1 * V + w2) and positions of all the pairs within the window, with their distinct codes and counts"""
+        if window_size not in self._pairs:
+            V = len(self._vocab)
+            codes, positions = [], []
+            for d in range(1, window_size):
+                codes.append(self._ids[:-d] * V + self._ids[d:])
+                positions.append(np.arange(self.N - d))
+            codes = np.concatenate(codes) if codes else np.empty(0, dtype=np.int64)
+            positions = np.concatenate(positions) if positions else np.empty(0, dtype=np.int64)
+            uniq, counts = np.unique(codes, return_counts=True)
+            self._pairs[window_size] = (codes, positions, uniq, counts)
+        return self._pairs[window_size]
+
+    def _pair_counts(self, weights, a, b):
+        """
+        Counts of the pairs (a, b) found at each distance d, summed with weight `weights[d]`
+        """
+        V = len(self._vocab)
+        keys = a * V + b
+        total = np.zeros(len(keys))
+        for d, weight in weights.items():
+            if d not in self._distance_pairs:
+                self._distance_pairs[d] = np.unique(self._ids[:self.N - d] * V + self._ids[d:], return_counts=True)
+            uniq, counts = self._distance_pairs[d]
+            if not len(uniq):
+                continue
+            i = np.minimum(np.searchsorted(uniq, keys), len(uniq) - 1)
+            total += weight * np.where(uniq[i] == keys, counts[i], 0)
+        return total
+
+    def _examples(self, codes, positions, code, examples):
+        pos = np.sort(positions[codes == code])[:examples]
+        return [self._cite_vocab[c] for c in self._cite_ids[pos].tolist()]
+
+    def _rank(self, ngrams, freq, score, num):
+        # the ngrams that cannot be scored (NaN likelihood ratio) are left out
+        order = np.flatnonzero(np.isfinite(score))
+        order = order[np.lexsort((-freq[order], -score[order]))][:num]
+        return ngrams[order], freq[order], score[order], order
+
+    def bigrams(self, num=20, window_size=2, measure="pmi", min_freq=2, ignore=None, examples=3):
+        """
+        Best scoring bigrams; the two words may be up to `window_size - 1` tokens apart.
+
+        Parameters
+        ----------
+        num : int
+            number of collocations to return
+        window_size : int
+            size of the window in which the words are counted as co-occurring (2 = adjacent words)
+        measure : str
+            "pmi", "likelihood_ratio" or "raw_freq"
+        min_freq : int
+            minimum number of co-occurrences
+        ignore : iter or callable
+            words (or a predicate on words) that cannot be part of a collocation, e.g. punctuation
+        examples : int
+            number of citations returned for each collocation
+
+        Returns
+        -------
+        list(Collocation)
+        """
+        if measure not in self.MEASURES:
+            raise ValueError("Unknown measure: {}".format(measure))
+        if window_size < 2:
+            raise ValueError("Specify window_size at least 2")
+        V = len(self._vocab)
+        codes, positions, uniq, counts = self._window_pairs(window_size)
+        a, b = uniq // V, uniq % V
+        mask = self._mask(ignore)
+        keep = (counts >= min_freq) & ~mask[a] & ~mask[b]
+        uniq, a, b, freq = uniq[keep], a[keep], b[keep], counts[keep]
+
+        n_ii = freq / (window_size - 1.0)
+        n_ix, n_xi = self.word_fd[a].astype(float), self.word_fd[b].astype(float)
+        if measure == "pmi":
+            score = np.log2(n_ii * self.N) - np.log2(n_ix * n_xi)
+        elif measure == "likelihood_ratio":
+            cont = np.array([n_ii, n_xi - n_ii, n_ix - n_ii, self.N - n_ix - n_xi + n_ii])
+            score = _likelihood_ratio(cont, 2)
+        else:
+            score = n_ii / self.N
+
+        ngrams, freq, score, order = self._rank(np.stack([a, b], axis=1), freq, score, num)
+        return [Collocation(tuple(self._vocab[w] for w in ng), int(f), float(sc),
+                            self._examples(codes, positions, code, examples))
+                for ng, f, sc, code in zip(ngrams.tolist(), freq, score, uniq[order])]
+
+    def trigrams(self, num=20, window_size=3, measure="pmi", min_freq=2, ignore=None, examples=3):
+        """
+        Best scoring trigrams (w1, w2, w3), with the three words in order within `window_size` tokens.
+        Parameters and return value as in `bigrams`.
+        """
+        if measure not in self.MEASURES:
+            raise ValueError("Unknown measure: {}".format(measure))
+        if window_size < 3:
+            raise ValueError("Specify window_size at least 3")
+        V = len(self._vocab)
+        ids = self._ids
+        codes, positions = [], []
+        # a trigram is encoded in two steps (pair id, then pair id * V + w3), so that the codes never overflow
+        pair_codes, pair_ids = np.unique(np.concatenate(
+            [ids[:-d2] * V + ids[d1:self.N - d2 + d1]
+             for d1 in range(1, window_size - 1) for d2 in range(d1 + 1, window_size)]), return_inverse=True)
+        pair_ids = pair_ids.ravel()
+        start = 0
+        for d1 in range(1, window_size - 1):
+            for d2 in range(d1 + 1, window_size):
+                n = self.N - d2
+                codes.append(pair_ids[start:start + n] * V + ids[d2:])
+                positions.append(np.arange(n))
+                start += n
+        codes, positions = np.concatenate(codes), np.concatenate(positions)
+        uniq, counts = np.unique(codes, return_counts=True)
+
+        pairs, c = uniq // V, uniq % V
+        a, b = pair_codes[pairs] // V, pair_codes[pairs] % V
+        mask = self._mask(ignore)
+        keep = (counts >= min_freq) & ~mask[a] & ~mask[b] & ~mask[c]
+        uniq, a, b, c, freq = uniq[keep], a[keep], b[keep], c[keep], counts[keep]
+
+        # NLTK counts each token once for every (w2, w3) combination in the rest of its window; (w1, w2) is
+        # counted for every w3 after w2, and (w1, w3) for every w2 between them
+        combinations = (window_size - 1) * (window_size - 2) // 2
+        n_all = float(self.N * combinations)
+        n_iii = freq.astype(float)
+        n_ixx, n_xix, n_xxi = (combinations * self.word_fd[w].astype(float) for w in (a, b, c))
+        if measure == "pmi":
+            score = np.log2(n_iii * n_all ** 2) - np.log2(n_ixx * n_xix * n_xxi)
+        elif measure == "likelihood_ratio":
+            bigram_weights = {d: window_size - 1 - d for d in range(1, window_size - 1)}
+            wildcard_weights = {d: d - 1 for d in range(2, window_size)}
+            n_iix = self._pair_counts(bigram_weights, a, b)
+            n_ixi = self._pair_counts(wildcard_weights, a, c)
+            n_xii = self._pair_counts(bigram_weights, b, c)
+            n_oii = n_xii - n_iii
+            n_ioi = n_ixi - n_iii
+            n_iio = n_iix - n_iii
+            n_ooi = n_xxi - n_iii - n_oii - n_ioi
+            n_oio = n_xix - n_iii - n_oii - n_iio
+            n_ioo = n_ixx - n_iii - n_ioi - n_iio
+            n_ooo = n_all - n_iii - n_oii - n_ioi - n_iio - n_ooi - n_oio - n_ioo
+            cont = np.array([n_iii, n_oii, n_ioi, n_ooi, n_iio, n_oio, n_ioo, n_ooo])
+            score = _likelihood_ratio(cont, 3)
+        else:
+            score = n_iii / n_all
+
+        ngrams, freq, score, order = self._rank(np.stack([a, b, c], axis=1), freq, score, num)
+        return [Collocation(tuple(self._vocab[w] for w in ng), int(f), float(sc),
+                            self._examples(codes, positions, code, examples))
+                for ng, f, sc, code in zip(ngrams.tolist(), freq, score, uniq[order])]
+
+
+def _split_cites(cite_tokens):
+    """(cite, token) or (text_id, cite, token) -> cites, tokens; text ids are prefixed to the cites"""
+    cites, tokens = [], []
+    for t in cite_tokens:
+        cites.append(t[0] if len(t) == 2 else "{}:{}".format(t[0], t[1]))
+        tokens.append(t[-1])
+    return cites, tokens
+
+
 class PerseusPlainText(Text):
-    def __init__(self):
-        pass
+    """
+    A `nltk.text.Text` whose tokens keep their citations. Concordances print the cite of each line,
+    and collocations come with the cites of their first occurrences.
+
+    Examples
+    --------
+    >>> text = PerseusPlainText(reader.cite_words("tlg0012.tlg001.perseus-grc1.xml"), name="Iliad")
+    >>> text.concordance("μῆνιν")
+    >>> text.bigram_collocations(measure="likelihood_ratio", ignore=string.punctuation + "·")
+    """
+
+    def __init__(self, cite_words, name=None):
+        """
+        Parameters
+        ----------
+        cite_words : iter
+            the tokens, as (cite, token) (see `CapitainCorpusReader.cite_words`) or (text_id, cite, token)
+            (see `CapitainCorpusReader.corpus_cite_words`)
+        name : str
+            the name of the text
+        """
+        cites, tokens = _split_cites(cite_words)
+        Text.__init__(self, tokens, name)
+        self._cites = cites
+        self._citable_index = None
+        self._finder = None
+
+    def _index_tokens(self):
+        return self.tokens, {}
+
+    def citable_index(self):
+        """The `CitableConcordanceIndex` of the text (built on first use)"""
+        if self._citable_index is None:
+            tokens, kwargs = self._index_tokens()
+            self._citable_index = CitableConcordanceIndex(tokens, self._cites, **kwargs)
+        return self._citable_index
+
+    def concordance(self, word=None, width=80, lines=25, include_cite=True, **query):
+        """Print the concordance lines of a word, with their citations (see `CitableConcordanceIndex.print_concordance`)"""
+        self.citable_index().print_concordance(word, include_cite=include_cite, width=width, lines=lines, **query)
+
+    def concordance_list(self, word=None, width=80, lines=25, **query):
+        """The first concordance lines of a word, as a list of `ConcordanceLine`"""
+        return list(self.citable_index().iter_concordance(word, width=width, limit=lines, **query))
+
+    def _collocation_keys(self):
+        return self.tokens
+
+    def collocation_finder(self):
+        """The `CitableCollocationFinder` of the text (built on first use)"""
+        if self._finder is None:
+            vocab, ids = utils.intern_strings(self._collocation_keys(), len(self.tokens))
+            cite_vocab, cite_ids = utils.intern_strings(self._cites, len(self._cites))
+            self._finder = CitableCollocationFinder(ids, vocab, cite_ids, cite_vocab)
+        return self._finder
+
+    def bigram_collocations(self, num=20, window_size=2, measure="pmi", min_freq=2, ignore=None, examples=3):
+        """Best scoring bigrams, with example citations (see `CitableCollocationFinder.bigrams`)"""
+        return self.collocation_finder().bigrams(num, window_size, measure, min_freq, ignore, examples)
+
+    def trigram_collocations(self, num=20, window_size=3, measure="pmi", min_freq=2, ignore=None, examples=3):
+        """Best scoring trigrams, with example citations (see `CitableCollocationFinder.trigrams`)"""
+        return self.collocation_finder().trigrams(num, window_size, measure, min_freq, ignore, examples)
+
+
+class PerseusAnnotateText(PerseusPlainText):
+    """
+    A citable text of tagged and lemmatized tokens, as produced by
+    `MorpheusLookupLemmatizer.lemmatize_sentences(..., include_cite=True)`. Concordances can be queried
+    by lemma and morphological features, and collocations can be counted on lemmata instead of forms.
+
+    Examples
+    --------
+    >>> text = PerseusAnnotateText([t for s in lemmatized_sents for t in s], key="lemma")
+    >>> text.concordance(lemma="λέγω", tense="aorist")
+    >>> text.bigram_collocations(ignore=lambda l: l == "punct")
+    """
+
+    def __init__(self, annotated_words, name=None, key="form"):
+        """
+        Parameters
+        ----------
+        annotated_words : iter
+            the tokens, as (cite, form, lemma, postag)
+        name : str
+            the name of the text
+        key : str
+            "form" or "lemma": the unit counted by the collocation finder
+        """
+        if key not in ("form", "lemma"):
+            raise ValueError("key must be 'form' or 'lemma'")
+        annotated_words = list(annotated_words)
+        PerseusPlainText.__init__(self, [(t[0], t[1]) for t in annotated_words], name)
+        self._annotations = [tuple(t[1:4]) for t in annotated_words]
+        self._key = key
+
+    def lemmas(self):
+        return [t[1] for t in self._annotations]
+
+    def postags(self):
+        return [t[2] for t in self._annotations]
 
+    def _index_tokens(self):
+        return self._annotations, {"key": lambda t: t[0], "lemma_col": 1, "postag_col": 2}
 
-class PerseusAnnotateText(Text):
-    pass
\ No newline at end of file
+    def _collocation_keys(self):
+        return self.lemmas() if self._key == "lemma" else self.tokens
@@ -1,32 +1,274 @@
-from collections import namedtuple
+from collections import namedtuple, OrderedDict
 from requests import get
 import re
 import functools
 from nltk.internals import java, config_java
+import io
 import os
 import tempfile
+import threading
 from subprocess import PIPE
 
+
+class MateProcess:
+    """
+    A long-running Mate JVM that keeps one tool (tagger, lemmatizer, parser) and its model in memory.
+    Sentences are sent to the process on stdin and read back from stdout in CoNLL-2009 format,
+    so that the JVM startup and the model load are paid only once per session.
+
+    The Java side is the small wrapper in `lib/mate/MateServer.java`; it is compiled against the
+    Mate jar (in a temporary folder, removed by `close`) the first time the process is started,
+    so the persistent mode needs a JDK (`javac`), not only a Java runtime.
+    """
+
+    END_OF_BATCH = "<EOB>"
+    _source = os.path.join(os.path.dirname(os.path.abspath(__file__)), "lib", "mate", "MateServer.java")
+
+    def __init__(self, mate_folder, java_class, path_to_model, classpath="anna-3.61.jar"):
+        self._mate_root = mate_folder
+        self._java_class = java_class
+        self._model = path_to_model
+        self._classpath = classpath
+        self._classdir = None
+        self._proc = None
+        self._stdin = None
+        self._stdout = None
+        self._stderr = None
+
+    def _compile(self):
+        """Compile MateServer.java in a temporary folder; javac is looked up next to the java binary"""
+        import subprocess
+        from nltk import internals
+
+        self._classdir = tempfile.mkdtemp(prefix="mate_server_")
+        java_bin = internals._java_bin if isinstance(internals._java_bin, str) else "java"
+        javac = os.path.join(os.path.dirname(java_bin), "javac") if os.path.dirname(java_bin) else "javac"
+        classpath = os.path.join(os.path.abspath(self._mate_root), self._classpath)
+        try:
+            subprocess.check_call([javac, "-cp", classpath, "-d", self._classdir, self._source])
+        except (OSError, subprocess.CalledProcessError) as e:
+            self._remove_classdir()
+            raise OSError("Could not compile {} with {}: the persistent Mate process needs a JDK "
+                          "({})".format(self._source, javac, e))
+
+    def _remove_classdir(self):
+        import shutil
+
+        if self._classdir is not None:
+            shutil.rmtree(self._classdir, ignore_errors=True)
+            self._classdir = None
+
+    def start(self):
+        if self._proc is not None:
+            return
+        if self._classdir is None:
+            self._compile()
+        self._stderr = tempfile.TemporaryFile()
+        cmd = ["MateServer", self._java_class, "-model", self._model]
+        cwd = os.getcwd()
+        os.chdir(self._mate_root)
+        try:
+            self._proc = java(cmd, classpath=os.pathsep.join([self._classpath, self._classdir]),
+                              stdin=PIPE, stdout=PIPE, stderr=self._stderr, blocking=False)
+        finally:
+            os.chdir(cwd)
+        # the pipes may be opened in text or binary mode depending on the NLTK version
+        self._stdin = io.TextIOWrapper(getattr(self._proc.stdin, "buffer", self._proc.stdin), encoding="utf8")
+        self._stdout = io.TextIOWrapper(getattr(self._proc.stdout, "buffer", self._proc.stdout), encoding="utf8")
+
+    @property
+    def running(self):
+        return self._proc is not None and self._proc.poll() is None
+
+    def _error(self):
+        self._stderr.seek(0)
+        err = self._stderr.read().decode("utf8", errors="replace")
+        return RuntimeError("The Mate process ({}) stopped unexpectedly:\n{}".format(self._java_class, err))
+
+    def annotate(self, conll_sents):
+        """
+        Send sentences to the process and yield them back annotated, in the same order.
+
+        Parameters
+        ----------
+        conll_sents : iter
+            CoNLL-2009 sentences, each one as a string of lines ending with a newline (no blank line).
+            The iterable is consumed lazily, as the process reads its input.
+
+        Returns
+        -------
+        generator : the annotated sentences, in the same format. If `conll_sents` raises, the sentences
+            sent before the error are generated, then the error is raised again
+        """
+        self.start()
+        error = []
+
+        def feed():
+            # write from another thread, so that neither side can block on a full pipe
+            try:
+                for s in conll_sents:
+                    try:
+                        self._stdin.write(s + "\n")
+                    except UnicodeError:
+                        raise
+                    except (BrokenPipeError, ValueError):
+                        # the process is gone: the reader reports it
+                        return
+            except BaseException as e:
+                error.append(e)
+            # the batch is always closed, so that the reader does not wait forever
+            try:
+                self._stdin.write(self.END_OF_BATCH + "\n")
+                self._stdin.flush()
+            except (BrokenPipeError, ValueError):
+                pass
+
+        feeder = threading.Thread(target=feed, daemon=True)
+        feeder.start()
+        lines = []
+        done = False
+        try:
+            while True:
+                line = self._stdout.readline()
+                if not line:
+                    raise self._error()
+                line = line.rstrip("\n")
+                if line == self.END_OF_BATCH:
+                    done = True
+                    break
+                if line:
+                    lines.append(line + "\n")
+                else:
+                    yield "".join(lines)
+                    lines = []
+        finally:
+            # if the caller stopped early, drain the rest of the batch to keep the process in sync
+            while not done and self.running:
+                line = self._stdout.readline()
+                done = not line or line.rstrip("\n") == self.END_OF_BATCH
+            feeder.join()
+        if error:
+            raise error[0]
+
+    def close(self):
+        if self._proc is not None:
+            try:
+                self._stdin.close()
+            except (BrokenPipeError, OSError):
+                pass
+            self._proc.wait()
+            self._proc = None
+        if self._stderr is not None:
+            self._stderr.close()
+            self._stderr = None
+        self._remove_classdir()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+
 class MateCaller:
-    def __init__(self, mate_folder, path_to_model, java_options="-Xmx3G"):
+    def __init__(self, mate_folder, path_to_model, java_options="-Xmx3G", persistent=False):
+        """
+        Parameters
+        ----------
+        mate_folder : str
+            the folder with the Mate jar (`anna-3.61.jar`)
+        path_to_model : str
+            the Mate model
+        java_options : str
+            options for the JVM
+        persistent : bool
+            if True, keep one Mate process per tool alive for the whole session (see `MateProcess`)
+            instead of starting a new JVM for each call. Call `close` (or use the object as a
+            context manager) to stop the processes.
+        """
         self._java_options = java_options
         self._mate_root = mate_folder
         self._model = path_to_model
         self._classpath = "anna-3.61.jar"
+        self._persistent = persistent
+        self._processes = {}
 
         # Configure java.
         config_java(options=self._java_options)
 
+    def _get_process(self, java_class):
+        """Return the running Mate process for java_class, starting it if needed"""
+        proc = self._processes.get(java_class)
+        if proc is None or not proc.running:
+            proc = MateProcess(self._mate_root, java_class, self._model, self._classpath)
+            proc.start()
+            self._processes[java_class] = proc
+        return proc
+
+    def close(self):
+        """Stop the persistent Mate processes, if any"""
+        for proc in self._processes.values():
+            proc.close()
+        self._processes = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
     def _execute(self, java_class, infile, outfile):
+        if self._persistent:
+            return self._execute_persistent(java_class, infile, outfile)
         cwd = os.getcwd()
         os.chdir(self._mate_root)
-        os.chdir(self._mate_root)
         cmd = [java_class, "-model", self._model, "-test", infile, "-out", outfile]
         stdout, stderr = java(cmd, classpath=self._classpath, stdout=PIPE, stderr=PIPE)
         os.chdir(cwd)
 
         return stdout, stderr
 
+    def _execute_persistent(self, java_class, infile, outfile):
+        """Same as `_execute`, but with the persistent process. Returns (None, None): there is no output to collect"""
+        with open(infile) as f, open(outfile, "w") as out:
+            for s in self._get_process(java_class).annotate(self._read_conll(f)):
+                out.write(s + "\n")
+        return None, None
+
+    @staticmethod
+    def _read_conll(stream):
+        """Read a CoNLL file one sentence at a time; generate each sentence as a block of lines"""
+        from nltk.corpus.reader.util import read_blankline_block
+
+        while True:
+            block = read_blankline_block(stream)
+            if not block:
+                break
+            yield from block
+
+    def _conll09_sentence(self, s, lemma_col=None, tag_col=None):
+        """Transforms one sentence (a list of tokens) into conll09-like lines (see `_to_conll09`)"""
+        lemma = '_'
+        postag = '_'
+        lines = []
+        for idx, w in enumerate(s, start=1):
+            if isinstance(w, str):
+                w = (w,)
+            if lemma_col:
+                lemma = w[int(lemma_col)]
+            if tag_col:
+                _t = w[int(tag_col)]
+                postag = "".join([l+'|' for l in _t]).rstrip("|")
+            # ID FORM LEMMA PLEMMA POS PPOS FEAT PFEAT HEAD PHEAD DEPREL PDEPREL FILLPRED PRED APREDs
+            lines.append(f"{idx}\t{w[0]}\t{lemma}\t_\t{postag[0]}\t_\t{postag}\t_\t_\t_\t_\t_\t_\t_\t_\n")
+        return "".join(lines)
+
+    def _iter_conll09(self, sentences, lemma_col=None, tag_col=None):
+        """Generate the conll09-like representation of the sentences (see `_to_conll09`), one sentence at a time"""
+        for s in sentences:
+            yield self._conll09_sentence(s, lemma_col, tag_col) + "\n"
+
     def _to_conll09(self, sentences, lemma_col=None, tag_col=None):
         """Transforms sentence list (each sentence a list of tokens) into a conll09-like tabular file.
 
@@ -40,58 +282,156 @@ class MateCaller:
         -------
         str : a conll09-like tabular representation of the sentences
         """
-        Token = namedtuple('Token', ['form', 'lemma', 'pos'])
-        lemma = '_'
-        postag = '_'
-        txt = ''
-        for s in sentences:
-            for idx,w in enumerate(s, start=1):
-                if isinstance(w, str):
-                    w = (w,)
-                if lemma_col:
-                    lemma = w[int(lemma_col)]
-                if tag_col:
-                    _t = w[int(lemma_col)]
-                    postag = "".join([l+'|' for l in _t]).rstrip("|")
-                t = Token(w[0], lemma, postag)
-                # ID FORM LEMMA PLEMMA POS PPOS FEAT PFEAT HEAD PHEAD DEPREL PDEPREL FILLPRED PRED APREDs
-                txt += f"{idx}\t{t.form}\t{t.lemma}\t_\t{t.pos[0]}\t_\t{t.pos}\t_\t_\t_\t_\t_\t_\t_\t_\n"
-            txt += "\n"
-        return txt
+        return "".join(self._iter_conll09(sentences, lemma_col, tag_col))
+
+    def _conll2tagged_sent(self, conll_sent):
+        return [(l.split("\t")[1], l.split("\t")[5]) for l in conll_sent.rstrip().split("\n") if l]
 
     def _conll2tagged(self, conll_sents):
+        return [self._conll2tagged_sent(s) for s in conll_sents]
 
-        tagged_sents = []
-        for s in conll_sents:
-            sent = [(l.split("\t")[1], l.split("\t")[5]) for l in s.rstrip().split("\n")]
-            tagged_sents.append(sent)
-        return tagged_sents
+    def _iter_annotate_sents(self, sents, j_class, lemma_col, tag_col, chunk_size=1000):
+        """
+        Streaming version of `_annotate_sents`. The sentences are sent to Mate in chunks of `chunk_size`
+        and the annotated sentences are generated as soon as each chunk comes back, so that memory
+        does not grow with the size of the corpus. Without a persistent process, each chunk starts a new JVM.
 
-    def _annotate_sents(self, sents, j_class, lemma_col, tag_col, outfile=None):
-        from nltk.corpus.reader.util import read_blankline_block
+        Mate skips empty sentences: they are not sent, and are put back in the output (as empty blocks),
+        so that the output stays aligned with the input.
 
-        input_txt = self._to_conll09(sents, lemma_col, tag_col)
+        Parameters
+        ----------
+        sents : iter
+            the sentences; any iterable (e.g. a generator) is consumed one chunk at a time
+        j_class : str
+            the Mate class to run
+        lemma_col : int
+            index of the lemma in the tokens (or None)
+        tag_col : int
+            index of the tag in the tokens (or None)
+        chunk_size : int
+            number of sentences per chunk; None to send everything in one chunk
 
+        Returns
+        -------
+        generator : the annotated sentences, as conll09 blocks
+        """
+        from itertools import islice
+
+        sents = iter(sents)
+        while True:
+            chunk = list(islice(sents, chunk_size)) if chunk_size else list(sents)
+            if not chunk:
+                break
+            full = [s for s in chunk if len(s) > 0]
+            if not full:
+                yield from self._realign(chunk, [])
+            elif self._persistent:
+                proc = self._get_process(j_class)
+                annotated = proc.annotate(self._conll09_sentence(s, lemma_col, tag_col) for s in full)
+                yield from self._realign(chunk, annotated)
+            else:
+                with tempfile.NamedTemporaryFile(mode='w+', delete=True) as input_file, \
+                        tempfile.NamedTemporaryFile(mode='w+', delete=True) as output_file:
+                    input_file.writelines(self._iter_conll09(full, lemma_col, tag_col))
+                    input_file.flush()
+                    del full
+                    stdout, stderr = self._execute(j_class, input_file.name, output_file.name)
+                    output_file.seek(0)
+                    yield from self._realign(chunk, self._read_conll(output_file))
+            if not chunk_size:
+                break
+
+    @staticmethod
+    def _realign(sents, annotated):
+        """Put the empty sentences back among the annotated ones (which are those of the non-empty sentences)"""
+        annotated = iter(annotated)
+        for s in sents:
+            if len(s) == 0:
+                yield ""
+                continue
+            c = next(annotated, None)
+            if c is None:
+                raise RuntimeError("Mate returned fewer sentences than it was sent")
+            yield c
+        if next(annotated, None) is not None:
+            raise RuntimeError("Mate returned more sentences than it was sent")
+
+    def _execute_worker(self, java_class, infile, outfile, java_options=None):
+        """
+        Same as `_execute`, but safe to run from several threads at once: the JVM is started in the
+        Mate folder (instead of changing the working directory of the whole process) and it takes
+        its own options (e.g. its own -Xmx), instead of those configured globally in NLTK.
+        """
+        import subprocess
+        from nltk import internals
+
+        java_bin = internals._java_bin if isinstance(internals._java_bin, str) else "java"
+        options = (java_options or self._java_options).split()
+        cmd = [java_bin] + options + ["-cp", self._classpath,
+                                      java_class, "-model", self._model, "-test", infile, "-out", outfile]
+        p = subprocess.run(cmd, cwd=self._mate_root, stdout=PIPE, stderr=PIPE)
+        if p.returncode != 0:
+            raise OSError("Mate failed ({}):\n{}".format(java_class, p.stderr.decode("utf8", errors="replace")))
+        return p.stdout, p.stderr
+
+    def _annotate_shard(self, shard, j_class, lemma_col, tag_col, java_options=None):
         with tempfile.NamedTemporaryFile(mode='w+', delete=True) as input_file, \
                 tempfile.NamedTemporaryFile(mode='w+', delete=True) as output_file:
-
-            # prepare the input file
-            input_file.writelines(input_txt)
+            input_file.writelines(self._iter_conll09(shard, lemma_col, tag_col))
             input_file.flush()
-            stdout, stderr = self._execute(j_class, input_file.name, output_file.name)
-
+            self._execute_worker(j_class, input_file.name, output_file.name, java_options)
             output_file.seek(0)
+            return list(self._read_conll(output_file))
 
-            conll = []
-            while True:
-                block = read_blankline_block(output_file)
-                if block:
-                    conll.extend(block)
-                else:
-                    break
+    def _annotate_sents_parallel(self, sents, j_class, lemma_col, tag_col, workers, worker_java_options=None):
+        """
+        Split the sentences in `workers` contiguous shards and annotate them with as many Mate processes
+        running side by side. The results are reassembled in the original order.
+
+        Mate skips empty sentences: they are left out of the shards and put back in the output
+        (as empty blocks), so that the output stays aligned with the input.
+
+        Parameters
+        ----------
+        workers : int
+            number of Mate processes
+        worker_java_options : str
+            JVM options of each process (e.g. "-Xmx2G"); if None, the options of the caller are used
+
+        Returns
+        -------
+        list : the annotated sentences, as conll09 blocks
+        """
+        from concurrent.futures import ThreadPoolExecutor
+
+        sents = list(sents)
+        full = [i for i, s in enumerate(sents) if len(s) > 0]
+        size = -(-len(full) // workers) if full else 1
+        shards = [[sents[i] for i in full[b:b + size]] for b in range(0, len(full), size)]
+
+        # the JVMs do the work: threads are enough to drive them
+        with ThreadPoolExecutor(max_workers=workers) as ex:
+            results = ex.map(lambda shard: self._annotate_shard(shard, j_class, lemma_col, tag_col,
+                                                                worker_java_options), shards)
+            annotated = [c for r in results for c in r]
+
+        if len(annotated) != len(full):
+            raise RuntimeError("Mate returned {} sentences instead of {}".format(len(annotated), len(full)))
+        conll = [""] * len(sents)
+        for i, c in zip(full, annotated):
+            conll[i] = c
+        return conll
+
+    def _annotate_sents(self, sents, j_class, lemma_col, tag_col, outfile=None, workers=1,
+                        worker_java_options=None):
+        if workers > 1:
+            conll = self._annotate_sents_parallel(sents, j_class, lemma_col, tag_col, workers, worker_java_options)
+        else:
+            conll = list(self._iter_annotate_sents(sents, j_class, lemma_col, tag_col, chunk_size=None))
         if outfile:
             with open(outfile, 'w') as out:
-                "\n".join(conll)
+                out.write("\n".join(conll))
         return conll
 
     def lemmatize(self, infile, outfile):
@@ -121,10 +461,230 @@ gender = reverse_dict({'neuter': 'n', 'masculine': 'm', 'feminine': 'f', '-': '-
 case = reverse_dict({'accusative': 'a', 'nominative': 'n', 'vocative': 'v', '-': '-', 'dative': 'd', 'genitive': 'g'})
 degree = reverse_dict({'superl': 's', '-': '-', 'comp': 'c'})
 
+# the fields of the 9-character AGLDT postag, in order
+POSTAG_FIELDS = ["pos", "person", "number", "tense", "mood", "voice", "gender", "case", "degree"]
+_POSTAG_DICTS = [pos, person, number, tense, mood, voice, gender, case, degree]
+
+# Integer coding of the postags. In each field, "-" is coded 0 and the other letters follow in alphabetical order;
+# any other character (or a missing one, in tags shorter than 9) gets the last code of the field.
+# The packed form stores the nine codes in the bits of a uint32, the first field in the highest bits.
+POSTAG_ALPHABETS = [["-"] + sorted(k for k in d if k != "-") for d in _POSTAG_DICTS]
+_POSTAG_BITS = [len(a).bit_length() for a in POSTAG_ALPHABETS]
+_POSTAG_SHIFTS = [sum(_POSTAG_BITS[i + 1:]) for i in range(9)]
+
+
+def _postag_lookup_table():
+    import numpy as np
+
+    lut = np.empty((9, 128), dtype=np.uint8)
+    for i, alphabet in enumerate(POSTAG_ALPHABETS):
+        lut[i] = len(alphabet)
+        for code, letter in enumerate(alphabet):
+            lut[i, ord(letter)] = code
+    return lut
+
+
+def postag_values(field, value):
+    """
+    The postag letters of a field that match a value, given either as a letter or as a name
+    (e.g. `postag_values("tense", "aorist") == ["a"]`; some names, like "verb", have more than one letter).
+
+    Raises
+    ------
+    ValueError
+        if the value is neither a letter nor a known name
+    """
+    d = _POSTAG_DICTS[POSTAG_FIELDS.index(field)]
+    if len(value) == 1:
+        return [value]
+    letters = [k for k, name in d.items() if name == value]
+    if not letters:
+        raise ValueError("Unknown value for {}: {}".format(field, value))
+    return letters
+
+
+def postag_codes(postags):
+    """
+    Decode a sequence of postags, in one vectorized pass, into a structured array with one `uint8` column
+    of codes per field (see `POSTAG_ALPHABETS` for the meaning of the codes).
+
+    Parameters
+    ----------
+    postags : iter
+        9-character AGLDT postags
+
+    Returns
+    -------
+    numpy.ndarray
+        structured array with fields `POSTAG_FIELDS`
+
+    Examples
+    --------
+    >>> codes = postag_codes(tags)
+    >>> genitives = codes["case"] == POSTAG_ALPHABETS[7].index("g")
+    """
+    import numpy as np
+
+    tags = np.asarray([t or "" for t in postags], dtype="U9")
+    chars = tags.view(np.uint32).reshape(-1, 9)
+    chars = np.where(chars < 128, chars, 0)
+    lut = _postag_lookup_table()
+    out = np.empty(len(tags), dtype=[(f, np.uint8) for f in POSTAG_FIELDS])
+    for i, f in enumerate(POSTAG_FIELDS):
+        out[f] = lut[i][chars[:, i]]
+    return out
+
+
+def pack_postags(postags):
+    """
+    Encode a sequence of postags as `uint32` integers (9 fields in 29 bits); see `unpack_postags`.
+
+    Parameters
+    ----------
+    postags : iter
+        9-character AGLDT postags, or a structured array returned by `postag_codes`
+
+    Returns
+    -------
+    numpy.ndarray
+    """
+    import numpy as np
+
+    codes = postags if getattr(postags, "dtype", None) is not None and postags.dtype.names else postag_codes(postags)
+    packed = np.zeros(len(codes), dtype=np.uint32)
+    for f, shift in zip(POSTAG_FIELDS, _POSTAG_SHIFTS):
+        packed |= codes[f].astype(np.uint32) << np.uint32(shift)
+    return packed
+
+
+def _unpack_field(packed, i):
+    import numpy as np
+
+    return (packed >> np.uint32(_POSTAG_SHIFTS[i])) & np.uint32((1 << _POSTAG_BITS[i]) - 1)
+
+
+def unpack_postags(packed):
+    """
+    Decode packed postags back to strings; unknown characters come back as "?"
+
+    Returns
+    -------
+    list(str)
+    """
+    import numpy as np
+
+    packed = np.asarray(packed, dtype=np.uint32)
+    chars = np.empty((len(packed), 9), dtype="U1")
+    for i, alphabet in enumerate(POSTAG_ALPHABETS):
+        chars[:, i] = np.array(alphabet + ["?"])[_unpack_field(packed, i)]
+    return chars.view("U9").ravel().tolist()
+
+
+def postag_mask(packed, **features):
+    """
+    Vectorized filter of packed postags by feature.
+
+    Parameters
+    ----------
+    packed : numpy.ndarray
+        postags packed with `pack_postags`
+    features : str
+        fields by name, with either the letter or the name of the value (see `postag_values`)
+
+    Returns
+    -------
+    numpy.ndarray
+        boolean mask
+
+    Examples
+    --------
+    >>> packed = pack_postags(tags)
+    >>> aor_opt = postag_mask(packed, tense="aorist", mood="optative")
+    """
+    import numpy as np
+
+    packed = np.asarray(packed, dtype=np.uint32)
+    mask = np.ones(len(packed), dtype=bool)
+    for field, value in features.items():
+        if field not in POSTAG_FIELDS:
+            raise TypeError("Unknown postag field: {}".format(field))
+        i = POSTAG_FIELDS.index(field)
+        alphabet = POSTAG_ALPHABETS[i]
+        codes = [alphabet.index(v) for v in postag_values(field, value) if v in alphabet]
+        mask &= np.isin(_unpack_field(packed, i), codes)
+    return mask
+
+
+def postags_to_dataframe(postags):
+    """
+    Decode a sequence of postags into a pandas DataFrame with one categorical column per field,
+    holding the names of the values (e.g. "genitive"); unknown characters are NaN.
+
+    Parameters
+    ----------
+    postags : iter
+        9-character AGLDT postags
+
+    Returns
+    -------
+    pandas.DataFrame
+    """
+    import numpy as np
+    import pandas as pd
+
+    codes = postag_codes(postags)
+    columns = {}
+    for i, (f, d) in enumerate(zip(POSTAG_FIELDS, _POSTAG_DICTS)):
+        names = list(OrderedDict.fromkeys(d[letter] for letter in POSTAG_ALPHABETS[i]))
+        # code -> category; the unknown code maps to -1 (NaN)
+        to_name = np.array([names.index(d[letter]) for letter in POSTAG_ALPHABETS[i]] + [-1])
+        columns[f] = pd.Categorical.from_codes(to_name[codes[f]], categories=names)
+    return pd.DataFrame(columns)
+
+
+# Universal Dependencies equivalents of the AGLDT postags (used for the CoNLL-U export)
+_UPOS = {'n': 'NOUN', 'v': 'VERB', 't': 'VERB', 'a': 'ADJ', 'd': 'ADV', 'g': 'PART', 'l': 'DET', 'p': 'PRON',
+         'm': 'NUM', 'c': 'CCONJ', 'r': 'ADP', 'i': 'INTJ', 'e': 'INTJ', 'u': 'PUNCT', 'x': 'X'}
+_UD_FEATS = [
+    {'1': 'Person=1', '2': 'Person=2', '3': 'Person=3'},
+    {'s': 'Number=Sing', 'p': 'Number=Plur', 'd': 'Number=Dual'},
+    {'p': 'Tense=Pres', 'i': 'Aspect=Imp|Tense=Past', 'a': 'Aspect=Perf|Tense=Past', 'r': 'Aspect=Perf|Tense=Pres',
+     'l': 'Aspect=Perf|Tense=Pqp', 'f': 'Tense=Fut', 't': 'Aspect=Perf|Tense=Fut'},
+    {'i': 'Mood=Ind|VerbForm=Fin', 's': 'Mood=Sub|VerbForm=Fin', 'o': 'Mood=Opt|VerbForm=Fin',
+     'm': 'Mood=Imp|VerbForm=Fin', 'n': 'VerbForm=Inf', 'p': 'VerbForm=Part'},
+    {'a': 'Voice=Act', 'm': 'Voice=Mid', 'p': 'Voice=Pass', 'e': 'Voice=Mid,Pass'},
+    {'m': 'Gender=Masc', 'f': 'Gender=Fem', 'n': 'Gender=Neut'},
+    {'n': 'Case=Nom', 'g': 'Case=Gen', 'd': 'Case=Dat', 'a': 'Case=Acc', 'v': 'Case=Voc'},
+    {'c': 'Degree=Cmp', 's': 'Degree=Sup'},
+]
+
+
+@functools.lru_cache(maxsize=4096)
+def postag_to_ud(postag):
+    """
+    Convert an AGLDT postag to the Universal Dependencies part of speech and features.
+
+    Parameters
+    ----------
+    postag : str
+        9-character AGLDT postag
+
+    Returns
+    -------
+    tuple : (str, str)
+        UPOS ("X" if unknown) and FEATS, sorted by name ("_" if empty)
+    """
+    postag = postag or ""
+    upos = _UPOS.get(postag[:1], 'X')
+    feats = [f for d, letter in zip(_UD_FEATS, postag[1:]) if letter in d for f in d[letter].split("|")]
+    return upos, "|".join(sorted(feats)) or "_"
+
 
 Sentence = namedtuple("Sentence", ["id", "document_id", "subdoc"])
+CacheInfo = namedtuple("CacheInfo", ["hits", "misses", "evictions", "size", "maxsize", "bytes", "maxbytes"])
 Word = namedtuple("Word", ['id', 'form', 'lemma', 'postag', 'head', 'relation', 'cite'])
 Artificial = namedtuple("Artificial", ['id', 'form', 'lemma', 'postag', 'head', 'relation', 'cite', 'type'])
+HeadCycle = namedtuple("HeadCycle", ["sentence", "id", "cite", "cycle"])
 
 class Morph():
     def __init__(self, tag):
@@ -144,6 +704,180 @@ class Morph():
         return {'pos': self.pos, 'person': self.person, 'number': self.number, 'tense': self.tense, 'mood': self.mood,
                 'voice': self.voice, 'gender': self.gender, 'case': self.case, 'degree': self.degree, }
 
+
+def _sizeof(obj):
+    """Approximate memory footprint of an object: shallow size, plus that of the items of tuples"""
+    import sys
+
+    size = sys.getsizeof(obj)
+    if isinstance(obj, tuple):
+        size += sum(sys.getsizeof(o) for o in obj)
+    return size
+
+
+class LRUCache:
+    """
+    A bounded mapping that evicts the least recently used entries. It can be bounded by number of entries,
+    by (approximate) memory footprint in bytes, or both. Unlike `functools.lru_cache`, it belongs to the
+    object that creates it, and it keeps count of hits, misses and evictions (see `info`).
+    """
+
+    def __init__(self, maxsize=None, maxbytes=None, sizeof=_sizeof):
+        """
+        Parameters
+        ----------
+        maxsize : int
+            maximum number of entries (None for no limit)
+        maxbytes : int
+            maximum approximate size of keys and values, in bytes (None for no limit)
+        sizeof : callable
+            function used to measure keys and values when `maxbytes` is set
+        """
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        self._sizeof = sizeof
+        self._data = OrderedDict()
+        self._bytes = 0
+        self.hits = self.misses = self.evictions = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def get(self, key, default=None):
+        """Return the value stored for key (and mark it as recently used), or default"""
+        try:
+            value = self._data[key]
+        except KeyError:
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        if key in self._data:
+            self.pop(key)
+        if self.maxsize == 0:
+            return
+        self._data[key] = value
+        if self.maxbytes is not None:
+            self._bytes += self._entry_size(key, value)
+        while self._data and ((self.maxsize is not None and len(self._data) > self.maxsize) or
+                              (self.maxbytes is not None and self._bytes > self.maxbytes)):
+            self.pop(next(iter(self._data)))
+            self.evictions += 1
+
+    def pop(self, key, default=None):
+        if key not in self._data:
+            return default
+        value = self._data.pop(key)
+        if self.maxbytes is not None:
+            self._bytes -= self._entry_size(key, value)
+        return value
+
+    def clear(self):
+        self._data.clear()
+        self._bytes = 0
+
+    def _entry_size(self, key, value):
+        return self._sizeof(key) + self._sizeof(value)
+
+    def info(self):
+        """
+        Returns
+        -------
+        CacheInfo : hits, misses, evictions, current size (entries and bytes) and limits
+        """
+        nbytes = self._bytes if self.maxbytes is not None else None
+        return CacheInfo(self.hits, self.misses, self.evictions, len(self._data), self.maxsize,
+                         nbytes, self.maxbytes)
+
+
+def pack_strings(strings):
+    """
+    Intern a sequence of strings into a single utf-8 blob plus an array of offsets.
+    The i-th string is `blob[offsets[i]:offsets[i + 1]]`.
+
+    Parameters
+    ----------
+    strings : iter
+        the strings to pack
+
+    Returns
+    -------
+    tuple : (bytes, numpy.ndarray)
+        the blob and the `uint64` offsets (one more than the strings)
+    """
+    import numpy as np
+
+    encoded = [s.encode("utf8") for s in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.uint64)
+    np.cumsum([len(b) for b in encoded], out=offsets[1:])
+    return b"".join(encoded), offsets
+
+
+def intern_strings(strings, count=-1):
+    """
+    Intern a sequence of strings: return the distinct strings, in order of first occurrence,
+    and the integer id of each string of the sequence.
+
+    Parameters
+    ----------
+    strings : iter
+        the strings
+    count : int
+        the length of the sequence, if known (it saves a copy when `strings` is a generator)
+
+    Returns
+    -------
+    tuple : (list, numpy.ndarray)
+        the distinct strings and the `uint32` ids
+    """
+    import numpy as np
+
+    ids = {}
+    codes = np.fromiter((ids.setdefault(s, len(ids)) for s in strings), dtype=np.uint32, count=count)
+    return list(ids), codes
+
+
+class StringTable:
+    """
+    Read-only sequence view over strings packed with `pack_strings`. The blob can be any buffer
+    (bytes, mmap, memoryview), so that the table can live in a memory-mapped file.
+    Items are returned as utf-8 `bytes`; if the strings were packed in sorted order,
+    the table can be searched with `bisect` using encoded keys.
+    """
+
+    def __init__(self, blob, offsets):
+        self._blob = memoryview(blob)
+        self._offsets = offsets
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("string table index out of range")
+        return bytes(self._blob[int(self._offsets[i]):int(self._offsets[i + 1])])
+
+    def string(self, i):
+        return self[i].decode("utf8")
+
+    def index(self, s):
+        """Binary search for `s` in a sorted table; raises KeyError if it is not there"""
+        import bisect
+
+        key = s.encode("utf8")
+        i = bisect.bisect_left(self, key)
+        if i == len(self) or self[i] != key:
+            raise KeyError(s)
+        return i
+
 @functools.lru_cache(maxsize=512)
 def _is_morph_word(word):
     u = 'http://morph.perseids.org/analysis/word?lang=grc&engine=morpheusgrc&word={}'.format(word)
@@ -156,19 +890,96 @@ def _is_morph_word(word):
     return isw
 
 
-
-def fix_bad_apostrophe_words(words):
+def _remote_morph_words(words, cache_path=None, workers=8):
+    """
+    Check words with the Morpheus web service. The queries are sent in parallel, and their answers are kept
+    in a JSON file (if `cache_path` is given) so that no word is ever queried twice.
+
+    Returns
+    -------
+    dict
+        word -> bool
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    import json
+
+    cache = {}
+    if cache_path is not None and os.path.exists(cache_path):
+        with open(cache_path, encoding="utf8") as f:
+            cache = json.load(f)
+    todo = sorted(set(words) - set(cache))
+    if todo:
+        with ThreadPoolExecutor(max_workers=workers) as ex:
+            cache.update(zip(todo, ex.map(_is_morph_word, todo)))
+        if cache_path is not None:
+            tmp = cache_path + ".tmp"
+            with open(tmp, "w", encoding="utf8") as f:
+                json.dump(cache, f, ensure_ascii=False)
+            os.replace(tmp, cache_path)
+    return {w: cache[w] for w in words}
+
+
+def _valid_morph_words(words, form_set=None, remote=False, cache_path=None):
+    """The words that Morpheus knows: checked offline against the form set, and online (if `remote`) when not found"""
+    if form_set is None:
+        from .lemmatize import default_form_set
+        form_set = default_form_set()
+    valid = {w for w in words if w in form_set}
+    unknown = set(words) - valid
+    if remote and unknown:
+        valid.update(w for w, ok in _remote_morph_words(unknown, cache_path).items() if ok)
+    return valid
+
+
+def _bad_apostrophe_candidates(words):
+    return {w.replace("\u02bc", "'") for w in words if w and w[-1] == "\u0313"}
+
+
+def _fix_words(words, valid):
     reg = re.compile("\u0313$")
 
     for i, w in enumerate(words):
         w = w.replace("\u02bc", "'")
-        if w[-1] == "\u0313":
-            if _is_morph_word(w) == False:
+        if w and w[-1] == "\u0313":
+            if w not in valid:
                 words[i] = reg.sub("'", w)
     return words
 
-def fix_bad_apostrophe_sents(sents):
+
+def fix_bad_apostrophe_words(words, form_set=None, remote=False, cache_path=None):
+    """
+    Replace the final U+0313 (combining comma above) of elided words with an apostrophe, unless
+    the word is a valid Morpheus form. The words are modified in place.
+
+    Parameters
+    ----------
+    words : list(str)
+        the tokens
+    form_set : MorpheusFormSet
+        the forms known to Morpheus (default: the bundled Morpheus table, see `lemmatize.default_form_set`)
+    remote : bool
+        if True, the words that are not in the form set are also looked up in the Morpheus web service
+    cache_path : str
+        JSON file where the answers of the web service are kept between sessions
+
+    Returns
+    -------
+    list(str)
+    """
+    valid = _valid_morph_words(_bad_apostrophe_candidates(words), form_set, remote, cache_path)
+    return _fix_words(words, valid)
+
+def fix_bad_apostrophe_sents(sents, form_set=None, remote=False, cache_path=None):
+    """
+    Same as `fix_bad_apostrophe_words`, for a list of sentences. The distinct candidate words of all
+    the sentences are checked in one batch, so a generator of sentences is read into a list first.
+    """
+    sents = list(sents)
+    candidates = set()
+    for s in sents:
+        candidates |= _bad_apostrophe_candidates(s)
+    valid = _valid_morph_words(candidates, form_set, remote, cache_path)
     for s in sents:
-        s = fix_bad_apostrophe_words(s)
+        s = _fix_words(s, valid)
 
     return sents